@@ -8,18 +8,166 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _parse_limits(value: str) -> dict[str, int]:
+    """تحويل نص مثل "instagram:2,tiktok:3" إلى قاموس {المنصة: الحد}"""
+    limits = {}
+    for item in (value or "").split(","):
+        if ":" in item:
+            name, limit = item.split(":", 1)
+            limits[name.strip().lower()] = int(limit)
+    return limits
+
+
 # ===== إعدادات البوت الأساسية =====
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # سيتم قراءته من متغيرات البيئة في المنصة السحابية
+# معرّفات المشرفين المسموح لهم بأمر /stats، مفصولة بفواصل (فارغ = الأمر معطل)
+ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if i}
+STATS_LOG_INTERVAL = int(os.getenv("STATS_LOG_INTERVAL", "300"))  # فترة تسجيل الإحصائيات في السجل بالثواني (0 = تعطيل)
+
+# ===== خادم Bot API محلي (اختياري) =====
+# عنوان خادم telegram-bot-api مستضاف ذاتياً مثل http://localhost:8081 (فارغ = الخادم العام).
+# يجب تنفيذ logOut مرة واحدة على الخادم العام قبل نقل البوت إليه.
+BOT_API_URL = os.getenv("BOT_API_URL", "").rstrip("/")
+# الوضع المحلي (--local): الملفات تُرسل بمسارها على القرص ويرتفع حد الحجم إلى 2000MB.
+# "auto" = فحص الخادم عند البدء بإرسال ملف صغير بمساره إلى BOT_API_PROBE_CHAT_ID (أو محادثة
+# التجهيز أو أول مشرف)؛ عند فشل الفحص تُستخدم حدود الخادم العام ورفع المحتوى.
+# true/false يفرضان الوضع بدون فحص. يجب أن يرى الخادم DOWNLOAD_PATH بنفس المسار المطلق
+_bot_api_local_mode = os.getenv("BOT_API_LOCAL_MODE", "auto").lower()
+if not BOT_API_URL:
+    BOT_API_LOCAL_MODE = "false"
+elif _bot_api_local_mode == "auto":
+    BOT_API_LOCAL_MODE = "auto"
+else:
+    BOT_API_LOCAL_MODE = "true" if _bot_api_local_mode in ("1", "true", "yes") else "false"
+BOT_API_PROBE_CHAT_ID = int(os.getenv("BOT_API_PROBE_CHAT_ID", "0")) or None
+
+# ===== وضع Webhook (بديل Polling) =====
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")                     # الرابط العام مثل https://bot.example.com (فارغ = Polling)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")                    # عنوان الاستماع المحلي
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))   # منفذ الاستماع (PORT في المنصات السحابية)
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "telegram").lstrip("/")     # مسار استقبال التحديثات
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")                           # الرمز السري (فارغ = مشتق من التوكن)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # أقصى اتصالات متزامنة من تلغرام (1-100)
+WEBHOOK_READY_PATH = "/" + os.getenv("WEBHOOK_READY_PATH", "ready").lstrip("/")  # مسار فحص الجاهزية
+# تسجيل الـ Webhook لدى تلغرام عند البدء (يُتخطى إذا كان مسجلاً بنفس الإعدادات).
+# مع عدة نسخ: اجعله true في نسخة واحدة فقط (أو خطوة النشر) وfalse في البقية
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "true").lower() in ("1", "true", "yes")
 
 # ===== إعدادات التحميل =====
 DOWNLOAD_PATH = os.getenv("DOWNLOAD_PATH", "./downloads")
-MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))  # الحد الأقصى لحجم الملف بالميجابايت
-MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+# الحد الأقصى لحجم الملف بالميجابايت لكل وضع (50 للخادم العام، 2000 للخادم المحلي).
+# الحد الفعلي يُحدد عند البدء حسب وضع الخادم (utils.bot_api)؛ MAX_FILE_SIZE_MB يفرض حداً واحداً للوضعين
+PUBLIC_MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
+LOCAL_MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "2000"))
+# ===== إدارة مساحة القرص =====
+# الحد الأقصى لاستخدام مجلد التحميل (يكفي افتراضياً لعدة ملفات بأكبر حجم ممكن)
+_max_possible_file_mb = LOCAL_MAX_FILE_SIZE_MB if BOT_API_LOCAL_MODE != "false" else PUBLIC_MAX_FILE_SIZE_MB
+DISK_BUDGET_MB = int(os.getenv("DISK_BUDGET_MB", str(max(2048, _max_possible_file_mb * 3))))
+DISK_MIN_FREE_MB = int(os.getenv("DISK_MIN_FREE_MB", "200"))              # مساحة حرة يجب إبقاؤها على القرص
+DISK_ADMISSION_TIMEOUT = int(os.getenv("DISK_ADMISSION_TIMEOUT", "60"))   # مدة انتظار توفر المساحة قبل رفض المهمة
+CAROUSEL_ITEM_ESTIMATE_MB = int(os.getenv("CAROUSEL_ITEM_ESTIMATE_MB", "30"))  # حجز عنصر المنشور المتعدد مجهول الحجم
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", "600"))              # فترة تشغيل منظف الملفات اليتيمة
+JANITOR_MAX_AGE = int(os.getenv("JANITOR_MAX_AGE", "3600"))               # عمر المجلد المؤقت اليتيم قبل حذفه
+# الفيديو الأكبر من حد الإرسال يُقسّم إلى أجزاء؛ هذا أقصى عدد أجزاء (0 = بدون تقسيم).
+# أقصى حجم فيديو يُحمَّل محدود أيضاً بثلث الميزانية (المسارات + الملف المدمج ثم الأجزاء)
+SPLIT_MAX_PARTS = int(os.getenv("SPLIT_MAX_PARTS", "8"))
+# معرّف قناة/محادثة خاصة يرفع إليها البوت عناصر المنشورات المتعددة مسبقاً للحصول على file_id
+# ثم يرسلها كألبوم واحد. فارغ = يُرسل كل عنصر للمستخدم مباشرة فور تحميله كرسالة منفصلة
+UPLOAD_STAGING_CHAT_ID = int(os.getenv("UPLOAD_STAGING_CHAT_ID", "0")) or None
+
+# ===== معالجة التحديثات =====
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))  # تحديثات تُعالج بالتوازي (مع ترتيب داخل كل محادثة)
 
 # ===== إعدادات مكافحة السبام =====
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "3"))   # عدد الطلبات المسموح بها
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))       # النافذة الزمنية بالثواني
 COOLDOWN_SECONDS = int(os.getenv("COOLDOWN_SECONDS", "30"))         # وقت الانتظار بعد تجاوز الحد
+GLOBAL_RATE_LIMIT = float(os.getenv("GLOBAL_RATE_LIMIT", "0"))      # أقصى طلبات في الثانية لكل البوت (0 = بلا حد)
+GLOBAL_RATE_BURST = int(os.getenv("GLOBAL_RATE_BURST", "20"))       # الدفعة المسموحة فوق المعدل العام
+# أقصى عدد طلبات جلب معلومات متزامنة لكل منصة قبل الرفض، مثل "instagram:3,facebook:2"
+PLATFORM_CONCURRENCY_LIMITS = _parse_limits(os.getenv("PLATFORM_CONCURRENCY_LIMITS", ""))
+
+# ===== إعدادات الكاش =====
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "1800"))                # مدة صلاحية معلومات الفيديو بالثواني
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "500"))  # أقصى عدد عناصر في الذاكرة
+METADATA_CACHE_MAX_MB = int(os.getenv("METADATA_CACHE_MAX_MB", "64"))             # أقصى حجم للكاش في الذاكرة
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "")  # مسار ملف SQLite للكاش الدائم (فارغ = تعطيل)
+INFO_REUSE_MAX_AGE = int(os.getenv("INFO_REUSE_MAX_AGE", "1200"))  # أقصى عمر لإعادة استخدام روابط البث بدون تاريخ انتهاء
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", str(30 * 24 * 3600)))      # مدة صلاحية file_id الخاص بتلغرام
+FILE_ID_CACHE_MAX_ENTRIES = int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "20000"))
+
+# ===== مجمّعات العمل (Worker Pools) =====
+# كل مجمّع له عدد خيوط، وحد لطول الطابور، وحد للتزامن لكل منصة
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "4"))        # جلب المعلومات (سريع)
+EXTRACT_QUEUE_SIZE = int(os.getenv("EXTRACT_QUEUE_SIZE", "50"))
+EXTRACT_PLATFORM_LIMITS = _parse_limits(os.getenv("EXTRACT_PLATFORM_LIMITS", ""))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "3"))      # التحميل عبر الشبكة
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "20"))
+DOWNLOAD_PLATFORM_LIMITS = _parse_limits(os.getenv("DOWNLOAD_PLATFORM_LIMITS", "instagram:2"))
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "1"))    # معالجة ffmpeg (ثقيلة على المعالج)
+TRANSCODE_QUEUE_SIZE = int(os.getenv("TRANSCODE_QUEUE_SIZE", "20"))
+TRANSCODE_PLATFORM_LIMITS = _parse_limits(os.getenv("TRANSCODE_PLATFORM_LIMITS", ""))
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", "1"))         # عدد خيوط ffmpeg عند إعادة الترميز (الملاذ الأخير)
+# وضع التنفيذ لمهام yt-dlp: "thread" (افتراضي) أو "process" لتجنب حجز GIL وعزل الأعطال
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "thread").lower()
+EXTRACT_TIMEOUT = int(os.getenv("EXTRACT_TIMEOUT", "90"))      # مهلة جلب المعلومات في وضع العمليات (لا مهلة في وضع الخيوط)
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "1200"))  # مهلة التحميل في وضع العمليات (لا مهلة في وضع الخيوط)
+
+# ===== التحميل المجزأ (اختياري) =====
+# تحميل الصيغ التقدمية الكبيرة عبر عدة طلبات Range متوازية بدلاً من اتصال واحد
+SEGMENTED_DOWNLOAD = os.getenv("SEGMENTED_DOWNLOAD", "false").lower() in ("1", "true", "yes")
+SEGMENT_MAX_CONNECTIONS = int(os.getenv("SEGMENT_MAX_CONNECTIONS", "8"))  # أقصى عدد اتصالات متوازية للملف الواحد
+SEGMENT_CHUNK_MB = int(os.getenv("SEGMENT_CHUNK_MB", "2"))                # حجم كل جزء يُطلب في طلب Range واحد
+SEGMENT_MIN_SIZE_MB = int(os.getenv("SEGMENT_MIN_SIZE_MB", "8"))          # الملفات الأصغر تُحمّل باتصال واحد
+CONCURRENT_FRAGMENTS = int(os.getenv("CONCURRENT_FRAGMENTS", "4"))        # أجزاء DASH/HLS المتوازية في yt-dlp
+
+# ===== فحص الأحجام الفعلية قبل عرض الجودات =====
+SIZE_PROBE_DEADLINE = float(os.getenv("SIZE_PROBE_DEADLINE", "3"))     # المهلة الإجمالية لفحص كل الصيغ بالثواني
+SIZE_PROBE_MAX_FORMATS = int(os.getenv("SIZE_PROBE_MAX_FORMATS", "24"))  # أقصى عدد صيغ تُفحص للرابط الواحد
+SIZE_PROBE_TIMEOUT = float(os.getenv("SIZE_PROBE_TIMEOUT", "2"))       # مهلة الاتصال/القراءة لكل طلب فحص
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", "8"))                    # خيوط مجمّع الفحص المشترك بين كل الروابط
+PROBE_QUEUE_SIZE = int(os.getenv("PROBE_QUEUE_SIZE", "64"))
+
+# ===== وضع الواجهة والعمال المنفصلين (اختياري) =====
+# عند تعيين مسار الطابور يكتفي البوت باستقبال التحديثات وإضافة مهام التحميل إلى طابور SQLite،
+# وتنفذها عمليات عمال مستقلة (python worker.py) على نفس الجهاز وبنفس DOWNLOAD_PATH
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "")                   # مسار ملف الطابور (فارغ = التحميل داخل عملية البوت)
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))     # مهام متزامنة لكل عملية عامل
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))   # فترة فحص الطابور بالثواني
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))      # مدة حجز المهمة قبل اعتبار العامل متوقفاً
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))         # محاولات المهمة قبل فشلها نهائياً
+JOB_QUEUE_TIMEOUT = int(os.getenv("JOB_QUEUE_TIMEOUT", "300"))     # أقصى انتظار لعامل حر قبل رفض المهمة
+# في هذا الوضع تُسجَّل حجوزات القرص في نفس ملف الطابور فتكون DISK_BUDGET_MB ميزانية الجهاز كله؛
+# كل عملية تجدد حجوزاتها بهذه الفترة، وحجوزات العملية المتوقفة تُهمل بعد 4 فترات
+DISK_LEDGER_HEARTBEAT = int(os.getenv("DISK_LEDGER_HEARTBEAT", "30"))
+
+# ===== جدولة مهام التحميل =====
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "2"))                  # عدد التحميلات المتزامنة لكل البوت
+QUEUE_UPDATE_INTERVAL = int(os.getenv("QUEUE_UPDATE_INTERVAL", "5"))              # فترة تحديث رسالة موقع الانتظار
+SCHEDULER_AGING_BYTES = int(os.getenv("SCHEDULER_AGING_BYTES", str(512 * 1024)))  # تخفيض التكلفة لكل ثانية انتظار (منع التجويع)
+
+# ===== تقارير التقدم =====
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))  # أقل فترة بين تعديلات رسالة التقدم بالثواني
+PROGRESS_MIN_STEP = int(os.getenv("PROGRESS_MIN_STEP", "5"))              # أقل تغير في النسبة المئوية يستحق التعديل
+
+# ===== جلسات المستخدمين في الذاكرة =====
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))                        # انتهاء الجلسة الخاملة (قائمة جودات مهجورة)
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "20000"))       # أقصى عدد جلسات نشطة
+USER_RECORD_TTL = int(os.getenv("USER_RECORD_TTL", str(7 * 24 * 3600)))    # حذف سجل المستخدم (اللغة) بعد عدم النشاط
+USER_MAX_ENTRIES = int(os.getenv("USER_MAX_ENTRIES", "200000"))            # أقصى عدد سجلات مستخدمين
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "60"))    # فترة التنظيف في الخلفية
+
+# ===== تفضيلات المستخدمين الدائمة =====
+PREFS_DB_PATH = os.getenv("PREFS_DB_PATH", "./data/users.db")       # ملف SQLite (ضعه على وحدة تخزين دائمة؛ فارغ = تعطيل)
+PREFS_FLUSH_INTERVAL = float(os.getenv("PREFS_FLUSH_INTERVAL", "5"))  # أقصى تأخير لحفظ التغييرات بالثواني
+PREFS_FLUSH_BATCH = int(os.getenv("PREFS_FLUSH_BATCH", "200"))        # الحفظ فوراً عند تجمّع هذا العدد من التغييرات
+
+# ===== الحالة المشتركة بين عدة نسخ من البوت =====
+# فارغ = في الذاكرة (نسخة واحدة). redis://[:password@]host:6379/0 = خادم مشترك متوافق مع Redis
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "dlbot:")                # بادئة كل المفاتيح في الخادم المشترك
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "0.05"))  # مدة تجميع الكتابات قبل إرسالها
 
 # ===== إعدادات اللغة =====
 DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "ar")
@@ -58,4 +206,5 @@ YTDLP_BASE_OPTIONS = {
     "retries": 3,
     "nocheckcertificate": True,
     "cookiefile": os.getenv("COOKIE_FILE"),  # خيار لإضافة ملف كوكيز لإنستغرام وغيره
+    "concurrent_fragment_downloads": CONCURRENT_FRAGMENTS,
 }
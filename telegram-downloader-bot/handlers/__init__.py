@@ -1,3 +1,6 @@
-from .commands import start_command, help_command, lang_command, cancel_command, handle_lang_callback
+from .commands import (
+    start_command, help_command, lang_command, cancel_command, handle_lang_callback,
+    preload_user_prefs, stats_command, is_cancel_update,
+)
 from .message_handler import handle_message
 from .callback_handler import handle_callback
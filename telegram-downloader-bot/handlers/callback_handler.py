@@ -6,22 +6,89 @@ Handles quality selection, download type, and download execution
 import os
 import logging
 import asyncio
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ChatAction
 from telegram.error import TelegramError
+from yt_dlp.utils import DownloadError
 
 from locales import get_message
 from utils import (
-    get_user_lang, get_user_url, get_user_video_info,
+    get_user_lang, get_user_url, get_user_video_info, get_user_state,
     set_user_state, clear_user_session, rate_limiter,
-    format_file_size,
+    format_file_size, format_duration, media_key, increment_user_downloads,
 )
-from utils.downloader import download_video, download_audio, cleanup_file
-from config.settings import MAX_FILE_SIZE_MB, MAX_FILE_SIZE_BYTES
+from utils.downloader import (
+    download_video, download_audio, iter_video_items, cleanup_file, split_for_upload, fitting_format_spec,
+)
+from utils.cache import file_id_cache, file_id_key
+from utils.workers import PoolBusyError
+from utils.disk import DiskFullError
+from utils.bot_api import bot_api
+from utils.scheduler import job_scheduler, estimate_job_cost
+from utils.progress import ProgressReporter
+from utils.update_processor import release_chat_lane
+from utils.ffmpeg import SEND_AUDIO_EXTS
+from config.settings import UPLOAD_STAGING_CHAT_ID
 
 logger = logging.getLogger(__name__)
 
+# الحد الأقصى لعدد العناصر في ألبوم تلغرام واحد
+_MEDIA_GROUP_LIMIT = 10
+
+# مهمة التحميل الجارية لكل مستخدم (ليلغيها /cancel أو زر الإلغاء): {user_id: Task}
+_active_downloads: dict[int, asyncio.Task] = {}
+# المهام التي ألغاها المستخدم نفسه (وليس إيقاف البوت)
+_cancelled_by_user: set[asyncio.Task] = set()
+
+
+def cancel_active_download(user_id: int) -> bool:
+    """إلغاء تحميل المستخدم الجاري (أو المنتظر في الطابور). Returns True if one was running."""
+    task = _active_downloads.get(user_id)
+    if task is None or task.done():
+        return False
+    _cancelled_by_user.add(task)
+    task.cancel()
+    return True
+
+
+@asynccontextmanager
+async def _user_download(query, user_id: int, lang: str):
+    """تسجيل مهمة التحميل الحالية حتى يمكن إلغاؤها، وتحويل إلغاء المستخدم إلى رسالة"""
+    task = asyncio.current_task()
+    _active_downloads[user_id] = task
+    try:
+        yield
+    except asyncio.CancelledError:
+        if task not in _cancelled_by_user:
+            raise
+        # الإلغاء انتهى هنا: لا يُعامل كإلغاء للمهمة نفسها بعد الآن
+        task.uncancel()
+        logger.info(f"User {user_id} cancelled their download")
+        try:
+            await query.edit_message_text(get_message("cancelled", lang), parse_mode="Markdown")
+        except TelegramError:
+            pass
+    finally:
+        _cancelled_by_user.discard(task)
+        if _active_downloads.get(user_id) is task:
+            del _active_downloads[user_id]
+
+
+@contextmanager
+def _upload_source(file_path: str):
+    """
+    مصدر الملف المرفوع: في وضع خادم Bot API المحلي يُرسل المسار فقط فيقرأ الخادم
+    الملف من القرص مباشرة (لا تمر بايتاته عبر Python)، وإلا يُفتح الملف للرفع.
+    """
+    if bot_api.local:
+        yield Path(file_path).absolute()
+        return
+    with open(file_path, "rb") as file:
+        yield file
+
 
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """المعالج الرئيسي لجميع الأزرار التفاعلية"""
@@ -34,6 +101,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # ===== إلغاء العملية =====
     if data == "action:cancel":
+        cancel_active_download(user.id)
         clear_user_session(user.id)
         await query.edit_message_text(
             get_message("cancelled", lang),
@@ -51,14 +119,16 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("quality:"):
         parts = data.split(":", 2)
         quality_index = int(parts[1])
-        await _start_video_download(query, context, user.id, lang, quality_index)
+        async with _user_download(query, user.id, lang):
+            await _start_video_download(query, context, user.id, lang, quality_index)
         return
 
     # ===== اختيار جودة الصوت =====
     if data.startswith("audio:"):
         parts = data.split(":", 2)
         quality_index = int(parts[1])
-        await _start_audio_download(query, context, user.id, lang, quality_index)
+        async with _user_download(query, user.id, lang):
+            await _start_audio_download(query, context, user.id, lang, quality_index)
         return
 
     # ===== الرجوع =====
@@ -122,8 +192,13 @@ async def _show_quality_options(query, user_id: int, lang: str, download_type: s
             label = q["quality_label"]
             size_str = q["filesize_str"]
             # تمييز الملفات الكبيرة جداً
-            if q["filesize"] > MAX_FILE_SIZE_BYTES:
+            if q.get("auto"):
+                btn_text = f"✨ {get_message('quality_auto', lang, quality=label)} — {size_str}"
+            elif q["filesize"] > bot_api.max_video_bytes:
                 btn_text = f"⚠️ {label} ({size_str} — كبير جداً)"
+            elif q["filesize"] > bot_api.max_file_bytes:
+                # يُرسل على أجزاء
+                btn_text = f"✂️ {label} — {size_str}"
             else:
                 btn_text = f"🎬 {label} — {size_str}"
 
@@ -137,6 +212,8 @@ async def _show_quality_options(query, user_id: int, lang: str, download_type: s
         qualities = video_info.get("audio_qualities", [])
         for i, q in enumerate(qualities):
             label = q["quality_label"]
+            if q.get("original"):
+                label = get_message("audio_original", lang, ext=q.get("ext", ""))
             size_str = q["filesize_str"]
             btn_text = f"🎵 {label} — {size_str}"
             keyboard.append([
@@ -190,14 +267,18 @@ async def _start_video_download(
         return
 
     selected = qualities[quality_index]
+    # الخيار التلقائي: أعلى دقة ضمن الحد أولاً، والأدنى منها بدائل عند تجاوز الحجم الفعلي
+    auto = bool(selected.get("auto"))
+    candidates = list(selected.get("candidates") or [selected])
+    selected = candidates[0]
     height = selected["height"]
     format_id = selected.get("format_id")
     filesize = selected.get("filesize", 0)
 
-    # التحقق من الحجم
-    if filesize and filesize > MAX_FILE_SIZE_BYTES:
+    # التحقق من الحجم: ما يتجاوز حد الإرسال يُقسّم بعد التحميل حتى bot_api.max_video_bytes
+    if filesize and filesize > bot_api.max_video_bytes:
         await query.edit_message_text(
-            get_message("error_file_too_large", lang, max_size=MAX_FILE_SIZE_MB),
+            get_message("error_file_too_large", lang, max_size=bot_api.max_video_mb),
             parse_mode="Markdown"
         )
         return
@@ -208,6 +289,8 @@ async def _start_video_download(
         parse_mode="Markdown"
     )
     set_user_state(user_id, "downloading")
+    # الطلب مسجل والجلسة مقروءة: التحميل والرفع لا يحجزان دور المحادثة
+    release_chat_lane()
 
     # مؤشر التحميل
     await context.bot.send_chat_action(
@@ -215,28 +298,96 @@ async def _start_video_download(
         action=ChatAction.UPLOAD_VIDEO
     )
 
+    # نتيجة الخيار التلقائي تُحفظ أيضاً بمفتاح "auto" لأن جودتها الفعلية قد تكون أحد البدائل
+    media = video_info.get("media_key") or media_key(url)
+    auto_key = file_id_key(media, "auto", "video") if auto else None
+    cache_key = auto_key or file_id_key(media, selected["quality_label"], "video")
+
     file_paths = None
     try:
-        # تحميل الفيديو (قد يكون قائمة ملفات في حال إنستغرام Carousel)
-        file_paths = await download_video(url, height=height, format_id=format_id)
-
-        if not file_paths:
+        # ===== إعادة الإرسال الفوري إذا سبق إرسال نفس الملف =====
+        if await _send_cached_video(query, context, cache_key, video_info, selected):
             await query.edit_message_text(
-                get_message("error_download_failed", lang),
+                get_message("done", lang),
                 parse_mode="Markdown"
             )
+            increment_user_downloads(user_id)
+            logger.info(
+                f"User {user_id} got cached video: {video_info['title']} "
+                f"[{selected['quality_label']}]"
+            )
             return
 
-        # التحقق من الأحجام
-        total_size = sum(os.path.getsize(fp) for fp in file_paths if os.path.exists(fp))
-        if total_size > MAX_FILE_SIZE_BYTES and len(file_paths) == 1:
+        # تحميل الفيديو (قد يكون قائمة ملفات في حال إنستغرام Carousel) عبر المجدول
+        notifier = _QueueNotifier(query, lang)
+        # عناصر المنشورات المتعددة تُرفع أثناء تحميل العناصر التالية: إلى محادثة التجهيز
+        # ثم تُرسل كألبوم {path: file_id}، أو مباشرة إلى المستخدم {path: message} بدونها
+        staged: dict[str, str] = {}
+        direct: dict[str, object] = {}
+        pipelined = video_info.get("item_count", 1) > 1
+        if pipelined and len(candidates) > 1:
+            # لكل عنصر أعلى دقة مرشحة يقع حجمه المعروف ضمن الحد (يختارها yt-dlp لكل عنصر)
+            format_id = fitting_format_spec([c["height"] for c in candidates], bot_api.max_file_bytes)
+
+        async def _job():
+            nonlocal selected
+            await notifier.started()
+            async with _progress_reporter(query, lang) as progress:
+                if pipelined and UPLOAD_STAGING_CHAT_ID:
+                    return await _download_and_stage_items(
+                        context, url, height, format_id, progress.hook, staged
+                    )
+                if pipelined:
+                    return await _download_and_send_items(
+                        context, query.message.chat_id, url, height, format_id, progress.hook,
+                        lambda size: _video_caption(video_info, selected, size), direct,
+                    )
+                if len(candidates) > 1:
+                    files, selected = await _download_best_fit(url, candidates, progress.hook)
+                    return files
+                return await download_video(
+                    url, height=height, format_id=format_id,
+                    progress_callback=progress.hook, estimated_size=filesize,
+                )
+
+        file_paths = await job_scheduler.run(
+            user_id,
+            estimate_job_cost(filesize, video_info.get("duration")),
+            _job,
+            on_queued=notifier,
+        )
+
+        if not file_paths:
             await query.edit_message_text(
-                get_message("error_file_too_large", lang, max_size=MAX_FILE_SIZE_MB),
+                get_message("error_download_failed", lang),
                 parse_mode="Markdown"
             )
-            cleanup_file(file_paths)
             return
 
+        # في الوضع التلقائي قد تختلف الجودة الفعلية عن المتوقعة (وقد تختلف بين عناصر
+        # المنشور المتعدد، فلا يُحفظ عندها إلا بمفتاح "auto")
+        cache_keys = [auto_key] if auto_key else []
+        if not (auto and pipelined):
+            cache_keys.append(file_id_key(media, selected["quality_label"], "video"))
+
+        # التحقق من الأحجام: الملف الأكبر من الحد يُقسّم إلى أجزاء بدلاً من رفضه
+        total_size = sum(os.path.getsize(fp) for fp in file_paths if os.path.exists(fp))
+        parts = None
+        if total_size > bot_api.max_file_bytes and len(file_paths) == 1:
+            try:
+                parts = await split_for_upload(file_paths[0])
+            except DiskFullError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not split oversized video for user {user_id}: {e}")
+                await query.edit_message_text(
+                    get_message("error_file_too_large", lang, max_size=bot_api.max_file_mb),
+                    parse_mode="Markdown"
+                )
+                return
+            # الأجزاء تُحذف مع الأصل في finally
+            file_paths = file_paths + parts
+
         # تحديث الرسالة لإظهار حالة الرفع
         await query.edit_message_text(
             get_message("uploading", lang),
@@ -244,16 +395,13 @@ async def _start_video_download(
         )
 
         # إرسال الفيديو (أو الفيديوهات)
-        caption = (
-            f"🎬 *{video_info['title']}*\n"
-            f"📊 الجودة: `{selected['quality_label']}`\n"
-            f"📦 الحجم: `{format_file_size(total_size)}`\n"
-            f"⏱️ المدة: `{video_info['duration_str']}`"
-        )
+        caption = _video_caption(video_info, selected, total_size)
 
-        if len(file_paths) == 1:
-            with open(file_paths[0], "rb") as video_file:
-                await context.bot.send_video(
+        if parts:
+            sent_messages = await _send_video_parts(context, query.message.chat_id, parts, caption)
+        elif len(file_paths) == 1 and not direct:
+            with _upload_source(file_paths[0]) as video_file:
+                message = await context.bot.send_video(
                     chat_id=query.message.chat_id,
                     video=video_file,
                     caption=caption,
@@ -262,23 +410,53 @@ async def _start_video_download(
                     read_timeout=120,
                     write_timeout=120,
                 )
+            sent_messages = [message]
         else:
-            # إرسال كألبوم (Media Group) للمنشورات المتعددة
+            # العناصر المرسلة مباشرة أثناء التحميل لا تُعاد، والباقي يُرسل كألبوم (Media Group)
+            # للمنشورات المتعددة، بحد أقصى 10 عناصر لكل ألبوم
             from telegram import InputMediaVideo
-            media_group = []
-            for i, fp in enumerate(file_paths):
-                # ملاحظة: إنستغرام قد يحتوي على صور وفيديوهات مختلطة، yt-dlp يحملها كفيديو عادة
-                media_group.append(InputMediaVideo(
-                    open(fp, "rb"), 
-                    caption=caption if i == 0 else "" ,
-                    parse_mode="Markdown"
-                ))
-            await context.bot.send_media_group(
-                chat_id=query.message.chat_id,
-                media=media_group,
-                read_timeout=180,
-                write_timeout=180,
-            )
+            sent_messages = [direct[fp] for fp in file_paths if fp in direct]
+            pending = [fp for fp in file_paths if fp not in direct]
+            for start in range(0, len(pending), _MEDIA_GROUP_LIMIT):
+                with ExitStack() as files:
+                    media_group = []
+                    for i, fp in enumerate(pending[start:start + _MEDIA_GROUP_LIMIT], start=start):
+                        # ملاحظة: إنستغرام قد يحتوي على صور وفيديوهات مختلطة، yt-dlp يحملها كفيديو عادة
+                        media_group.append(InputMediaVideo(
+                            staged.get(fp) or files.enter_context(_upload_source(fp)),
+                            caption=caption if i == 0 and not direct else "" ,
+                            parse_mode="Markdown"
+                        ))
+                    if len(media_group) == 1:
+                        # الألبوم يحتاج عنصرين على الأقل
+                        sent_messages.append(await context.bot.send_video(
+                            chat_id=query.message.chat_id,
+                            video=media_group[0].media,
+                            caption=media_group[0].caption,
+                            parse_mode="Markdown",
+                            supports_streaming=True,
+                            read_timeout=120,
+                            write_timeout=120,
+                        ))
+                        continue
+                    sent_messages += await context.bot.send_media_group(
+                        chat_id=query.message.chat_id,
+                        media=media_group,
+                        read_timeout=180,
+                        write_timeout=180,
+                    )
+            if direct:
+                # الوصف أُرسل مع العنصر الأول بحجمه فقط، نحدّثه بالحجم الإجمالي
+                try:
+                    await direct[next(fp for fp in file_paths if fp in direct)].edit_caption(
+                        caption, parse_mode="Markdown"
+                    )
+                except TelegramError:
+                    pass
+
+        await _remember_file_ids(
+            cache_keys, sent_messages, total_size, split=bool(parts), quality_label=selected["quality_label"]
+        )
 
         # رسالة الاكتمال
         await query.edit_message_text(
@@ -286,9 +464,10 @@ async def _start_video_download(
             parse_mode="Markdown"
         )
 
+        increment_user_downloads(user_id)
         logger.info(
             f"User {user_id} downloaded video: {video_info['title']} "
-            f"[{selected['quality_label']}] — {format_file_size(actual_size)}"
+            f"[{selected['quality_label']}] — {format_file_size(total_size)}"
         )
 
     except TelegramError as e:
@@ -300,8 +479,10 @@ async def _start_video_download(
     except Exception as e:
         logger.error(f"Error in video download for user {user_id}: {e}")
         error_str = str(e).lower()
-        if "too large" in error_str or "file too big" in error_str:
-            msg = get_message("error_file_too_large", lang, max_size=MAX_FILE_SIZE_MB)
+        if isinstance(e, (PoolBusyError, DiskFullError)):
+            msg = get_message("error_busy", lang)
+        elif "too large" in error_str or "file too big" in error_str:
+            msg = get_message("error_file_too_large", lang, max_size=bot_api.max_video_mb)
         elif "timeout" in error_str:
             msg = get_message("error_timeout", lang)
         else:
@@ -313,7 +494,7 @@ async def _start_video_download(
     finally:
         if file_paths:
             cleanup_file(file_paths)
-        clear_user_session(user_id)
+        _end_download_session(user_id, url)
 
 
 async def _start_audio_download(
@@ -340,7 +521,8 @@ async def _start_audio_download(
         return
 
     selected = qualities[quality_index]
-    quality_kbps = selected.get("abr", 192)
+    # الخيار "original" يُسلَّم بدون إعادة ترميز
+    quality_kbps = None if selected.get("original") else selected.get("abr", 192)
 
     # تحديث الرسالة
     await query.edit_message_text(
@@ -348,16 +530,51 @@ async def _start_audio_download(
         parse_mode="Markdown"
     )
     set_user_state(user_id, "downloading")
+    # الطلب مسجل والجلسة مقروءة: التحميل والرفع لا يحجزان دور المحادثة
+    release_chat_lane()
 
     await context.bot.send_chat_action(
         chat_id=query.message.chat_id,
         action=ChatAction.UPLOAD_DOCUMENT
     )
 
+    cache_key = file_id_key(
+        video_info.get("media_key") or media_key(url), selected["quality_label"], "audio"
+    )
+
     file_paths = None
     try:
-        # تحميل الصوت (دائماً ملف واحد عادة، لكن نستخدم القائمة للاتساق)
-        path = await download_audio(url, quality_kbps=quality_kbps)
+        # ===== إعادة الإرسال الفوري إذا سبق إرسال نفس الملف =====
+        if await _send_cached_audio(query, context, cache_key, video_info, selected):
+            await query.edit_message_text(
+                get_message("done", lang),
+                parse_mode="Markdown"
+            )
+            increment_user_downloads(user_id)
+            logger.info(
+                f"User {user_id} got cached audio: {video_info['title']} "
+                f"[{selected['quality_label']}]"
+            )
+            return
+
+        # تحميل الصوت (دائماً ملف واحد عادة، لكن نستخدم القائمة للاتساق) عبر المجدول
+        notifier = _QueueNotifier(query, lang)
+
+        async def _job():
+            await notifier.started()
+            async with _progress_reporter(query, lang) as progress:
+                return await download_audio(
+                    url, quality_kbps=quality_kbps,
+                    progress_callback=progress.hook, estimated_size=selected.get("filesize", 0),
+                    format_id=selected.get("format_id"),
+                )
+
+        path = await job_scheduler.run(
+            user_id,
+            estimate_job_cost(selected.get("filesize"), video_info.get("duration")),
+            _job,
+            on_queued=notifier,
+        )
         file_paths = [path] if path else None
 
         if not file_paths or not os.path.exists(file_paths[0]):
@@ -368,12 +585,11 @@ async def _start_audio_download(
             return
 
         actual_size = os.path.getsize(file_paths[0])
-        if actual_size > MAX_FILE_SIZE_BYTES:
+        if actual_size > bot_api.max_file_bytes:
             await query.edit_message_text(
-                get_message("error_file_too_large", lang, max_size=MAX_FILE_SIZE_MB),
+                get_message("error_file_too_large", lang, max_size=bot_api.max_file_mb),
                 parse_mode="Markdown"
             )
-            cleanup_file(file_paths)
             return
 
         await query.edit_message_text(
@@ -381,29 +597,39 @@ async def _start_audio_download(
             parse_mode="Markdown"
         )
 
-        caption = (
-            f"🎵 *{video_info['title']}*\n"
-            f"🎶 الجودة: `{selected['quality_label']}`\n"
-            f"📦 الحجم: `{format_file_size(actual_size)}`\n"
-            f"⏱️ المدة: `{video_info['duration_str']}`"
-        )
+        caption = _audio_caption(video_info, selected, actual_size)
+        # الأصل بترميز opus/vorbis (.ogg) لا يقبله sendAudio، فيُرسل كمستند بدون تحويل
+        as_document = os.path.splitext(file_paths[0])[1].lower() not in SEND_AUDIO_EXTS
 
-        with open(file_paths[0], "rb") as audio_file:
-            await context.bot.send_audio(
-                chat_id=query.message.chat_id,
-                audio=audio_file,
-                caption=caption,
-                parse_mode="Markdown",
-                title=video_info["title"],
-                read_timeout=120,
-                write_timeout=120,
-            )
+        with _upload_source(file_paths[0]) as audio_file:
+            if as_document:
+                message = await context.bot.send_document(
+                    chat_id=query.message.chat_id,
+                    document=audio_file,
+                    caption=caption,
+                    parse_mode="Markdown",
+                    read_timeout=120,
+                    write_timeout=120,
+                )
+            else:
+                message = await context.bot.send_audio(
+                    chat_id=query.message.chat_id,
+                    audio=audio_file,
+                    caption=caption,
+                    parse_mode="Markdown",
+                    title=video_info["title"],
+                    read_timeout=120,
+                    write_timeout=120,
+                )
+
+        await _remember_file_ids(cache_key, [message], actual_size, document=as_document)
 
         await query.edit_message_text(
             get_message("done", lang),
             parse_mode="Markdown"
         )
 
+        increment_user_downloads(user_id)
         logger.info(
             f"User {user_id} downloaded audio: {video_info['title']} "
             f"[{selected['quality_label']}] — {format_file_size(actual_size)}"
@@ -418,8 +644,10 @@ async def _start_audio_download(
     except Exception as e:
         logger.error(f"Error in audio download for user {user_id}: {e}")
         error_str = str(e).lower()
-        if "too large" in error_str:
-            msg = get_message("error_file_too_large", lang, max_size=MAX_FILE_SIZE_MB)
+        if isinstance(e, (PoolBusyError, DiskFullError)):
+            msg = get_message("error_busy", lang)
+        elif "too large" in error_str:
+            msg = get_message("error_file_too_large", lang, max_size=bot_api.max_file_mb)
         elif "timeout" in error_str:
             msg = get_message("error_timeout", lang)
         else:
@@ -431,4 +659,334 @@ async def _start_audio_download(
     finally:
         if file_paths:
             cleanup_file(file_paths)
+        _end_download_session(user_id, url)
+
+
+def _end_download_session(user_id: int, url: str):
+    """
+    مسح الجلسة بعد التحميل، إلا إذا بدأ المستخدم طلباً جديداً أثناءه
+    (دور المحادثة يُحرر قبل التحميل فقد تكون الجلسة لرابط آخر الآن).
+    """
+    if get_user_state(user_id) == "downloading" and get_user_url(user_id) == url:
         clear_user_session(user_id)
+
+
+async def _download_best_fit(url: str, candidates: list[dict], progress_hook) -> tuple[list[str] | None, dict]:
+    """
+    تحميل أعلى جودة مرشحة، والانتقال إلى التالية (الأدنى) فقط إذا لم يكتمل التحميل،
+    مثل إيقاف yt-dlp له بسبب max_filesize. الملف المكتمل يُعاد حتى لو تجاوز حد الإرسال
+    فيُقسَّم إلى أجزاء بدلاً من حذفه وإعادة التحميل بجودة أدنى.
+    Returns: (file paths or None, the candidate that was downloaded)
+    """
+    files = None
+    for number, candidate in enumerate(candidates, start=1):
+        try:
+            files = await download_video(
+                url, height=candidate["height"], format_id=candidate.get("format_id"),
+                progress_callback=progress_hook, estimated_size=candidate.get("filesize", 0),
+            )
+        except DownloadError as e:
+            if number == len(candidates):
+                raise
+            logger.info(f"Auto quality {candidate['quality_label']} of {url} failed: {e}")
+            files = None
+        if files or number == len(candidates):
+            break
+        logger.info(
+            f"Auto quality {candidate['quality_label']} of {url} was not downloaded, "
+            f"falling back to {candidates[number]['quality_label']}"
+        )
+    return files, candidate
+
+
+class _QueueNotifier:
+    """تحديث رسالة الحالة بموقع المستخدم في قائمة الانتظار والوقت المتوقع"""
+
+    def __init__(self, query, lang: str):
+        self.query = query
+        self.lang = lang
+        self.was_queued = False
+
+    async def __call__(self, position: int, eta_seconds: float):
+        self.was_queued = True
+        await self.query.edit_message_text(
+            get_message("queued", self.lang, position=position, eta=format_duration(eta_seconds)),
+            parse_mode="Markdown"
+        )
+
+    async def started(self):
+        """إعادة رسالة "جارٍ التحميل" عند خروج المهمة من الطابور"""
+        if not self.was_queued:
+            return
+        try:
+            await self.query.edit_message_text(
+                get_message("downloading", self.lang),
+                parse_mode="Markdown"
+            )
+        except TelegramError:
+            pass
+
+
+async def _stage_upload(context: ContextTypes.DEFAULT_TYPE, file_path: str) -> str | None:
+    """رفع ملف إلى محادثة التجهيز للحصول على file_id، ثم حذف الرسالة"""
+    if os.path.getsize(file_path) > bot_api.max_file_bytes:
+        return None
+    with _upload_source(file_path) as video_file:
+        message = await context.bot.send_video(
+            chat_id=UPLOAD_STAGING_CHAT_ID,
+            video=video_file,
+            supports_streaming=True,
+            disable_notification=True,
+            read_timeout=120,
+            write_timeout=120,
+        )
+    try:
+        await message.delete()
+    except TelegramError:
+        pass
+    return _message_file_id(message)
+
+
+async def _download_and_stage_items(
+    context: ContextTypes.DEFAULT_TYPE, url: str, height: int, format_id: str | None,
+    progress_hook, staged: dict[str, str],
+) -> list[str]:
+    """
+    تحميل عناصر المنشور المتعدد مع رفع كل عنصر فور اكتماله (بالتوازي مع تحميل التالي).
+    تُملأ staged بمعرّفات الملفات المرفوعة، وتُرجع مسارات جميع الملفات.
+    """
+    file_paths: list[str] = []
+    uploads: list[asyncio.Task] = []
+    try:
+        async for item_paths in iter_video_items(url, height, format_id, progress_hook):
+            for fp in item_paths:
+                file_paths.append(fp)
+                uploads.append(asyncio.create_task(_stage_upload(context, fp)))
+    except BaseException:
+        for task in uploads:
+            task.cancel()
+        cleanup_file(file_paths)
+        raise
+
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+    for fp, result in zip(file_paths, results):
+        if isinstance(result, str):
+            staged[fp] = result
+        elif isinstance(result, Exception):
+            logger.warning(f"Pre-upload of {fp} failed, will upload with the album: {result}")
+    return file_paths
+
+
+async def _download_and_send_items(
+    context: ContextTypes.DEFAULT_TYPE, chat_id: int, url: str, height: int, format_id: str | None,
+    progress_hook, caption_for, sent: dict,
+) -> list[str]:
+    """
+    بدون محادثة تجهيز: إرسال كل عنصر من المنشور المتعدد إلى المستخدم مباشرة فور اكتماله
+    (بالترتيب، وبالتوازي مع تحميل العنصر التالي) كرسائل منفصلة بدلاً من ألبوم.
+    تُملأ sent بالرسائل المرسلة {path: message}، وما فشل إرساله يبقى للألبوم في النهاية.
+    caption_for(size) يُرجع الوصف المرفق بالعنصر الأول.
+    """
+    file_paths: list[str] = []
+    uploads: list[asyncio.Task] = []
+
+    async def _send(fp: str, previous: asyncio.Task | None):
+        if previous:
+            # الحفاظ على ترتيب العناصر حتى لو فشل إرسال السابق
+            await asyncio.gather(previous, return_exceptions=True)
+        if os.path.getsize(fp) > bot_api.max_file_bytes:
+            return
+        with _upload_source(fp) as video_file:
+            sent[fp] = await context.bot.send_video(
+                chat_id=chat_id,
+                video=video_file,
+                caption=caption_for(os.path.getsize(fp)) if not sent else None,
+                parse_mode="Markdown",
+                supports_streaming=True,
+                read_timeout=120,
+                write_timeout=120,
+            )
+
+    try:
+        async for item_paths in iter_video_items(url, height, format_id, progress_hook):
+            for fp in item_paths:
+                file_paths.append(fp)
+                uploads.append(asyncio.create_task(_send(fp, uploads[-1] if uploads else None)))
+    except BaseException:
+        for task in uploads:
+            task.cancel()
+        cleanup_file(file_paths)
+        raise
+
+    results = await asyncio.gather(*uploads, return_exceptions=True)
+    for fp, result in zip(file_paths, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Direct upload of {fp} failed, will upload with the album: {result}")
+    return file_paths
+
+
+def _progress_reporter(query, lang: str) -> ProgressReporter:
+    """مُبلّغ تقدم يعدّل رسالة الحالة بالنسبة والسرعة والوقت المتبقي"""
+    def _render(sample) -> str:
+        filled = sample.percent // 10
+        return get_message(
+            "downloading_progress", lang,
+            percent=sample.percent,
+            bar="▓" * filled + "░" * (10 - filled),
+            downloaded=format_file_size(sample.downloaded),
+            total=format_file_size(sample.total),
+            speed=format_file_size(sample.speed),
+            eta=format_duration(sample.eta),
+        )
+
+    async def _edit(text: str):
+        await query.edit_message_text(text, parse_mode="Markdown")
+
+    return ProgressReporter(_edit, _render)
+
+
+def _video_caption(video_info: dict, selected: dict, size: int) -> str:
+    """نص الوصف المرفق مع الفيديو"""
+    return (
+        f"🎬 *{video_info['title']}*\n"
+        f"📊 الجودة: `{selected['quality_label']}`\n"
+        f"📦 الحجم: `{format_file_size(size)}`\n"
+        f"⏱️ المدة: `{video_info['duration_str']}`"
+    )
+
+
+def _audio_caption(video_info: dict, selected: dict, size: int) -> str:
+    """نص الوصف المرفق مع الصوت"""
+    return (
+        f"🎵 *{video_info['title']}*\n"
+        f"🎶 الجودة: `{selected['quality_label']}`\n"
+        f"📦 الحجم: `{format_file_size(size)}`\n"
+        f"⏱️ المدة: `{video_info['duration_str']}`"
+    )
+
+
+def _message_file_id(message) -> str | None:
+    """استخراج file_id من رسالة مُرسلة (فيديو، صوت، أو مستند)"""
+    for attr in ("video", "audio", "animation", "document"):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_id
+    return None
+
+
+async def _remember_file_ids(
+    cache_keys: str | list[str], messages, size: int, split: bool = False, document: bool = False,
+    quality_label: str | None = None,
+):
+    """
+    حفظ معرّفات الملفات المُرسلة لإعادة استخدامها لاحقاً، بمفتاح واحد أو أكثر
+    (split: أجزاء فيديو واحد مقسّم، document: أُرسل كمستند وليس كمقطع صوتي،
+    quality_label: الجودة الفعلية لعرضها عند الإرسال من الكاش بمفتاح "auto")
+    """
+    file_ids = [_message_file_id(m) for m in messages or []]
+    if not file_ids or not all(file_ids):
+        return
+    entry = {"file_ids": file_ids, "size": size}
+    if split:
+        entry["split"] = True
+    if document:
+        entry["document"] = True
+    if quality_label:
+        entry["quality_label"] = quality_label
+    for cache_key in [cache_keys] if isinstance(cache_keys, str) else cache_keys:
+        await file_id_cache.aset(cache_key, entry)
+
+
+async def _send_video_parts(context, chat_id: int, parts: list, caption: str, from_files: bool = True) -> list:
+    """
+    إرسال أجزاء فيديو مقسّم بالترتيب كرسائل متتالية مرقمة.
+    parts: مسارات الملفات، أو معرّفات file_id عندما from_files=False.
+    """
+    messages = []
+    for number, part in enumerate(parts, start=1):
+        label = f"🧩 الجزء `{number}/{len(parts)}`"
+        with ExitStack() as files:
+            video = files.enter_context(_upload_source(part)) if from_files else part
+            messages.append(await context.bot.send_video(
+                chat_id=chat_id,
+                video=video,
+                caption=f"{caption}\n{label}" if number == 1 else label,
+                parse_mode="Markdown",
+                supports_streaming=True,
+                read_timeout=120,
+                write_timeout=120,
+            ))
+    return messages
+
+
+async def _send_cached_video(query, context, cache_key: str, video_info: dict, selected: dict) -> bool:
+    """
+    إرسال الفيديو مباشرة عبر file_id المحفوظ.
+    Returns True if sent from cache, False on miss or stale file_id.
+    """
+    cached = await file_id_cache.aget(cache_key)
+    if not cached:
+        return False
+
+    file_ids = cached["file_ids"]
+    quality_label = cached.get("quality_label", selected["quality_label"])
+    caption = _video_caption(video_info, {**selected, "quality_label": quality_label}, cached.get("size", 0))
+    try:
+        if cached.get("split"):
+            await _send_video_parts(context, query.message.chat_id, file_ids, caption, from_files=False)
+        elif len(file_ids) == 1:
+            await context.bot.send_video(
+                chat_id=query.message.chat_id,
+                video=file_ids[0],
+                caption=caption,
+                parse_mode="Markdown",
+                supports_streaming=True,
+            )
+        else:
+            from telegram import InputMediaVideo
+            await context.bot.send_media_group(
+                chat_id=query.message.chat_id,
+                media=[
+                    InputMediaVideo(fid, caption=caption if i == 0 else "", parse_mode="Markdown")
+                    for i, fid in enumerate(file_ids)
+                ],
+            )
+        return True
+    except TelegramError as e:
+        # file_id لم يعد صالحاً — نحذفه ونعود للتحميل العادي
+        logger.warning(f"Cached file_id failed for {cache_key}: {e}")
+        await file_id_cache.adelete(cache_key)
+        return False
+
+
+async def _send_cached_audio(query, context, cache_key: str, video_info: dict, selected: dict) -> bool:
+    """
+    إرسال الصوت مباشرة عبر file_id المحفوظ.
+    Returns True if sent from cache, False on miss or stale file_id.
+    """
+    cached = await file_id_cache.aget(cache_key)
+    if not cached:
+        return False
+
+    caption = _audio_caption(video_info, selected, cached.get("size", 0))
+    try:
+        if cached.get("document"):
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=cached["file_ids"][0],
+                caption=caption,
+                parse_mode="Markdown",
+            )
+        else:
+            await context.bot.send_audio(
+                chat_id=query.message.chat_id,
+                audio=cached["file_ids"][0],
+                caption=caption,
+                parse_mode="Markdown",
+                title=video_info["title"],
+            )
+        return True
+    except TelegramError as e:
+        logger.warning(f"Cached file_id failed for {cache_key}: {e}")
+        await file_id_cache.adelete(cache_key)
+        return False
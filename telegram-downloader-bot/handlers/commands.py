@@ -1,18 +1,29 @@
 """
-معالجات الأوامر الأساسية: /start، /help، /lang، /cancel
-Basic command handlers: /start, /help, /lang, /cancel
+معالجات الأوامر الأساسية: /start، /help، /lang، /cancel، و/stats للمشرفين
+Basic command handlers: /start, /help, /lang, /cancel, admin /stats
 """
 
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
+from config.settings import ADMIN_IDS
 from locales import get_message
-from utils import get_user_lang, set_user_lang, clear_user_session, init_user
+from utils import get_user_lang, set_user_lang, clear_user_session, init_user, load_user
 
 logger = logging.getLogger(__name__)
 
 
+async def preload_user_prefs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """يعمل قبل كل المعالجات (المجموعة -1): تحميل تفضيلات المستخدم المحفوظة إلى الذاكرة"""
+    user = update.effective_user
+    if user:
+        # الرسائل النصية (غير الأوامر) تُحتسب في حد المعدل ضمن نفس رحلة التحميل
+        message = update.message
+        count_request = bool(message and message.text and not message.text.startswith("/"))
+        await load_user(user.id, count_request)
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج أمر /start"""
     user = update.effective_user
@@ -64,10 +75,25 @@ async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+def is_cancel_update(update: object) -> bool:
+    """
+    تحديثات الإلغاء (/cancel أو زر الإلغاء) تتخطى طابور المحادثة في PerChatUpdateProcessor
+    حتى لا تنتظر انتهاء التحميل الذي تريد إلغاءه.
+    """
+    if not isinstance(update, Update):
+        return False
+    if update.callback_query:
+        return update.callback_query.data == "action:cancel"
+    text = update.message.text if update.message else None
+    return bool(text) and text.split(maxsplit=1)[0].split("@")[0] == "/cancel"
+
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالج أمر /cancel — إلغاء العملية الحالية"""
+    """معالج أمر /cancel — إلغاء العملية الحالية (بما فيها التحميل الجاري)"""
+    from handlers.callback_handler import cancel_active_download
     user = update.effective_user
     lang = get_user_lang(user.id)
+    cancel_active_download(user.id)
     clear_user_session(user.id)
 
     await update.message.reply_text(
@@ -77,6 +103,20 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"User {user.id} cancelled their session")
 
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج أمر /stats — إحصائيات التشغيل (للمشرفين في ADMIN_IDS فقط)"""
+    from utils.stats import collect_stats, format_stats
+    user = update.effective_user
+    if user.id not in ADMIN_IDS:
+        logger.info(f"User {user.id} is not an admin, ignoring /stats")
+        return
+
+    await update.message.reply_text(
+        format_stats(collect_stats(context.application)),
+        parse_mode="Markdown"
+    )
+
+
 async def handle_lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج callback لتغيير اللغة"""
     query = update.callback_query
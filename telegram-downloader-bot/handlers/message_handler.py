@@ -14,9 +14,10 @@ from utils import (
     is_supported_platform, detect_platform, clean_url,
     set_user_url, set_user_video_info, set_user_state,
     get_user_state, rate_limiter, init_user,
-    format_duration, format_views, format_date,
+    format_duration, format_views, format_date, media_key, platform_id,
 )
 from utils.downloader import fetch_video_info
+from utils.workers import PoolBusyError
 
 logger = logging.getLogger(__name__)
 
@@ -78,6 +79,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode="Markdown"
     )
 
+    # ===== حد الطلبات المتزامنة للمنصة (حماية المستخرجات الحساسة) =====
+    platform = platform_id(url)
+    if not rate_limiter.try_acquire_platform(platform):
+        await status_msg.edit_text(get_message("error_busy", lang), parse_mode="Markdown")
+        return
+
     # ===== جلب معلومات الفيديو =====
     try:
         video_info = await fetch_video_info(url)
@@ -90,7 +97,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     except Exception as e:
         error_str = str(e).lower()
-        if any(kw in error_str for kw in ["private", "unavailable", "not available", "removed"]):
+        if isinstance(e, PoolBusyError):
+            msg = get_message("error_busy", lang)
+        elif any(kw in error_str for kw in ["private", "unavailable", "not available", "removed"]):
             msg = get_message("error_video_unavailable", lang)
         elif "timeout" in error_str:
             msg = get_message("error_timeout", lang)
@@ -99,6 +108,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await status_msg.edit_text(msg, parse_mode="Markdown")
         logger.error(f"Error fetching info for {url}: {e}")
         return
+    finally:
+        rate_limiter.release_platform(platform)
 
     # ===== تخزين بيانات الجلسة =====
     set_user_url(user.id, url)
@@ -110,6 +121,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "upload_date": video_info.upload_date,
         "platform": video_info.platform,
         "url": url,
+        "media_key": media_key(url),
+        "item_count": video_info.item_count,
         "video_qualities": video_info.get_available_video_qualities(),
         "audio_qualities": video_info.get_available_audio_qualities(),
     })
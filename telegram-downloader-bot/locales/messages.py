@@ -41,6 +41,8 @@ MESSAGES = {
         "downloading": "⏳ *جارٍ التحميل...*\nيرجى الانتظار، قد يستغرق هذا بعض الوقت.",
         "fetching_info": "🔍 *جارٍ جلب معلومات الفيديو...*",
         "uploading": "📤 *جارٍ الرفع إلى تلغرام...*",
+        "downloading_progress": "⏳ *جارٍ التحميل...* {percent}%\n{bar}\n\n📦 {downloaded} / {total}\n⚡ {speed}/ث — ⏱️ {eta}",
+        "queued": "🕒 *طلبك في قائمة الانتظار*\n\nموقعك: #{position}\nالوقت المتوقع: {eta}",
         "done": "✅ *تم التحميل بنجاح!*",
         "cancelled": "❌ *تم إلغاء العملية.*",
         "language_changed": "✅ تم تغيير اللغة إلى العربية.",
@@ -57,6 +59,8 @@ MESSAGES = {
         ),
         "quality_option": "🎬 {label} — الحجم التقريبي: {size}",
         "audio_option": "🎵 {label} — الحجم التقريبي: {size}",
+        "audio_original": "الأصلي بدون تحويل ({ext})",
+        "quality_auto": "تلقائي: أعلى جودة ضمن الحد ({quality})",
         "size_unknown": "غير معروف",
         "quality_unavailable": "⚠️ هذه الجودة غير متاحة، سيتم استخدام أقرب جودة متاحة.",
 
@@ -89,6 +93,7 @@ MESSAGES = {
         ),
         "error_general": "❌ *حدث خطأ غير متوقع.* يرجى المحاولة مرة أخرى.",
         "error_timeout": "⏰ *انتهت مهلة الطلب.* يرجى المحاولة مرة أخرى.",
+        "error_busy": "🚦 *البوت مشغول حالياً بطلبات كثيرة.* يرجى المحاولة بعد قليل.",
 
         # ===== مكافحة السبام =====
         "rate_limit_exceeded": (
@@ -149,6 +154,8 @@ MESSAGES = {
         "downloading": "⏳ *Downloading...*\nPlease wait, this may take a moment.",
         "fetching_info": "🔍 *Fetching video information...*",
         "uploading": "📤 *Uploading to Telegram...*",
+        "downloading_progress": "⏳ *Downloading...* {percent}%\n{bar}\n\n📦 {downloaded} / {total}\n⚡ {speed}/s — ⏱️ {eta}",
+        "queued": "🕒 *Your request is queued*\n\nYou are #{position} in queue\nETA: {eta}",
         "done": "✅ *Download complete!*",
         "cancelled": "❌ *Operation cancelled.*",
         "language_changed": "✅ Language changed to English.",
@@ -165,6 +172,8 @@ MESSAGES = {
         ),
         "quality_option": "🎬 {label} — Est. size: {size}",
         "audio_option": "🎵 {label} — Est. size: {size}",
+        "audio_original": "Original, no conversion ({ext})",
+        "quality_auto": "Auto: best quality within the limit ({quality})",
         "size_unknown": "Unknown",
         "quality_unavailable": "⚠️ This quality is unavailable, using the closest available quality.",
 
@@ -197,6 +206,7 @@ MESSAGES = {
         ),
         "error_general": "❌ *An unexpected error occurred.* Please try again.",
         "error_timeout": "⏰ *Request timed out.* Please try again.",
+        "error_busy": "🚦 *The bot is busy with many requests right now.* Please try again shortly.",
 
         # ===== Anti-Spam =====
         "rate_limit_exceeded": (
@@ -11,6 +11,7 @@
 
 import os
 import sys
+import signal
 import logging
 import asyncio
 from pathlib import Path
@@ -21,6 +22,7 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -28,10 +30,15 @@ from telegram.ext import (
 # إضافة مسار المشروع إلى sys.path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config.settings import BOT_TOKEN, DOWNLOAD_PATH
+from config.settings import (
+    BOT_TOKEN, DOWNLOAD_PATH, STATS_LOG_INTERVAL, MAX_CONCURRENT_UPDATES, BOT_API_URL, BOT_API_LOCAL_MODE,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, WEBHOOK_READY_PATH, WEBHOOK_REGISTER,
+)
 from handlers import (
     start_command, help_command, lang_command, cancel_command,
-    handle_lang_callback, handle_message, handle_callback,
+    handle_lang_callback, handle_message, handle_callback, preload_user_prefs, stats_command,
+    is_cancel_update,
 )
 
 # ===== إعداد نظام السجلات =====
@@ -106,22 +113,37 @@ def create_application() -> Application:
     # إنشاء مجلد التحميل
     os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 
-    # بناء التطبيق
-    application = (
+    # بناء التطبيق (معالجة متوازية مع الحفاظ على الترتيب داخل كل محادثة)
+    from utils.update_processor import PerChatUpdateProcessor
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
+        .concurrent_updates(PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES, skip_lane=is_cancel_update))
         .read_timeout(60)
         .write_timeout(120)
         .connect_timeout(30)
         .pool_timeout(60)
-        .build()
     )
+    if BOT_API_URL:
+        # خادم Bot API مستضاف ذاتياً. الإرسال بالمسار (الوضع المحلي) يُقرر في post_init بعد فحص
+        # الخادم؛ local_mode للمكتبة يسمح بالمسارات فقط، والملفات المفتوحة تُرفع بمحتواها كالعادة
+        builder = (
+            builder
+            .base_url(f"{BOT_API_URL}/bot")
+            .base_file_url(f"{BOT_API_URL}/file/bot")
+            .local_mode(BOT_API_LOCAL_MODE != "false")
+        )
+    application = builder.build()
+
+    # ===== تحميل تفضيلات المستخدم قبل أي معالج (المجموعة -1) =====
+    application.add_handler(TypeHandler(Update, preload_user_prefs), group=-1)
 
     # ===== تسجيل معالجات الأوامر =====
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("lang", lang_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("stats", stats_command))
 
     # ===== معالج الأزرار التفاعلية =====
     # معالج تغيير اللغة (له أولوية أعلى)
@@ -144,9 +166,52 @@ def create_application() -> Application:
     return application
 
 
+async def post_shutdown(application: Application):
+    """تنفيذ عند إيقاف التطبيق"""
+    from utils.workers import shutdown_pools
+    from utils.prefs import prefs_store
+    from utils.state import state_backend, state_writer
+    shutdown_pools()
+    # حفظ ما تبقى من تغييرات التفضيلات والحالة المشتركة قبل الخروج
+    await prefs_store.flush()
+    await state_writer.flush()
+    state_backend.close()
+
+
 async def post_init(application: Application):
     """تنفيذ بعد تهيئة التطبيق"""
+    from utils.disk import disk_manager
+    from utils.user_manager import session_store
+    from utils.prefs import prefs_store
+    from utils.state import state_backend, state_writer
+    from utils.job_queue import job_queue
+    from utils.stats import run_stats_logger
+    from utils.bot_api import bot_api, detect_local_mode
+    if BOT_API_URL:
+        # فحص الخادم (BOT_API_LOCAL_MODE=auto): عند الفشل حدود الخادم العام ورفع المحتوى
+        await detect_local_mode()
+        logger.info(
+            f"🏠 خادم Bot API: {BOT_API_URL} (mode={BOT_API_LOCAL_MODE}, local={bot_api.local}, "
+            f"max_file={bot_api.max_file_mb}MB)"
+        )
     await setup_bot_commands(application)
+    if job_queue.enabled:
+        # الوضع المنفصل: التحميل لدى العمال، والمهام القديمة لم يعد أحد ينتظرها
+        await job_queue.reset()
+        logger.info(f"🧵 الوضع المنفصل: مهام التحميل تُرسل إلى العمال عبر {job_queue.path}")
+    # منظف دوري للمجلدات المؤقتة اليتيمة في مجلد التحميل
+    # (بدون التنظيف الفوري عند البدء إذا كان العمال يكتبون في نفس المجلد)
+    application.create_task(disk_manager.run_janitor(reap_on_start=not job_queue.enabled))
+    # تنظيف الجلسات المنتهية تدريجياً
+    application.create_task(session_store.run_sweeper())
+    # حفظ تفضيلات المستخدمين على دفعات
+    application.create_task(prefs_store.run_writer())
+    # إرسال كتابات الحالة المشتركة على دفعات
+    if state_backend.shared:
+        application.create_task(state_writer.run())
+    # لقطة دورية لإحصائيات المجمّعات والمجدول والقرص والكاش في السجل
+    if STATS_LOG_INTERVAL > 0:
+        application.create_task(run_stats_logger(application, STATS_LOG_INTERVAL))
     bot_info = await application.bot.get_me()
     logger.info(
         f"✅ البوت يعمل بنجاح!\n"
@@ -156,6 +221,80 @@ async def post_init(application: Application):
     )
 
 
+async def register_webhook(application: Application, secret: str):
+    """
+    تسجيل الـ Webhook مرة واحدة: لا يُعاد التسجيل إذا كان مسجلاً بنفس الرابط والإعدادات،
+    ولا تُحذف التحديثات المعلقة (نسخة تُعاد تشغيلها لا يجب أن تُسقط رسائل النسخ الأخرى).
+    """
+    url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+    max_connections = min(max(WEBHOOK_MAX_CONNECTIONS, 1), 100)
+    info = await application.bot.get_webhook_info()
+    if (
+        info.url == url
+        and info.max_connections == max_connections
+        and set(info.allowed_updates or ()) == {str(getattr(t, "value", t)) for t in Update.ALL_TYPES}
+    ):
+        logger.info("Webhook is already registered, skipping set_webhook")
+        return
+    # الرمز السري لا يظهر في getWebhookInfo، لكنه ثابت (مشتق من التوكن أو من WEBHOOK_SECRET)؛
+    # عند تغيير WEBHOOK_SECRET يجب تنفيذ deleteWebhook أولاً حتى يُعاد التسجيل
+    await application.bot.set_webhook(
+        url=url,
+        secret_token=secret,
+        max_connections=max_connections,
+        allowed_updates=Update.ALL_TYPES,
+    )
+
+
+async def run_webhook(application: Application):
+    """
+    التشغيل بوضع Webhook عبر الخادم المدمج: تلغرام يرسل كل تحديث فور حدوثه
+    بدلاً من انتظار دورة Polling، ويمكن توزيع الطلبات على عدة نسخ خلف موازن أحمال.
+    """
+    from utils.webhook import WebhookServer, derive_secret_token
+
+    secret = WEBHOOK_SECRET or derive_secret_token(BOT_TOKEN)
+    server = WebhookServer(
+        application,
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        path=WEBHOOK_PATH,
+        secret_token=secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        ready_path=WEBHOOK_READY_PATH,
+    )
+    # لإحصائيات /stats
+    application.bot_data["webhook_server"] = server
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows
+            pass
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await server.start()
+    if WEBHOOK_REGISTER:
+        await register_webhook(application, secret)
+    await application.start()
+    logger.info(f"🌐 وضع Webhook: {WEBHOOK_URL}{WEBHOOK_PATH}")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
 def main():
     """نقطة الدخول الرئيسية"""
     logger.info("=" * 60)
@@ -164,6 +303,11 @@ def main():
 
     application = create_application()
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
+
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+        return
 
     # تشغيل البوت بوضع Polling
     application.run_polling(
@@ -0,0 +1,91 @@
+"""
+قياس أداء محدد المعدل مع عدد كبير من المستخدمين (100 ألف افتراضياً):
+زمن is_allowed لكل طلب والذاكرة المستخدمة، في الوضع المحلي ووضع الخادم المشترك
+(مع خادم ذاكري بنفس أوامر Redis لقياس كلفة البوت نفسه دون الشبكة).
+في الوضع المشترك تُكتب فترات التهدئة عبر state_writer ولا تُنفذ هنا، فيُقبل عدد أكبر.
+Rate limiter micro-benchmark
+
+الاستخدام:
+    python scripts/bench_rate_limiter.py
+    python scripts/bench_rate_limiter.py --users 100000 --requests 3
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+from pathlib import Path
+
+# إضافة مسار المشروع إلى sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.rate_limiter import RateLimiter
+from utils.state import MemoryBackend
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _report(name: str, samples: list[float], allowed: int, memory: int):
+    total = sum(samples)
+    print(
+        f"{name:<8} requests={len(samples):>8}  allowed={allowed:>8}  "
+        f"throughput={len(samples) / total:>10.0f}/s  "
+        f"p50={_percentile(samples, 0.5) * 1e6:6.2f}µs  p99={_percentile(samples, 0.99) * 1e6:6.2f}µs  "
+        f"memory={memory / 1024 / 1024:6.1f}MB"
+    )
+
+
+def bench_local(user_ids: list[int]) -> None:
+    limiter = RateLimiter(global_rate=0)
+    samples, allowed = [], 0
+    tracemalloc.start()
+    for user_id in user_ids:
+        started = time.perf_counter()
+        ok, _ = limiter.is_allowed(user_id)
+        samples.append(time.perf_counter() - started)
+        allowed += ok
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    _report("local", samples, allowed, memory)
+
+
+def bench_shared(user_ids: list[int]) -> None:
+    limiter = RateLimiter(global_rate=0)
+    backend = MemoryBackend()
+    samples, allowed = [], 0
+    tracemalloc.start()
+    for user_id in user_ids:
+        started = time.perf_counter()
+        limiter.prime(user_id, backend.execute(limiter.shared_commands(user_id)))
+        ok, _ = limiter.is_allowed(user_id)
+        samples.append(time.perf_counter() - started)
+        allowed += ok
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    _report("shared", samples, allowed, memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limiter micro-benchmark")
+    parser.add_argument("--users", type=int, default=100_000, help="عدد المستخدمين المختلفين")
+    parser.add_argument("--requests", type=int, default=3, help="متوسط الطلبات لكل مستخدم")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # تحذيرات تجاوز الحد تطغى على القياس
+    logging.disable(logging.WARNING)
+    random.seed(args.seed)
+    user_ids = [random.randrange(args.users) for _ in range(args.users * args.requests)]
+    print(f"{args.users} users, {len(user_ids)} requests (pid {os.getpid()})")
+    bench_local(user_ids)
+    bench_shared(user_ids)
+
+
+if __name__ == "__main__":
+    main()
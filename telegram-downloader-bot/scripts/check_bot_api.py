@@ -0,0 +1,42 @@
+"""
+فحص يدوي لخادم Bot API المحدد في BOT_API_URL: نفس الفحص الذي يجريه البوت عند البدء
+مع BOT_API_LOCAL_MODE=auto (utils.bot_api.probe_local_mode). يُنشئ ملفاً صغيراً في
+DOWNLOAD_PATH ويرسله بمساره إلى المحادثة المحددة ثم يحذف الرسالة:
+الخادم العام أو الخادم بدون --local يرفض الإرسال بالمسار.
+Check that the configured Bot API server accepts local file paths
+
+الاستخدام:
+    python scripts/check_bot_api.py --chat <chat_id>
+"""
+
+import sys
+import asyncio
+import argparse
+from pathlib import Path
+
+# إضافة مسار المشروع إلى sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config.settings import BOT_API_URL
+from utils.bot_api import probe_local_mode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that BOT_API_URL runs in --local mode")
+    parser.add_argument("--chat", type=int, required=True, help="محادثة يستطيع البوت الإرسال إليها (مثل معرّفك)")
+    args = parser.parse_args()
+
+    if not BOT_API_URL:
+        print("BOT_API_URL is not set: the public server never accepts local paths")
+        sys.exit(1)
+
+    if asyncio.run(probe_local_mode(args.chat)):
+        print("OK: the server accepts local paths (local mode)")
+        return
+    print("The server does not accept local paths: the bot will use public Bot API limits "
+          "(start it with --local and share DOWNLOAD_PATH at the same absolute path)")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+اختبار حمل لمعالج التحديثات (PerChatUpdateProcessor) بدون شبكة:
+عدد كبير من المحادثات المتزامنة (200 افتراضياً)، كل منها تبدأ تحميلاً طويلاً
+ثم ترسل /cancel ورسالة عادية. يقيس زمن الانتظار حتى يبدأ معالج كل تحديث
+(p50/p99) للإلغاء وللرسائل العادية، ويتحقق من الترتيب داخل كل محادثة.
+Load test for per-chat update processing latency
+
+الاستخدام:
+    python scripts/load_test_updates.py
+    python scripts/load_test_updates.py --chats 200 --download-seconds 3 --concurrency 64
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from pathlib import Path
+
+# إضافة مسار المشروع إلى sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Chat, Message, Update, User
+
+from handlers.commands import is_cancel_update
+from utils.update_processor import PerChatUpdateProcessor
+
+_update_ids = iter(range(1, 10**9))
+
+
+def _text_update(chat_id: int, text: str) -> Update:
+    user = User(chat_id, f"user{chat_id}", is_bot=False)
+    chat = Chat(chat_id, Chat.PRIVATE)
+    message = Message(next(_update_ids), datetime.now(timezone.utc), chat, from_user=user, text=text)
+    return Update(message.message_id, message=message)
+
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def run(chats: int, download_seconds: float, concurrency: int, gap: float):
+    processor = PerChatUpdateProcessor(concurrency, skip_lane=is_cancel_update)
+    latencies: dict[str, list[float]] = {"cancel": [], "message": []}
+    order: dict[int, list[str]] = {}
+    downloads: dict[int, asyncio.Task] = {}
+
+    async def handle(update: Update, kind: str, submitted: float):
+        chat_id = update.effective_chat.id
+        order.setdefault(chat_id, []).append(kind)
+        if kind == "download":
+            downloads[chat_id] = asyncio.current_task()
+            try:
+                await asyncio.sleep(download_seconds)
+            except asyncio.CancelledError:
+                pass
+            return
+        latencies[kind].append(time.perf_counter() - submitted)
+        if kind == "cancel" and chat_id in downloads:
+            downloads[chat_id].cancel()
+
+    async def submit(update: Update, kind: str):
+        submitted = time.perf_counter()
+        await processor.process_update(update, handle(update, kind, submitted))
+
+    async def chat(chat_id: int):
+        tasks = [asyncio.create_task(submit(_text_update(chat_id, "https://example.com/v"), "download"))]
+        await asyncio.sleep(gap)
+        tasks.append(asyncio.create_task(submit(_text_update(chat_id, "/cancel"), "cancel")))
+        tasks.append(asyncio.create_task(submit(_text_update(chat_id, "hello"), "message")))
+        await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(1, chats + 1)))
+    elapsed = time.perf_counter() - started
+
+    print(f"{chats} chats, concurrency {concurrency}, download {download_seconds}s, total {elapsed:.2f}s")
+    for kind, samples in latencies.items():
+        print(
+            f"{kind:<8} n={len(samples):>4}  p50={_percentile(samples, 0.5) * 1000:8.1f}ms  "
+            f"p99={_percentile(samples, 0.99) * 1000:8.1f}ms  max={max(samples, default=0) * 1000:8.1f}ms"
+        )
+    # الرسالة العادية يجب أن تُعالج بعد التحميل (أو إلغائه) في نفس المحادثة
+    out_of_order = sum(1 for kinds in order.values() if kinds.index("download") > kinds.index("message"))
+    print(f"out of order chats: {out_of_order}, processor stats: {processor.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-chat update processor load test")
+    parser.add_argument("--chats", type=int, default=200, help="عدد المحادثات المتزامنة")
+    parser.add_argument("--download-seconds", type=float, default=3.0, help="مدة التحميل المحاكى")
+    parser.add_argument("--concurrency", type=int, default=64, help="MAX_CONCURRENT_UPDATES")
+    parser.add_argument("--gap", type=float, default=0.05, help="التأخير بين بدء التحميل وإرسال /cancel")
+    args = parser.parse_args()
+    asyncio.run(run(args.chats, args.download_seconds, args.concurrency, args.gap))
+
+
+if __name__ == "__main__":
+    main()
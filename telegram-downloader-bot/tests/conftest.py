@@ -0,0 +1,10 @@
+"""إعداد مشترك للاختبارات: مسار المشروع ومتغيرات بيئة لا تتصل بأي خدمة خارجية"""
+
+import os
+import sys
+from pathlib import Path
+
+# إضافة مسار المشروع إلى sys.path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
@@ -0,0 +1,89 @@
+"""فحص الوضع المحلي لخادم Bot API مقابل خادم HTTP وهمي (محلي وغير محلي)"""
+
+import json
+import asyncio
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.bot_api import BotApiMode, bot_api, detect_local_mode, probe_local_mode
+
+
+def _stub_server(local: bool):
+    """خادم يقبل file:// في sendDocument فقط عندما local=True (مثل telegram-bot-api --local)"""
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = unquote(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+            method = self.path.rsplit("/", 1)[-1]
+            calls.append(method)
+            if method == "getMe":
+                result = {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "b", "username": "stub"}}
+            elif method == "sendDocument" and local and "file://" in body:
+                result = {"ok": True, "result": {"message_id": 5, "date": 0, "chat": {"id": 7, "type": "private"}}}
+            elif method == "deleteMessage":
+                result = {"ok": True, "result": True}
+            else:
+                result = {"ok": False, "error_code": 400, "description": "Bad Request: wrong HTTP URL specified"}
+            payload = json.dumps(result).encode()
+            self.send_response(200 if result["ok"] else 400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", calls
+
+
+@pytest.fixture
+def restore_mode():
+    yield
+    bot_api.apply(False)
+
+
+@pytest.mark.parametrize("local", [True, False])
+def test_probe_matches_server_mode(local, tmp_path):
+    server, url, calls = _stub_server(local)
+    try:
+        assert asyncio.run(probe_local_mode(7, base_url=url, directory=str(tmp_path))) is local
+    finally:
+        server.shutdown()
+    assert "sendDocument" in calls
+    # ملف الفحص يُحذف في الحالتين
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("local", [True, False])
+def test_detect_applies_limits(local, tmp_path, restore_mode):
+    server, url, _ = _stub_server(local)
+    try:
+        detected = asyncio.run(detect_local_mode("auto", chat_id=7, base_url=url, directory=str(tmp_path)))
+    finally:
+        server.shutdown()
+    expected = BotApiMode()
+    expected.apply(local)
+    assert detected is local
+    assert bot_api.local is local
+    assert bot_api.max_file_bytes == expected.max_file_bytes
+
+
+def test_unreachable_server_falls_back_to_public(tmp_path, restore_mode):
+    server, url, _ = _stub_server(True)
+    server.shutdown()
+    server.server_close()
+    assert asyncio.run(detect_local_mode("auto", chat_id=7, base_url=url, directory=str(tmp_path))) is False
+    assert bot_api.local is False
+
+
+def test_auto_without_probe_chat_uses_public_limits(restore_mode):
+    bot_api.apply(True)
+    assert asyncio.run(detect_local_mode("auto")) is False
+    assert bot_api.local is False
@@ -0,0 +1,65 @@
+"""حد المعدل في وضع الخادم المشترك: الطلبات المرفوضة لا تُحسب، والنتائج غير المستهلكة تنتهي"""
+
+import asyncio
+import importlib
+
+from utils.rate_limiter import RateLimiter, _PRIMED_MAX_AGE
+from utils.state import MemoryBackend, WriteBehind
+
+# utils يعيد تصدير المثيل rate_limiter بنفس اسم الوحدة
+rate_limiter_module = importlib.import_module("utils.rate_limiter")
+
+
+def _request(limiter: RateLimiter, backend: MemoryBackend, writer: WriteBehind, user_id: int):
+    """تحديث واحد كما في load_user ثم المعالج: رحلة الخادم، ثم is_allowed، ثم تفريغ الكتابات"""
+    limiter.prime(user_id, backend.execute(limiter.shared_commands(user_id)))
+    result = limiter.is_allowed(user_id)
+    asyncio.run(writer.flush())
+    return result
+
+
+def test_rejected_requests_are_not_counted(monkeypatch):
+    backend = MemoryBackend()
+    writer = WriteBehind(backend)
+    monkeypatch.setattr(rate_limiter_module, "state_writer", writer)
+    limiter = RateLimiter(max_requests=2, window=3600, cooldown=0, global_rate=0)
+
+    assert _request(limiter, backend, writer, 1)[0]
+    assert _request(limiter, backend, writer, 1)[0]
+    for _ in range(5):
+        assert not _request(limiter, backend, writer, 1)[0]
+
+    window_key = limiter.shared_commands(1)[1][1]
+    limiter._window_elapsed.clear()
+    # طلبان مقبولان فقط رغم سبعة طلبات
+    assert backend.execute([("GET", window_key)]) == ["2"]
+
+
+def test_global_rejection_is_refunded(monkeypatch):
+    backend = MemoryBackend()
+    writer = WriteBehind(backend)
+    monkeypatch.setattr(rate_limiter_module, "state_writer", writer)
+    limiter = RateLimiter(max_requests=10, window=3600, cooldown=0, global_rate=0.001, global_burst=1)
+
+    assert _request(limiter, backend, writer, 1)[0]
+    assert not _request(limiter, backend, writer, 1)[0]
+    window_key = limiter.shared_commands(1)[1][1]
+    assert backend.execute([("GET", window_key)]) == ["1"]
+
+
+def test_unconsumed_results_expire_by_age(monkeypatch):
+    limiter = RateLimiter(max_requests=10, window=60)
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limiter_module.time, "monotonic", lambda: clock[0])
+
+    for user_id in range(5):
+        limiter.shared_commands(user_id)
+        limiter.prime(user_id, [-2, 1, 1, None])
+    limiter.shared_commands(99)
+    assert len(limiter._primed) == 5 and len(limiter._window_elapsed) == 1
+
+    clock[0] += _PRIMED_MAX_AGE + 1
+    limiter.shared_commands(100)
+    # القديمة حُذفت دون مسح الجديدة
+    assert not limiter._primed
+    assert list(limiter._window_elapsed) == [100]
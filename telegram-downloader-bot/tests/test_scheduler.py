@@ -0,0 +1,78 @@
+"""ترتيب المجدول ومواقع الانتظار المحسوبة مرة واحدة لكل تغيير"""
+
+import asyncio
+from collections import deque
+
+from utils.scheduler import JobScheduler, _Job
+
+
+def _queue(scheduler: JobScheduler, user_id: int, cost: int) -> _Job:
+    job = _Job(user_id, cost, next(scheduler._seq))
+    scheduler._queues.setdefault(user_id, deque()).append(job)
+    scheduler._positions = None
+    return job
+
+
+def test_order_is_cheapest_head_first_and_fifo_per_user():
+    scheduler = JobScheduler(max_concurrent=1, aging_bytes=0)
+    a1 = _queue(scheduler, 1, 100)
+    a2 = _queue(scheduler, 1, 1)
+    b1 = _queue(scheduler, 2, 50)
+    c1 = _queue(scheduler, 3, 75)
+
+    # مهمة المستخدم 1 الثانية رخيصة لكنها لا تتنافس قبل الأولى
+    assert scheduler._ordered_jobs() == [b1, c1, a1, a2]
+    assert [scheduler.position(j) for j in (a1, a2, b1, c1)] == [3, 4, 1, 2]
+
+
+def test_positions_are_computed_once_per_change():
+    scheduler = JobScheduler(max_concurrent=1, aging_bytes=0)
+    jobs = [_queue(scheduler, user_id, user_id) for user_id in range(200)]
+    calls = []
+    ordered_jobs = scheduler._ordered_jobs
+    scheduler._ordered_jobs = lambda: calls.append(1) or ordered_jobs()
+
+    assert [scheduler.position(j) for j in jobs] == list(range(1, 201))
+    assert len(calls) == 1
+
+    scheduler._remove(jobs[0])
+    assert scheduler.position(jobs[1]) == 1
+    assert scheduler.position(jobs[0]) == 0
+    assert len(calls) == 2
+
+
+def test_run_reports_positions_and_dispatches_in_order():
+    scheduler = JobScheduler(max_concurrent=1, aging_bytes=0)
+    started = []
+    reported = {}
+
+    async def main():
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        first = asyncio.ensure_future(scheduler.run(0, 1, blocker))
+        await asyncio.sleep(0)
+
+        def job(name):
+            async def _run():
+                started.append(name)
+            return _run
+
+        async def on_queued(name, position, eta):
+            reported.setdefault(name, position)
+
+        waiters = [
+            asyncio.ensure_future(scheduler.run(
+                user_id, cost, job(name), on_queued=lambda p, e, n=name: on_queued(n, p, e),
+            ))
+            for user_id, cost, name in ((1, 300, "big"), (2, 100, "small"), (3, 200, "medium"))
+        ]
+        await asyncio.sleep(0.05)
+        gate.set()
+        await asyncio.gather(first, *waiters)
+
+    asyncio.run(main())
+    assert started == ["small", "medium", "big"]
+    assert reported["big"] == 1 and reported["medium"] == 2
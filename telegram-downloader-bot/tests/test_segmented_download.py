@@ -0,0 +1,125 @@
+"""التحميل المجزأ مقابل خادم HTTP محلي: مع Range، بدونه، ومع انقطاع جزء أثناء النقل"""
+
+import os
+import re
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils.downloader import RangeNotSupported, segmented_download
+
+CHUNK = 64 * 1024
+PAYLOAD = random.Random(13).randbytes(CHUNK * 10 + 12345)
+
+
+def _server(ranges: bool = True, fail_at: int | None = None):
+    """
+    خادم يقدّم PAYLOAD. ranges=False يتجاهل Range ويرسل الملف كاملاً (200).
+    fail_at: أول طلب يبدأ عند هذا الموضع يُقطع اتصاله بعد إرسال نصف مداه.
+    """
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+            if not ranges or not match:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(PAYLOAD)))
+                self.end_headers()
+                self.wfile.write(PAYLOAD)
+                return
+            start, end = int(match[1]), min(int(match[2]), len(PAYLOAD) - 1)
+            requests.append((start, end))
+            body = PAYLOAD[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if start == fail_at and requests.count((start, end)) == 1:
+                self.wfile.write(body[:len(body) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        def handle_error(self, request, client_address):
+            # العميل يغلق الاتصال عمداً (رفض الرد 200 مثلاً)
+            pass
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def _start(**options):
+        server, requests = _server(**options)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/video.mp4", requests
+
+    yield _start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_reassembled_file_is_byte_identical(serve, tmp_path):
+    url, requests = serve()
+    dest = str(tmp_path / "video.mp4")
+    progress = []
+
+    total = segmented_download(url, dest, progress_hook=progress.append, max_connections=4, chunk_size=CHUNK)
+
+    assert total == len(PAYLOAD)
+    with open(dest, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert not os.path.exists(dest + ".part")
+    # طلب الفحص (بايت واحد) ثم مدى لكل جزء
+    assert len([r for r in requests if r != (0, 0)]) == -(-len(PAYLOAD) // CHUNK)
+    assert progress[-1]["status"] == "finished"
+
+
+def test_server_without_range_support(serve, tmp_path):
+    url, _ = serve(ranges=False)
+    dest = str(tmp_path / "video.mp4")
+
+    with pytest.raises(RangeNotSupported):
+        segmented_download(url, dest, chunk_size=CHUNK)
+    assert not os.listdir(tmp_path)
+
+
+def test_max_size_is_checked_before_downloading(serve, tmp_path):
+    url, requests = serve()
+
+    with pytest.raises(RangeNotSupported):
+        segmented_download(url, str(tmp_path / "video.mp4"), chunk_size=CHUNK, max_size=len(PAYLOAD) - 1)
+    assert requests == [(0, 0)]
+    assert not os.listdir(tmp_path)
+
+
+def test_segment_failing_mid_transfer_is_resumed(serve, tmp_path):
+    fail_at = CHUNK * 3
+    url, requests = serve(fail_at=fail_at)
+    dest = str(tmp_path / "video.mp4")
+
+    segmented_download(url, dest, max_connections=4, chunk_size=CHUNK)
+
+    with open(dest, "rb") as f:
+        assert f.read() == PAYLOAD
+    # الجزء المقطوع يُستأنف من حيث توقف بدلاً من إعادته من بدايته
+    end = fail_at + CHUNK - 1
+    assert (fail_at, end) in requests
+    assert (fail_at + CHUNK // 2, end) in requests
@@ -0,0 +1,165 @@
+"""عميل RESP مقابل الخادم البديل المحلي (serve_standin)، وإعادة المحاولة، وكتابة الجلسة"""
+
+import socket
+import asyncio
+import threading
+
+import pytest
+
+import utils.user_manager as user_manager
+from utils.state import MemoryBackend, RespBackend, StateBackend, StateError, WriteBehind, serve_standin
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Standin:
+    """serve_standin في حلقة أحداث بخيط مستقل، مع إمكانية إيقافه وإعادة تشغيله"""
+
+    def __init__(self):
+        self.port = _free_port()
+        self.backend = MemoryBackend()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.start()
+
+    def start(self):
+        self.task = asyncio.run_coroutine_threadsafe(self._serve(), self.loop)
+        for _ in range(100):
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                threading.Event().wait(0.02)
+        raise RuntimeError("stand-in did not start")
+
+    async def _serve(self):
+        await serve_standin(port=self.port, backend=self.backend)
+
+    def stop(self):
+        """إيقاف الخادم وإغلاق كل الاتصالات القائمة (مثل إعادة تشغيل Redis)"""
+        def _cancel_all():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+        self.loop.call_soon_threadsafe(_cancel_all)
+        threading.Event().wait(0.2)
+
+
+@pytest.fixture
+def standin():
+    server = _Standin()
+    yield server
+    server.stop()
+    server.loop.call_soon_threadsafe(server.loop.stop)
+
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_pipeline_roundtrip(standin):
+    backend = RespBackend("127.0.0.1", standin.port)
+    results = backend.execute([
+        ("SET", "k", "v", "EX", 60),
+        ("GET", "k"),
+        ("INCR", "n"),
+        ("INCR", "n"),
+        ("HSET", "h", "a", 1, "b", {"x": 1}),
+        ("HDEL", "h", "a"),
+        ("HGETALL", "h"),
+        ("GET", "missing"),
+    ])
+    assert results == ["OK", "v", 1, 2, 2, 1, {"b": '{"x":1}'}, None]
+    assert 0 < backend.execute([("PTTL", "k")])[0] <= 60000
+    backend.close()
+
+
+def test_reconnects_after_server_restart(standin):
+    backend = RespBackend("127.0.0.1", standin.port)
+    assert backend.execute([("INCR", "n")]) == [1]
+    old_sock = backend._sock
+    standin.stop()
+    standin.start()
+    # الاتصال القديم أُغلق أثناء الخمول: يُستبدل قبل الكتابة فيُحسب INCR مرة واحدة
+    assert backend.execute([("INCR", "n")]) == [2]
+    assert backend._sock is not old_sock
+    assert backend.execute([("GET", "n")]) == ["2"]
+    backend.close()
+
+
+def _dropping_server():
+    """خادم يقرأ الأوامر ثم يغلق الاتصال دون رد (انقطاع بعد الكتابة)"""
+    received = []
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def _serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            data = conn.recv(65536)
+            received.append(data)
+            conn.close()
+
+    threading.Thread(target=_serve, daemon=True).start()
+    return listener, received
+
+
+def test_write_failure_does_not_resend_incr():
+    listener, received = _dropping_server()
+    backend = RespBackend("127.0.0.1", listener.getsockname()[1])
+    with pytest.raises(StateError):
+        backend.execute([("INCR", "rate:1"), ("PEXPIRE", "rate:1", 60000)])
+    assert len(received) == 1
+
+    # أوامر قابلة للتكرار تُعاد مرة واحدة باتصال جديد
+    with pytest.raises(StateError):
+        backend.execute([("GET", "k")])
+    assert len(received) == 3
+    listener.close()
+
+
+class _RecordingBackend(MemoryBackend):
+    shared = True
+
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    def execute(self, commands):
+        self.commands += commands
+        return super().execute(commands)
+
+
+def test_session_writes_only_changed_fields(monkeypatch):
+    backend = _RecordingBackend()
+    writer = WriteBehind(backend)
+    monkeypatch.setattr(user_manager, "state_backend", backend)
+    monkeypatch.setattr(user_manager, "state_writer", writer)
+    user_id = 424242
+    key = user_manager.state_key("session", user_id)
+
+    async def main():
+        user_manager.set_user_video_info(user_id, {"title": "t", "formats": list(range(50))})
+        user_manager.set_user_state(user_id, "waiting_quality")
+        await writer.flush()
+        user_manager.set_user_state(user_id, "downloading")
+        user_manager.set_user_url(user_id, "https://example.com/v")
+        await writer.flush()
+        stored = backend.execute([("HGETALL", key)])[0]
+        user_manager.clear_user_session(user_id)
+        await writer.flush()
+        return stored
+
+    stored = asyncio.run(main())
+    video_info_writes = [c for c in backend.commands if c[0] == "HSET" and "video_info" in c]
+    assert len(video_info_writes) == 1
+    assert stored["state"] == "downloading"
+    assert stored["url"] == "https://example.com/v"
+    assert '"title":"t"' in stored["video_info"]
+    assert backend.execute([("HGETALL", key)]) == [{}]
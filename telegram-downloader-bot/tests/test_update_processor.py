@@ -0,0 +1,92 @@
+"""PerChatUpdateProcessor: ترتيب التحديثات داخل المحادثة، والتوازي بين المحادثات، وتحرير الدور مبكراً"""
+
+import asyncio
+from datetime import datetime, timezone
+from itertools import count
+
+from telegram import Chat, Message, Update, User
+
+from utils.update_processor import PerChatUpdateProcessor, release_chat_lane
+
+_ids = count(1)
+
+
+def _update(chat_id: int, text: str = "x") -> Update:
+    user = User(chat_id, f"user{chat_id}", is_bot=False)
+    message = Message(next(_ids), datetime.now(timezone.utc), Chat(chat_id, Chat.PRIVATE), from_user=user, text=text)
+    return Update(message.message_id, message=message)
+
+
+def test_same_chat_updates_run_in_arrival_order():
+    processor = PerChatUpdateProcessor(16)
+    events = []
+
+    async def handle(n: int, delay: float):
+        events.append(("start", n))
+        await asyncio.sleep(delay)
+        events.append(("end", n))
+
+    async def main():
+        # الأول أبطأ: لو عولجت بالتوازي لانتهى الثاني والثالث قبله
+        await asyncio.gather(*(
+            processor.process_update(_update(1), handle(n, delay))
+            for n, delay in ((1, 0.2), (2, 0.05), (3, 0))
+        ))
+
+    asyncio.run(main())
+    assert events == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    assert processor.stats()["active_chats"] == 0
+
+
+def test_different_chats_run_concurrently():
+    processor = PerChatUpdateProcessor(16)
+    running = set()
+    overlap = []
+
+    async def handle(chat_id: int):
+        running.add(chat_id)
+        await asyncio.sleep(0.05)
+        overlap.append(len(running))
+        running.discard(chat_id)
+
+    async def main():
+        await asyncio.gather(*(processor.process_update(_update(c), handle(c)) for c in range(1, 11)))
+
+    elapsed = asyncio.run(_timed(main))
+    assert max(overlap) == 10
+    assert elapsed < 0.5
+
+
+async def _timed(main) -> float:
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await main()
+    return loop.time() - started
+
+
+def test_released_lane_lets_next_update_start_during_long_work():
+    processor = PerChatUpdateProcessor(16)
+    events = []
+
+    async def download():
+        events.append("download queued")
+        release_chat_lane()
+        await asyncio.sleep(0.2)
+        events.append("download done")
+
+    async def message():
+        events.append("next message")
+
+    async def main():
+        first = asyncio.ensure_future(processor.process_update(_update(1), download()))
+        await asyncio.sleep(0)
+        await processor.process_update(_update(1, "hello"), message())
+        await first
+
+    asyncio.run(main())
+    assert events == ["download queued", "next message", "download done"]
+    assert processor.stats()["active_chats"] == 0
+
+
+def test_release_outside_processor_is_harmless():
+    release_chat_lane()
@@ -0,0 +1,104 @@
+"""خادم Webhook المدمج: الرمز السري، وتسليم التحديث للطابور، ومسار الجاهزية"""
+
+import json
+import asyncio
+
+from telegram import Update
+
+from utils.webhook import WebhookServer, derive_secret_token
+
+SECRET = derive_secret_token("123456:TEST")
+UPDATE = {
+    "update_id": 17,
+    "message": {
+        "message_id": 5, "date": 0,
+        "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "u"},
+        "text": "https://example.com/v",
+    },
+}
+
+
+class _Application:
+    """ما يستخدمه الخادم من telegram.ext.Application فقط"""
+
+    def __init__(self, running: bool = True):
+        self.running = running
+        self.bot = None
+        self.update_queue: asyncio.Queue = asyncio.Queue()
+
+
+async def _request(port: int, method: str, path: str, body: bytes = b"", headers: dict | None = None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(body)}\r\nConnection: close\r\n"
+    for name, value in (headers or {}).items():
+        head += f"{name}: {value}\r\n"
+    writer.write(head.encode() + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    return int(status_line.split()[1]), rest.partition(b"\r\n\r\n")[2]
+
+
+def _run(scenario, running: bool = True):
+    async def main():
+        application = _Application(running)
+        server = WebhookServer(application, "127.0.0.1", 0, "/webhook", SECRET, 8, "/ready")
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        try:
+            return await scenario(port, application, server)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_wrong_secret_is_rejected():
+    async def scenario(port, application, server):
+        body = json.dumps(UPDATE).encode()
+        wrong = await _request(port, "POST", "/webhook", body, {"X-Telegram-Bot-Api-Secret-Token": "nope"})
+        missing = await _request(port, "POST", "/webhook", body)
+        return wrong[0], missing[0], application.update_queue.qsize()
+
+    assert _run(scenario) == (403, 403, 0)
+
+
+def test_valid_update_is_dispatched():
+    async def scenario(port, application, server):
+        status, _ = await _request(
+            port, "POST", "/webhook", json.dumps(UPDATE).encode(), {"X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        update = await asyncio.wait_for(application.update_queue.get(), 1)
+        return status, update, server.received
+
+    status, update, received = _run(scenario)
+    assert status == 200
+    assert isinstance(update, Update)
+    assert update.update_id == 17 and update.message.text == "https://example.com/v"
+    assert received == 1
+
+
+def test_invalid_payload_and_unknown_paths():
+    async def scenario(port, application, server):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        return (
+            (await _request(port, "POST", "/webhook", b"{not json", headers))[0],
+            (await _request(port, "GET", "/webhook"))[0],
+            (await _request(port, "POST", "/other", b"{}", headers))[0],
+        )
+
+    assert _run(scenario) == (400, 405, 404)
+
+
+def test_ready_path_follows_application_state():
+    async def scenario(port, application, server):
+        starting = await _request(port, "GET", "/ready")
+        application.running = True
+        ready = await _request(port, "GET", "/ready")
+        return starting, ready
+
+    starting, ready = _run(scenario, running=False)
+    assert starting == (503, b"starting")
+    assert ready == (200, b"ok")
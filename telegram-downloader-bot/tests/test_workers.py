@@ -0,0 +1,70 @@
+"""مهلة مجمّع العمليات: إنهاء عملية المهمة العالقة وحدها دون المساس بالمهام الأخرى"""
+
+import os
+import time
+import asyncio
+
+import pytest
+
+from utils.workers import JobTimeoutError, WorkerPool
+
+
+def _hang(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _healthy(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _fail():
+    raise ValueError("bad input")
+
+
+def test_timeout_kills_only_the_hanging_job():
+    pool = WorkerPool("test", 2, 2, {}, use_processes=True, timeout=1.5)
+
+    async def main():
+        hanging = asyncio.ensure_future(pool.run(_hang, 60))
+        await asyncio.sleep(0.8)
+        # المهمة السليمة تبدأ قبل إنهاء العالقة وتنتهي بعده
+        healthy = asyncio.ensure_future(pool.run(_healthy, 1.2))
+        with pytest.raises(JobTimeoutError):
+            await hanging
+        assert not healthy.done()
+        assert await healthy not in (None, os.getpid())
+        # مهمة جديدة تعمل مباشرة بعد ذلك
+        assert await pool.run(_healthy, 0) not in (None, os.getpid())
+
+    started = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - started < 20
+    assert pool.killed == 1
+    assert not pool._processes
+
+
+def test_worker_exception_is_raised_in_caller():
+    pool = WorkerPool("test", 1, 1, {}, use_processes=True, timeout=10)
+    with pytest.raises(ValueError, match="bad input"):
+        asyncio.run(pool.run(_fail))
+    assert pool.killed == 0
+
+
+def test_cancelling_the_waiter_kills_its_process():
+    pool = WorkerPool("test", 1, 1, {}, use_processes=True, timeout=60)
+
+    async def main():
+        task = asyncio.ensure_future(pool.run(_hang, 60))
+        await asyncio.sleep(1)
+        process = next(iter(pool._processes))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        process.join(5)
+        return process
+
+    process = asyncio.run(main())
+    assert not process.is_alive()
+    assert pool.killed == 1
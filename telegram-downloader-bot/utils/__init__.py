@@ -1,4 +1,7 @@
-from .url_validator import is_valid_url, is_supported_platform, detect_platform, extract_url_from_text, clean_url
+from .url_validator import (
+    is_valid_url, is_supported_platform, detect_platform, platform_id,
+    extract_url_from_text, clean_url, media_key,
+)
 from .rate_limiter import rate_limiter
 from .formatters import format_file_size, format_duration, format_views, format_date, truncate_title
 from .user_manager import (
@@ -7,4 +10,5 @@ from .user_manager import (
     get_user_url, set_user_url,
     get_user_video_info, set_user_video_info,
     clear_user_session, init_user,
+    load_user, increment_user_downloads,
 )
@@ -0,0 +1,109 @@
+"""
+وضع خادم Bot API الفعلي (محلي أو عام) وحدود الإرسال المترتبة عليه.
+في الوضع "auto" يُفحص الخادم عند البدء (post_init) بإرسال ملف صغير بمساره على القرص:
+الخادم المحلي (--local) يقبله، والخادم العام أو غير المحلي يرفضه فتُستخدم حدوده ورفع المحتوى.
+Effective Bot API mode and upload limits, detected at startup
+"""
+
+import os
+import logging
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from telegram import Bot
+from telegram.error import TelegramError
+
+from config.settings import (
+    BOT_TOKEN, BOT_API_URL, BOT_API_LOCAL_MODE, BOT_API_PROBE_CHAT_ID, UPLOAD_STAGING_CHAT_ID, ADMIN_IDS,
+    DOWNLOAD_PATH, PUBLIC_MAX_FILE_SIZE_MB, LOCAL_MAX_FILE_SIZE_MB, DISK_BUDGET_MB, SPLIT_MAX_PARTS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BotApiMode:
+    """
+    الوضع الفعلي وحدوده. قبل الفحص (وفي عمليات العمال التي لا تفحص الخادم)
+    تُستخدم حدود الخادم العام، والواجهة ترسل الحدود الفعلية مع كل مهمة.
+    """
+
+    def __init__(self):
+        self.apply(False)
+
+    def apply(self, local: bool):
+        self.local = local
+        self.max_file_mb = LOCAL_MAX_FILE_SIZE_MB if local else PUBLIC_MAX_FILE_SIZE_MB
+        self.max_file_bytes = self.max_file_mb * 1024 * 1024
+        # أقصى حجم فيديو يُحمَّل ثم يُقسّم إلى أجزاء (محدود بثلث ميزانية القرص)
+        self.max_video_bytes = min(
+            self.max_file_bytes * max(1, SPLIT_MAX_PARTS),
+            max(self.max_file_bytes, DISK_BUDGET_MB * 1024 * 1024 // 3),
+        )
+
+    @property
+    def max_video_mb(self) -> int:
+        return self.max_video_bytes // (1024 * 1024)
+
+
+async def probe_local_mode(
+    chat_id: int, base_url: Optional[str] = None, token: Optional[str] = None, directory: Optional[str] = None,
+) -> bool:
+    """
+    هل يقبل الخادم الإرسال بالمسار المحلي؟ يُنشئ ملفاً صغيراً في directory ويرسله
+    بمساره إلى chat_id ثم يحذف الرسالة. أي خطأ (رفض المسار، خادم لا يستجيب) = لا.
+    القيم الافتراضية: BOT_API_URL وBOT_TOKEN وDOWNLOAD_PATH.
+    """
+    base_url = base_url or BOT_API_URL
+    directory = directory or DOWNLOAD_PATH
+    bot = Bot(
+        token or BOT_TOKEN, base_url=f"{base_url}/bot", base_file_url=f"{base_url}/file/bot", local_mode=True,
+    )
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="bot_api_check_", suffix=".txt", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write("local mode check\n")
+        async with bot:
+            # في local_mode ترسل المكتبة file://<المسار المطلق> بدلاً من محتوى الملف
+            message = await bot.send_document(chat_id, Path(path).absolute(), disable_notification=True)
+            try:
+                await bot.delete_message(chat_id, message.message_id)
+            except TelegramError:
+                pass
+        return True
+    except TelegramError as e:
+        logger.info(f"Bot API server at {base_url} rejected a local path: {e}")
+        return False
+    finally:
+        os.remove(path)
+
+
+def _probe_chat() -> Optional[int]:
+    """محادثة يستطيع البوت الإرسال إليها لفحص الخادم"""
+    return BOT_API_PROBE_CHAT_ID or UPLOAD_STAGING_CHAT_ID or (min(ADMIN_IDS) if ADMIN_IDS else None)
+
+
+async def detect_local_mode(mode: str = BOT_API_LOCAL_MODE, chat_id: Optional[int] = None, **probe_options) -> bool:
+    """
+    تحديد الوضع الفعلي عند البدء حسب BOT_API_LOCAL_MODE وتطبيق حدوده.
+    probe_options تُمرَّر إلى probe_local_mode (base_url, token, directory).
+    """
+    if mode == "auto":
+        chat_id = chat_id or _probe_chat()
+        if chat_id is None:
+            logger.warning(
+                "BOT_API_LOCAL_MODE=auto needs BOT_API_PROBE_CHAT_ID, UPLOAD_STAGING_CHAT_ID or ADMIN_IDS "
+                "to probe the server; using public Bot API limits"
+            )
+            local = False
+        else:
+            local = await probe_local_mode(chat_id, **probe_options)
+    else:
+        local = mode == "true"
+    bot_api.apply(local)
+    return local
+
+
+# مثيل عام واحد للاستخدام في جميع أنحاء البوت
+bot_api = BotApiMode()
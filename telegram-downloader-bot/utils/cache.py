@@ -0,0 +1,315 @@
+"""
+وحدة الكاش: كاش في الذاكرة (TTL + LRU) مع طبقة اختيارية على القرص (SQLite)
+In-process TTL/LRU cache with an optional on-disk SQLite tier
+"""
+
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config.settings import (
+    CACHE_DB_PATH,
+    METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES, METADATA_CACHE_MAX_MB,
+    FILE_ID_CACHE_TTL, FILE_ID_CACHE_MAX_ENTRIES,
+)
+from utils.state import state_backend, state_key
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """
+    طبقة تخزين دائمة بسيطة (مفتاح → قيمة JSON) مع تاريخ انتهاء.
+    جميع الدوال متزامنة ويجب استدعاؤها من خيط عامل وليس من حلقة الأحداث.
+    """
+
+    def __init__(self, path: str, table: str):
+        self.path = path
+        self.table = table
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        """قراءة قيمة غير منتهية الصلاحية. Returns (value, expires_at) or None."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            value, expires_at = row
+            if expires_at < time.time():
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            return value, expires_at
+
+    def set(self, key: str, value: str, expires_at: float):
+        """كتابة قيمة مع تاريخ انتهائها"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            conn.commit()
+
+    def delete(self, key: str):
+        """حذف قيمة"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            conn.commit()
+
+    def purge_expired(self) -> int:
+        """حذف جميع القيم المنتهية، وإرجاع عددها"""
+        with self._lock:
+            conn = self._connect()
+            cur = conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),)
+            )
+            conn.commit()
+            return cur.rowcount
+
+
+class TTLCache:
+    """
+    كاش في الذاكرة محدود بعدد العناصر وبالحجم التقريبي بالبايت.
+    - كل عنصر له مدة صلاحية (TTL)
+    - الإخلاء حسب الأقدم استخداماً (LRU)
+    - عدادات للإصابة والإخفاق
+    - طبقة اختيارية على القرص حتى لا يبدأ البوت بكاش فارغ بعد إعادة التشغيل
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: int,
+        max_entries: int,
+        max_bytes: int,
+        store: Optional[SQLiteStore] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        # {key: (expires_at, size_bytes, value)}
+        self._data: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # ===== طبقة الذاكرة (متزامنة وسريعة) =====
+
+    def get(self, key: str) -> Any:
+        """قراءة من الذاكرة فقط. Returns None on miss."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[int] = None, expires_at: float = None):
+        """إضافة عنصر إلى الذاكرة مع إخلاء الأقدم عند تجاوز الحدود"""
+        if size > self.max_bytes:
+            # عنصر أكبر من الكاش بأكمله — لا فائدة من تخزينه في الذاكرة
+            return
+        if key in self._data:
+            self._remove(key)
+        if expires_at is None:
+            expires_at = time.time() + (ttl or self.ttl)
+        self._data[key] = (expires_at, size, value)
+        self._bytes += size
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            old_key = next(iter(self._data))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        """حذف عنصر من الذاكرة"""
+        if key in self._data:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    # ===== واجهة غير متزامنة (الذاكرة ثم القرص) =====
+
+    async def aget(self, key: str) -> Any:
+        """قراءة من الذاكرة ثم من القرص (في خيط عامل)"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.store is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                loaded = await loop.run_in_executor(None, self._load_from_store, key)
+            except Exception as e:
+                logger.warning(f"Cache '{self.name}' disk read failed for {key}: {e}")
+                loaded = None
+            if loaded is not None:
+                value, size, expires_at = loaded
+                self.set(key, value, size, expires_at=expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def aset(self, key: str, value: Any, ttl: Optional[int] = None):
+        """كتابة في الذاكرة والقرص. يتم التسلسل (JSON) في خيط عامل."""
+        expires_at = time.time() + (ttl or self.ttl)
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(
+                None, self._serialize_and_store, key, value, expires_at
+            )
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' write failed for {key}: {e}")
+            return
+        self.set(key, value, size, expires_at=expires_at)
+
+    async def adelete(self, key: str):
+        """حذف عنصر من الذاكرة والقرص"""
+        self.delete(key)
+        if self.store is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self.store.delete, key)
+            except Exception as e:
+                logger.warning(f"Cache '{self.name}' disk delete failed for {key}: {e}")
+
+    def _serialize_and_store(self, key: str, value: Any, expires_at: float) -> int:
+        payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+        if self.store is not None:
+            self.store.set(key, payload, expires_at)
+        return len(payload.encode("utf-8"))
+
+    def _load_from_store(self, key: str) -> Optional[tuple[Any, int, float]]:
+        row = self.store.get(key)
+        if row is None:
+            return None
+        payload, expires_at = row
+        return json.loads(payload), len(payload.encode("utf-8")), expires_at
+
+    def stats(self) -> dict:
+        """إحصائيات الكاش"""
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class SharedStore:
+    """
+    طبقة الكاش في خادم الحالة المشترك (نفس واجهة SQLiteStore) حتى تتشارك
+    كل نسخ البوت معرّفات الملفات ومعلومات الفيديو.
+    """
+
+    def __init__(self, backend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        full_key = state_key(self.namespace, key)
+        value, ttl_ms = self.backend.execute([("GET", full_key), ("PTTL", full_key)])
+        if value is None:
+            return None
+        return value, time.time() + max(ttl_ms, 0) / 1000
+
+    def set(self, key: str, value: str, expires_at: float):
+        ttl_ms = int((expires_at - time.time()) * 1000)
+        if ttl_ms > 0:
+            self.backend.execute([("SET", state_key(self.namespace, key), value, "PX", ttl_ms)])
+
+    def delete(self, key: str):
+        self.backend.execute([("DEL", state_key(self.namespace, key))])
+
+    def purge_expired(self) -> int:
+        # الخادم يحذف المفاتيح المنتهية بنفسه
+        return 0
+
+
+def _make_store(table: str) -> Optional[SQLiteStore | SharedStore]:
+    """إنشاء طبقة التخزين: الخادم المشترك إن وُجد، وإلا SQLite إذا تم تحديد CACHE_DB_PATH"""
+    if state_backend.shared:
+        return SharedStore(state_backend, table)
+    if not CACHE_DB_PATH:
+        return None
+    return SQLiteStore(CACHE_DB_PATH, table)
+
+
+# كاش معلومات الفيديو (نتيجة extract_info) مفتاحه المعرّف الموحد للوسائط
+metadata_cache = TTLCache(
+    name="metadata",
+    ttl=METADATA_CACHE_TTL,
+    max_entries=METADATA_CACHE_MAX_ENTRIES,
+    max_bytes=METADATA_CACHE_MAX_MB * 1024 * 1024,
+    store=_make_store("metadata_cache"),
+)
+
+
+# كاش واصفات الوسائط المضغوطة (VideoInfo) في الذاكرة فقط: قوائم الجودات تُحسب مرة
+# واحدة وتُشارك بين المستخدمين بدلاً من نسخها لكل جلسة
+media_info_cache = TTLCache(
+    name="media_info",
+    ttl=METADATA_CACHE_TTL,
+    max_entries=METADATA_CACHE_MAX_ENTRIES,
+    max_bytes=METADATA_CACHE_MAX_ENTRIES * 8 * 1024,
+)
+
+
+# كاش معرّفات الملفات في تلغرام (file_id) لإعادة الإرسال الفوري دون تحميل أو رفع
+# {media_key|quality_label|kind: {"file_ids": [...], "size": bytes}}
+file_id_cache = TTLCache(
+    name="file_ids",
+    ttl=FILE_ID_CACHE_TTL,
+    max_entries=FILE_ID_CACHE_MAX_ENTRIES,
+    max_bytes=FILE_ID_CACHE_MAX_ENTRIES * 1024,
+    store=_make_store("file_id_cache"),
+)
+
+
+def file_id_key(key: str, quality_label: str, kind: str) -> str:
+    """مفتاح كاش file_id: المعرّف الموحد + الجودة + النوع (video/audio)"""
+    return f"{key}|{quality_label}|{kind}"
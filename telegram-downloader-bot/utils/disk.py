@@ -0,0 +1,376 @@
+"""
+وحدة إدارة مساحة القرص لمجلد التحميل: ميزانية بالبايت، قبول المهام حسب المساحة،
+ومنظف دوري للمجلدات المؤقتة اليتيمة
+Disk budget manager and janitor for DOWNLOAD_PATH
+"""
+
+import os
+import time
+import shutil
+import socket
+import asyncio
+import logging
+import secrets
+import sqlite3
+import tempfile
+import threading
+
+from config.settings import (
+    DOWNLOAD_PATH, DISK_BUDGET_MB, DISK_MIN_FREE_MB, DISK_ADMISSION_TIMEOUT,
+    JANITOR_INTERVAL, JANITOR_MAX_AGE, JOB_QUEUE_PATH, DISK_LEDGER_HEARTBEAT,
+)
+
+logger = logging.getLogger(__name__)
+
+# بادئة المجلدات المؤقتة للمهام
+JOB_DIR_PREFIX = "job_"
+
+
+class DiskFullError(Exception):
+    """لا توجد مساحة كافية لقبول المهمة ضمن الميزانية"""
+
+
+def _tree_size(path: str) -> int:
+    """الحجم الإجمالي لمجلد (بدون اتباع الروابط الرمزية)"""
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += _tree_size(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return total
+
+
+class DiskLedger:
+    """
+    سجل حجوزات القرص المشترك بين البوت وعمليات العمال (جدول في ملف الطابور)،
+    حتى تكون الميزانية للجهاز كله لا لكل عملية.
+    القبول (مجموع الحجوزات + التقدير ضمن الميزانية) يتم ذرياً داخل BEGIN IMMEDIATE.
+    كل عملية تجدد صفوفها دورياً، وصفوف العملية المتوقفة تُحذف بعد stale_after ثانية.
+    """
+
+    def __init__(self, path: str, stale_after: float):
+        self.path = path
+        self.stale_after = stale_after
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS disk_reservations ("
+                "job_dir TEXT PRIMARY KEY, bytes INTEGER NOT NULL, owner TEXT NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def try_reserve(self, job_dir: str, size: int, untracked: int, budget: int) -> bool:
+        """جعل حجز job_dir بحجم size إذا كان مجموع حجوزات الجهاز (دون حجزه الحالي) يسمح بذلك"""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                conn.execute("DELETE FROM disk_reservations WHERE updated_at < ?", (now - self.stale_after,))
+                reserved = conn.execute(
+                    "SELECT COALESCE(SUM(bytes), 0) FROM disk_reservations WHERE job_dir != ?", (job_dir,)
+                ).fetchone()[0]
+                fits = reserved + untracked + size <= budget
+                if fits:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO disk_reservations VALUES (?, ?, ?, ?)",
+                        (job_dir, size, self.owner, now),
+                    )
+                conn.execute("COMMIT")
+                return fits
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def claim(self, job_dir: str, size: int):
+        """نقل ملكية حجز (أنشأه عامل) إلى هذه العملية"""
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO disk_reservations VALUES (?, ?, ?, ?)",
+                (job_dir, size, self.owner, time.time()),
+            )
+
+    def remove(self, job_dir: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM disk_reservations WHERE job_dir = ?", (job_dir,))
+
+    def touch(self):
+        """تجديد صفوف هذه العملية حتى لا تُعتبر متوقفة"""
+        with self._lock:
+            self._connect().execute(
+                "UPDATE disk_reservations SET updated_at = ? WHERE owner = ?", (time.time(), self.owner)
+            )
+
+    def snapshot(self) -> tuple[int, set[str]]:
+        """(مجموع الحجوزات الحية على الجهاز، مجلداتها)"""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT job_dir, bytes FROM disk_reservations WHERE updated_at >= ?",
+                (time.time() - self.stale_after,),
+            ).fetchall()
+        return sum(size for _, size in rows), {job_dir for job_dir, _ in rows}
+
+
+class DiskManager:
+    """
+    - كل مهمة تحصل على مجلد مؤقت خاص وتحجز حجمها التقديري
+    - يتم قبول المهمة فقط إذا كان (المحجوز + غير المتتبع + التقدير) ضمن الميزانية
+      والمساحة الحرة الفعلية تكفي؛ وإلا تنتظر تحرير مساحة حتى مهلة محددة
+    - المنظف يحذف المجلدات غير المتتبعة الأقدم من الحد (بقايا .part و.ytdl والصور المصغرة
+      أو مهام أُنهيت العملية أثناءها)
+    - مع ledger (الوضع المنفصل) تُحسب الحجوزات من السجل المشترك لكل العمليات،
+      ومجلدات العمليات الأخرى الحية لا يحذفها المنظف ولا يحسبها غير متتبعة
+    """
+
+    def __init__(self, root: str, budget_bytes: int, min_free_bytes: int, ledger: DiskLedger | None = None):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.ledger = ledger
+        # {job_dir: reserved_bytes}
+        self._active: dict[str, int] = {}
+        self._untracked_bytes = 0   # آخر قياس لحجم ما لا تتبعه أي مهمة نشطة
+        self._released: asyncio.Event | None = None
+        self.reaped_dirs = 0
+        self.reaped_bytes = 0
+        self.rejected = 0
+
+    @property
+    def reserved_bytes(self) -> int:
+        if self.ledger is not None:
+            return self.ledger.snapshot()[0]
+        return sum(self._active.values())
+
+    def _free_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.root).free
+        except OSError:
+            return 0
+
+    def _fits(self, estimated: int) -> bool:
+        within_budget = self.reserved_bytes + self._untracked_bytes + estimated <= self.budget_bytes
+        return within_budget and self._free_bytes() - estimated >= self.min_free_bytes
+
+    def _reserve(self, job_dir: str, total: int, extra: int) -> bool:
+        """
+        قبول ذري عبر السجل المشترك: حجز المجلد يصبح total بعد زيادة extra.
+        دالة متزامنة — تُستدعى من خيط عامل.
+        """
+        if self._free_bytes() - extra < self.min_free_bytes:
+            return False
+        return self.ledger.try_reserve(job_dir, total, self._untracked_bytes, self.budget_bytes)
+
+    async def _admit(self, job_dir: str, total: int, extra: int, timeout: float):
+        """
+        انتظار حتى يتسع القرص لـ extra بايت إضافية على حجز job_dir (حتى timeout ثانية)،
+        وإلا DiskFullError. مع السجل المشترك لا يوقظ التحريرُ في عملية أخرى هذه العملية،
+        لذا يُعاد الفحص كل ثانية على الأكثر.
+        """
+        if self._released is None:
+            self._released = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.ledger is not None:
+                if await loop.run_in_executor(None, self._reserve, job_dir, total, extra):
+                    return
+            elif self._fits(extra):
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or total > self.budget_bytes:
+                self.rejected += 1
+                logger.warning(
+                    f"Disk budget exhausted: reserved={self.reserved_bytes} "
+                    f"untracked={self._untracked_bytes} requested={extra}"
+                )
+                raise DiskFullError("not enough disk space for this download")
+            self._released.clear()
+            try:
+                await asyncio.wait_for(
+                    self._released.wait(), min(remaining, 1.0) if self.ledger is not None else remaining
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire_job_dir(self, estimated_bytes: int, timeout: float = DISK_ADMISSION_TIMEOUT) -> str:
+        """
+        حجز مساحة وإنشاء مجلد مؤقت للمهمة.
+        تنتظر حتى timeout ثانية لتحرير مساحة، ثم ترفع DiskFullError.
+        """
+        if self.ledger is None:
+            await self._admit("", estimated_bytes, estimated_bytes, timeout)
+            path = tempfile.mkdtemp(prefix=JOB_DIR_PREFIX, dir=self.root)
+            self._active[path] = estimated_bytes
+            return path
+
+        # السجل المشترك مفتاحه المسار، فيُحجز الاسم أولاً ثم يُنشأ المجلد
+        path = os.path.join(self.root, JOB_DIR_PREFIX + secrets.token_hex(6))
+        await self._admit(path, estimated_bytes, estimated_bytes, timeout)
+        try:
+            os.makedirs(path)
+        except BaseException:
+            self.ledger.remove(path)
+            raise
+        self._active[path] = estimated_bytes
+        return path
+
+    async def reserve_more(self, job_dir: str, extra_bytes: int, timeout: float = DISK_ADMISSION_TIMEOUT):
+        """
+        زيادة حجز مجلد مهمة قائم (مثل أجزاء تقسيم الفيديو) بنفس شروط القبول.
+        المجلدات غير المتتبعة تُتجاهل. Raises DiskFullError.
+        """
+        if job_dir not in self._active:
+            return
+        total = self._active[job_dir] + extra_bytes
+        await self._admit(job_dir, total, extra_bytes, timeout)
+        if job_dir in self._active:
+            self._active[job_dir] = total
+
+    def adopt(self, job_dir: str, reserved_bytes: int):
+        """تتبع مجلد مهمة أنشأته عملية أخرى (عامل في الوضع المنفصل) حتى يُحرَّر بعد الإرسال"""
+        self._active[job_dir] = reserved_bytes
+        if self.ledger is not None:
+            self.ledger.claim(job_dir, reserved_bytes)
+
+    def detach(self, job_dir: str):
+        """التوقف عن تتبع المجلد دون حذفه (تسليمه لعملية أخرى، ويبقى حجزه في السجل المشترك)"""
+        self._active.pop(job_dir, None)
+        if self._released is not None:
+            self._released.set()
+
+    def is_job_dir(self, path: str) -> bool:
+        return path in self._active
+
+    def release(self, job_dir: str):
+        """حذف مجلد المهمة بالكامل (مع أي بقايا) وتحرير حجزه"""
+        self._active.pop(job_dir, None)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        if self.ledger is not None:
+            try:
+                self.ledger.remove(job_dir)
+            except sqlite3.Error as e:
+                # يُهمل الصف تلقائياً بعد توقف تجديده
+                logger.warning(f"Failed to release disk reservation for {job_dir}: {e}")
+        if self._released is not None:
+            self._released.set()
+
+    def reap_orphans(self, active: set[str], max_age: float = JANITOR_MAX_AGE) -> int:
+        """
+        حذف مجلدات المهام (JOB_DIR_PREFIX) غير المتتبعة الأقدم من max_age ثانية.
+        active: نسخة من مجلدات هذه العملية تُؤخذ في حلقة الأحداث قبل التسليم للخيط.
+        أي شيء آخر في DOWNLOAD_PATH ليس ملك البوت فلا يُلمس ولا يُحسب.
+        دالة متزامنة — تُستدعى من خيط عامل.
+        """
+        now = time.time()
+        reaped = 0
+        untracked = 0
+        active = set(active)
+        if self.ledger is not None:
+            # مجلدات العمليات الأخرى الحية محجوزة في السجل وليست يتيمة
+            active |= self.ledger.snapshot()[1]
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return 0
+
+        for entry in entries:
+            if entry.path in active or not entry.name.startswith(JOB_DIR_PREFIX):
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                size = _tree_size(entry.path)
+                age = now - entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            if age < max_age:
+                untracked += size
+                continue
+            try:
+                shutil.rmtree(entry.path)
+                reaped += 1
+                self.reaped_bytes += size
+                logger.info(f"Janitor removed orphan {entry.path} ({size} bytes, {int(age)}s old)")
+            except OSError as e:
+                untracked += size
+                logger.warning(f"Janitor failed to remove {entry.path}: {e}")
+
+        self._untracked_bytes = untracked
+        self.reaped_dirs += reaped
+        return reaped
+
+    async def _reap(self, max_age: float = JANITOR_MAX_AGE):
+        """تشغيل reap_orphans في خيط مع قراءة المجلدات النشطة وإيقاظ المنتظرين في حلقة الأحداث"""
+        loop = asyncio.get_running_loop()
+        reaped = await loop.run_in_executor(None, self.reap_orphans, set(self._active), max_age)
+        if reaped and self._released is not None:
+            self._released.set()
+
+    async def run_janitor(self, interval: float = JANITOR_INTERVAL, reap_on_start: bool = True):
+        """
+        مهمة خلفية: تنظيف فوري لبقايا التشغيل السابق ثم تنظيف دوري.
+        reap_on_start=False عندما تشارك عمليات أخرى (العمال) نفس المجلد.
+        مع السجل المشترك تُجدَّد حجوزات هذه العملية أيضاً كل DISK_LEDGER_HEARTBEAT ثانية.
+        """
+        loop = asyncio.get_running_loop()
+        if reap_on_start:
+            # عند البدء لا توجد مهام نشطة، لذا كل مجلدات المهام بقايا من التشغيل السابق
+            await self._reap(0)
+        step = min(interval, DISK_LEDGER_HEARTBEAT) if self.ledger is not None else interval
+        next_reap = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(step)
+            if self.ledger is not None:
+                try:
+                    await loop.run_in_executor(None, self.ledger.touch)
+                except sqlite3.Error as e:
+                    logger.error(f"Disk ledger heartbeat failed: {e}")
+            if time.monotonic() < next_reap:
+                continue
+            next_reap = time.monotonic() + interval
+            try:
+                await self._reap()
+            except Exception as e:
+                logger.error(f"Janitor run failed: {e}")
+
+    def stats(self) -> dict:
+        """مؤشرات استخدام القرص"""
+        return {
+            "shared": self.ledger is not None,
+            "budget_bytes": self.budget_bytes,
+            "reserved_bytes": self.reserved_bytes,
+            "untracked_bytes": self._untracked_bytes,
+            "free_bytes": self._free_bytes(),
+            "active_jobs": len(self._active),   # مهام هذه العملية فقط
+            "reaped_dirs": self.reaped_dirs,
+            "reaped_bytes": self.reaped_bytes,
+            "rejected": self.rejected,
+        }
+
+
+# مثيل عام واحد للاستخدام في جميع أنحاء البوت
+disk_manager = DiskManager(
+    DOWNLOAD_PATH,
+    budget_bytes=DISK_BUDGET_MB * 1024 * 1024,
+    min_free_bytes=DISK_MIN_FREE_MB * 1024 * 1024,
+    ledger=DiskLedger(JOB_QUEUE_PATH, DISK_LEDGER_HEARTBEAT * 4) if JOB_QUEUE_PATH else None,
+)
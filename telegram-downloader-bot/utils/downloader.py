@@ -4,18 +4,36 @@ Video and audio downloader module using yt-dlp
 """
 
 import os
+import ssl
+import copy
+import time
 import asyncio
 import logging
-import tempfile
+import threading
+import http.client
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, NamedTuple, Optional
+from urllib.parse import urlparse, parse_qs, urlsplit, urljoin
 
 import yt_dlp
+from yt_dlp.postprocessor import PostProcessor
 
 from config.settings import (
-    DOWNLOAD_PATH, MAX_FILE_SIZE_BYTES, YTDLP_BASE_OPTIONS
+    DOWNLOAD_PATH, YTDLP_BASE_OPTIONS, INFO_REUSE_MAX_AGE,
+    SEGMENTED_DOWNLOAD, SEGMENT_MAX_CONNECTIONS, SEGMENT_CHUNK_MB, SEGMENT_MIN_SIZE_MB,
+    SIZE_PROBE_DEADLINE, SIZE_PROBE_MAX_FORMATS, SIZE_PROBE_TIMEOUT, CAROUSEL_ITEM_ESTIMATE_MB,
 )
 from utils.formatters import format_file_size, format_duration, format_views, format_date, truncate_title
+from utils.url_validator import media_key, platform_id
+from utils.cache import metadata_cache, media_info_cache
+from utils.workers import extract_pool, download_pool, transcode_pool, probe_pool, process_context
+from utils.bot_api import bot_api
+from utils.disk import disk_manager
+from utils.job_queue import job_queue, PROGRESS_KEYS
+from utils.ffmpeg import THUMBNAIL_EXTS, convert_to_mp4, encode_audio, run_ffmpeg, split_video
 
 logger = logging.getLogger(__name__)
 
@@ -23,55 +41,159 @@ logger = logging.getLogger(__name__)
 os.makedirs(DOWNLOAD_PATH, exist_ok=True)
 
 
+class MediaFormat(NamedTuple):
+    """صف واحد في جدول الصيغ — فقط الحقول التي يحتاجها البوت من صيغة yt-dlp"""
+    format_id: str
+    ext: str
+    height: int
+    vcodec: str
+    acodec: str
+    abr: float
+    tbr: float
+    fps: float
+    filesize: int  # الحجم المعروف أو التقريبي (0 = غير معروف)
+
+    @classmethod
+    def from_dict(cls, fmt: dict) -> "MediaFormat":
+        return cls(
+            format_id=fmt.get("format_id", ""),
+            ext=fmt.get("ext", ""),
+            height=fmt.get("height") or 0,
+            vcodec=fmt.get("vcodec") or "",
+            acodec=fmt.get("acodec") or "",
+            abr=fmt.get("abr") or 0,
+            tbr=fmt.get("tbr") or 0,
+            fps=fmt.get("fps") or 0,
+            filesize=fmt.get("filesize") or fmt.get("filesize_approx") or 0,
+        )
+
+
+def _mp4_preference(fmt: MediaFormat) -> tuple:
+    """ترتيب تفضيل الصيغ: H.264 أولاً، ثم الصيغ المعروف حجمها، ثم الأعلى معدل بت"""
+    return (
+        fmt.vcodec.lower().startswith(("avc1", "h264")),
+        bool(fmt.filesize),
+        fmt.tbr,
+    )
+
+
 class VideoInfo:
-    """كلاس لتخزين معلومات الفيديو"""
+    """
+    واصف مضغوط للوسائط: الحقول التي يستخدمها البوت فقط، بدون قاموس yt-dlp الخام.
+    الصيغ جدول من الصفوف الثابتة، وقوائم الجودات تُحسب مرة واحدة وتُشارك بين كل
+    المستخدمين الذين يطلبون نفس الرابط (لذلك هي tuples لا تُعدَّل).
+    """
+    __slots__ = (
+        "title", "duration", "duration_str", "views", "upload_date", "platform",
+        "item_count", "formats", "_video_qualities", "_audio_qualities",
+    )
+
     def __init__(self, raw_info: dict):
         self.title = truncate_title(raw_info.get("title", ""))
         self.duration = raw_info.get("duration", 0)
-        self.duration_str = format_duration(self.duration)
         self.views = format_views(raw_info.get("view_count"))
         self.upload_date = format_date(raw_info.get("upload_date"))
         self.platform = raw_info.get("extractor_key", "Unknown")
-        self.url = raw_info.get("webpage_url", "")
-        self.thumbnail = raw_info.get("thumbnail", "")
-        self.formats = raw_info.get("formats", [])
-        self.raw = raw_info
+        formats = raw_info.get("formats") or []
+
+        # المنشورات المتعددة (مثل Carousel في إنستغرام): الجودات تؤخذ من أول عنصر
+        entries = [e for e in raw_info.get("entries") or [] if isinstance(e, dict)]
+        self.item_count = len(entries) or 1
+        if entries and not formats:
+            formats = entries[0].get("formats") or []
+            self.duration = self.duration or entries[0].get("duration", 0)
 
-    def get_available_video_qualities(self) -> list[dict]:
+        self.duration_str = format_duration(self.duration)
+        self.formats = tuple(MediaFormat.from_dict(f) for f in formats)
+        self._video_qualities = None
+        self._audio_qualities = None
+
+    def estimated_size(self) -> int:
+        """حجم تقريبي لحساب مساحة الذاكرة في كاش الواصفات"""
+        return 512 + 120 * len(self.formats)
+
+    def get_available_video_qualities(self) -> tuple[dict, ...]:
         """
-        استخراج الجودات المتاحة للفيديو مع تقدير الأحجام.
-        Returns list of dicts: {quality_label, height, format_id, filesize, filesize_str}
+        استخراج الجودات المتاحة للفيديو مع تقدير الأحجام (تُحسب مرة واحدة).
+        الخيار الأول قد يكون "تلقائي" (auto=True) مع قائمة candidates تنازلية.
+        Returns tuple of dicts: {quality_label, height, format_id, filesize, filesize_str}
         """
-        seen_heights = set()
-        qualities = []
+        if self._video_qualities is None:
+            self._video_qualities = tuple(self._build_video_qualities())
+        return self._video_qualities
+
+    def get_available_audio_qualities(self) -> tuple[dict, ...]:
+        """استخراج الجودات الصوتية المتاحة (تُحسب مرة واحدة)"""
+        if self._audio_qualities is None:
+            self._audio_qualities = tuple(self._build_audio_qualities())
+        return self._audio_qualities
 
+    def menu_format_ids(self) -> list[str]:
+        """
+        معرّفات الصيغ التي تظهر فعلاً في قوائم الجودة: الصوت المدمج أولاً (يدخل في حجم
+        كل الصيغ المرئية فقط)، ثم الفيديو من الأعلى دقة، ثم الصوت.
+        """
+        video = sorted(
+            (q for q in self.get_available_video_qualities() if not q.get("auto") and q["height"] != 9999),
+            key=lambda x: x["height"],
+            reverse=True,
+        )
+        merged_audio = self._merged_audio_format()
+        ids = [merged_audio.format_id] if merged_audio else []
+        ids += [q["format_id"] for q in video]
+        ids += [q["format_id"] for q in self.get_available_audio_qualities()]
+        return list(dict.fromkeys(ids))
+
+    def _merged_audio_format(self) -> Optional[MediaFormat]:
+        """أفضل مسار صوتي يُدمج مع الصيغ المرئية فقط (بنفس تفضيل AAC عند التحميل)"""
+        best = None
+        for fmt in self.formats:
+            if fmt.vcodec == "none" and fmt.acodec not in ("", "none"):
+                if best is None or _original_preference(fmt) > _original_preference(best):
+                    best = fmt
+        return best
+
+    def _merged_audio_size(self) -> int:
+        """الحجم التقديري لأفضل مسار صوتي يُدمج مع الصيغ المرئية فقط"""
+        best = self._merged_audio_format()
+        if best is None:
+            return 0
+        if best.filesize:
+            return best.filesize
+        return int((best.abr * 1000 * self.duration) / 8) if self.duration else 0
+
+    def _build_video_qualities(self) -> list[dict]:
+        # اختيار صيغة واحدة لكل دقة، مع تفضيل H.264 لأنه يُنسخ إلى MP4 بدون إعادة ترميز
+        audio_size = self._merged_audio_size()
+        by_height: dict[int, MediaFormat] = {}
         for fmt in self.formats:
             # تجاهل الصيغ الصوتية فقط
-            if fmt.get("vcodec") == "none":
-                continue
-            height = fmt.get("height")
-            if not height:
+            if fmt.vcodec == "none" or not fmt.height:
                 continue
-            if height in seen_heights:
-                continue
-            seen_heights.add(height)
+            current = by_height.get(fmt.height)
+            if current is None or _mp4_preference(fmt) > _mp4_preference(current):
+                by_height[fmt.height] = fmt
 
+        qualities = []
+        for height, fmt in by_height.items():
             # تقدير الحجم
-            filesize = fmt.get("filesize") or fmt.get("filesize_approx") or 0
-            if not filesize and self.duration:
-                tbr = fmt.get("tbr", 0) or 0
-                filesize = int((tbr * 1000 * self.duration) / 8) if tbr else 0
+            filesize = fmt.filesize
+            if not filesize and self.duration and fmt.tbr:
+                filesize = int((fmt.tbr * 1000 * self.duration) / 8)
+            # الصيغة المرئية فقط يُدمج معها أفضل صوت، فيُضاف حجمه إلى التقدير
+            if filesize and fmt.acodec == "none":
+                filesize += audio_size
 
             qualities.append({
                 "height": height,
                 "quality_label": f"{height}p",
-                "format_id": fmt.get("format_id", ""),
+                "format_id": fmt.format_id,
                 "filesize": filesize,
                 "filesize_str": format_file_size(filesize) if filesize else "غير معروف",
-                "ext": fmt.get("ext", "mp4"),
-                "fps": fmt.get("fps", 0),
-                "vcodec": fmt.get("vcodec", ""),
-                "acodec": fmt.get("acodec", ""),
+                "ext": fmt.ext or "mp4",
+                "fps": fmt.fps,
+                "vcodec": fmt.vcodec,
+                "acodec": fmt.acodec,
             })
 
         # ترتيب تصاعدي حسب الجودة
@@ -92,36 +214,66 @@ class VideoInfo:
                 "acodec": best.get("acodec", ""),
             })
 
+            # خيار "تلقائي" في أول القائمة: أعلى دقة يقع حجمها المعروف ضمن الحد،
+            # والدقات الأدنى منها بالترتيب بدائل إذا تجاوز الملف الفعلي الحد
+            candidates = sorted(
+                (q for q in qualities[:-1] if q["filesize"] and q["filesize"] <= bot_api.max_file_bytes),
+                key=lambda x: x["height"],
+                reverse=True,
+            )
+            if candidates:
+                qualities.insert(0, {**candidates[0], "auto": True, "candidates": candidates})
+
         return qualities
 
-    def get_available_audio_qualities(self) -> list[dict]:
-        """استخراج الجودات الصوتية المتاحة"""
+    def _build_audio_qualities(self) -> list[dict]:
+        """
+        أول خيار "original" يسلّم أفضل صيغة صوتية كما هي (m4a/opus) بدون تحويل،
+        وبقية الخيارات تُحمّل الصيغة المحددة نفسها ثم تُرمَّز MP3.
+        """
         seen_abr = set()
         audio_formats = []
+        original = None
+        original_fmt = None
 
+        # الصيغ المدمجة (فيديو + صوت) تعني تحميل الفيديو كاملاً، فلا تُستخدم
+        # إلا إذا لم توجد أي صيغة صوتية خالصة
+        audio_only = any(fmt.vcodec == "none" and fmt.abr for fmt in self.formats)
         for fmt in self.formats:
             # الصيغ الصوتية فقط
-            if fmt.get("vcodec") != "none" and fmt.get("acodec") == "none":
+            if fmt.vcodec != "none" and (audio_only or fmt.acodec == "none"):
                 continue
-            abr = fmt.get("abr", 0) or 0
-            if not abr:
+            if not fmt.abr:
                 continue
-            abr_rounded = round(abr / 32) * 32  # تقريب لأقرب 32
+
+            filesize = fmt.filesize
+            if not filesize and self.duration:
+                filesize = int((fmt.abr * 1000 * self.duration) / 8)
+
+            if fmt.vcodec == "none" and _original_preference(fmt) > _original_preference(original_fmt):
+                original_fmt = fmt
+                original = {
+                    "abr": int(fmt.abr),
+                    "quality_label": "original",
+                    "format_id": fmt.format_id,
+                    "filesize": filesize,
+                    "filesize_str": format_file_size(filesize) if filesize else "غير معروف",
+                    "ext": fmt.ext or "m4a",
+                    "original": True,
+                }
+
+            abr_rounded = round(fmt.abr / 32) * 32  # تقريب لأقرب 32
             if abr_rounded in seen_abr:
                 continue
             seen_abr.add(abr_rounded)
 
-            filesize = fmt.get("filesize") or fmt.get("filesize_approx") or 0
-            if not filesize and self.duration:
-                filesize = int((abr * 1000 * self.duration) / 8)
-
             audio_formats.append({
                 "abr": abr_rounded,
                 "quality_label": f"{abr_rounded}kbps",
-                "format_id": fmt.get("format_id", ""),
+                "format_id": fmt.format_id,
                 "filesize": filesize,
                 "filesize_str": format_file_size(filesize) if filesize else "غير معروف",
-                "ext": fmt.get("ext", "m4a"),
+                "ext": fmt.ext or "m4a",
             })
 
         audio_formats.sort(key=lambda x: x["abr"])
@@ -137,27 +289,721 @@ class VideoInfo:
                  "filesize": 0, "filesize_str": "غير معروف", "ext": "mp3"},
             ]
 
+        if original:
+            audio_formats.insert(0, original)
+
         return audio_formats
 
 
+def _original_preference(fmt: Optional[MediaFormat]) -> tuple:
+    """ترتيب تفضيل الصيغة الأصلية: m4a أولاً (يشغّله تلغرام مباشرة)، ثم الأعلى معدل بت"""
+    if fmt is None:
+        return (False, False, 0)
+    acodec = fmt.acodec.lower()
+    return (
+        fmt.ext == "m4a" or acodec.startswith("mp4a"),
+        acodec.startswith("opus"),
+        fmt.abr,
+    )
+
+
+# ===== التحميل المجزأ عبر طلبات Range متوازية =====
+
+class RangeNotSupported(Exception):
+    """الخادم لا يدعم طلبات Range (أو لا يُعرف حجم الملف)"""
+
+
+class _ConnectionPool:
+    """
+    مجمّع اتصالات HTTP(S) قابلة لإعادة الاستخدام لكل (scheme, host, port)،
+    حتى لا تدفع الأجزاء المتتالية كلفة TCP/TLS من جديد.
+    """
+
+    def __init__(self, max_idle_per_host: int = 16, timeout: float = 30):
+        self._idle: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._max_idle = max_idle_per_host
+        self._timeout = timeout
+        self._ssl_context = ssl.create_default_context()
+        if YTDLP_BASE_OPTIONS.get("nocheckcertificate"):
+            self._ssl_context.check_hostname = False
+            self._ssl_context.verify_mode = ssl.CERT_NONE
+
+    def acquire(self, key: tuple, timeout: Optional[float] = None):
+        """اتصال خامل أو جديد؛ timeout يستبدل المهلة الافتراضية لهذا الاستخدام فقط"""
+        timeout = timeout or self._timeout
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def release(self, key: tuple, conn, reusable: bool = True):
+        if reusable:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self._max_idle:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+
+_http_pool = _ConnectionPool()
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+_READ_SIZE = 256 * 1024
+
+
+def _open_range(url: str, headers: dict, start: int, end: int, timeout: Optional[float] = None):
+    """
+    إرسال طلب GET بمدى محدد مع تتبع التحويلات.
+    Returns: (final_url, pool_key, connection, response)
+    """
+    for _ in range(5):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path or "/"
+        if parts.query:
+            path += f"?{parts.query}"
+
+        conn = _http_pool.acquire(key, timeout)
+        try:
+            conn.request("GET", path, headers={**headers, "Range": f"bytes={start}-{end}"})
+            resp = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+        if resp.status in _REDIRECT_CODES:
+            location = resp.getheader("Location")
+            resp.read()
+            _http_pool.release(key, conn, not resp.will_close)
+            if not location:
+                raise RangeNotSupported(f"redirect without location from {url}")
+            url = urljoin(url, location)
+            continue
+        if resp.status != 206:
+            conn.close()
+            raise RangeNotSupported(f"HTTP {resp.status} for range request")
+        return url, key, conn, resp
+    raise RangeNotSupported("too many redirects")
+
+
+def _probe_range(url: str, headers: dict, timeout: Optional[float] = None) -> tuple[str, int]:
+    """التأكد من دعم Range ومعرفة الحجم الكلي. Returns (final_url, total_size)."""
+    url, key, conn, resp = _open_range(url, headers, 0, 0, timeout)
+    content_range = resp.getheader("Content-Range") or ""
+    resp.read()
+    _http_pool.release(key, conn, not resp.will_close)
+    total = content_range.rpartition("/")[2]
+    if not total.isdigit():
+        raise RangeNotSupported(f"unknown total size: {content_range!r}")
+    return url, int(total)
+
+
+def _probe_size(url: str, headers: dict, timeout: Optional[float] = None) -> Optional[int]:
+    """
+    الحجم الفعلي للملف: طلب Range لبايت واحد، ثم HEAD (Content-Length) إذا لم يُدعم Range.
+    """
+    try:
+        return _probe_range(url, headers, timeout)[1]
+    except RangeNotSupported:
+        pass
+
+    for _ in range(5):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        conn = _http_pool.acquire(key, timeout)
+        try:
+            conn.request("HEAD", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        _http_pool.release(key, conn, not resp.will_close)
+        if resp.status in _REDIRECT_CODES and resp.getheader("Location"):
+            url = urljoin(url, resp.getheader("Location"))
+            continue
+        length = resp.getheader("Content-Length") or ""
+        return int(length) if resp.status == 200 and length.isdigit() else None
+    return None
+
+
+def _fetch_segment(url: str, headers: dict, fd: int, start: int, end: int, on_bytes, retries: int = 3):
+    """تحميل المدى [start, end] وكتابته في موضعه داخل الملف، مع الاستئناف عند انقطاع الاتصال"""
+    offset = start
+    for attempt in range(retries + 1):
+        try:
+            _, key, conn, resp = _open_range(url, headers, offset, end)
+            try:
+                while offset <= end:
+                    chunk = resp.read(min(_READ_SIZE, end - offset + 1))
+                    if not chunk:
+                        break
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    on_bytes(len(chunk))
+            except BaseException:
+                conn.close()
+                raise
+            if offset <= end:
+                conn.close()
+                raise http.client.IncompleteRead(b"", end - offset + 1)
+            _http_pool.release(key, conn, not resp.will_close)
+            return
+        except (OSError, http.client.HTTPException):
+            if attempt == retries:
+                raise
+            time.sleep(0.5 * (attempt + 1))
+
+
+def segmented_download(
+    url: str,
+    dest: str,
+    headers: Optional[dict] = None,
+    progress_hook=None,
+    max_connections: int = SEGMENT_MAX_CONNECTIONS,
+    chunk_size: int = SEGMENT_CHUNK_MB * 1024 * 1024,
+    max_size: Optional[int] = None,
+) -> int:
+    """
+    تحميل ملف عبر عدة طلبات Range متوازية تُكتب في مواضعها داخل ملف مُخصص مسبقاً.
+    يبدأ باتصالين ويزيد عدد الاتصالات ما دام الإنتاج الكلي يتحسن (مفيد للخوادم التي
+    تحدّ سرعة كل اتصال)، ويقلّله إذا تراجع بوضوح.
+    progress_hook يستقبل قواميس بنفس شكل hooks الخاصة بـ yt-dlp.
+    Returns: total bytes. Raises RangeNotSupported if the server can't serve ranges.
+    """
+    headers = dict(headers or {})
+    url, total = _probe_range(url, headers)
+    if max_size and total > max_size:
+        raise RangeNotSupported(f"file too large ({total} bytes)")
+
+    segments = deque(
+        (start, min(start + chunk_size, total) - 1) for start in range(0, total, chunk_size)
+    )
+    part = f"{dest}.part"
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    lock = threading.Lock()
+    state = {"done": 0, "reported": 0.0}
+    started = time.monotonic()
+
+    def _on_bytes(n: int):
+        with lock:
+            state["done"] += n
+            now = time.monotonic()
+            if not progress_hook or now - state["reported"] < 0.5:
+                return
+            state["reported"] = now
+            done = state["done"]
+        speed = done / max(now - started, 1e-6)
+        progress_hook({
+            "status": "downloading",
+            "downloaded_bytes": done,
+            "total_bytes": total,
+            "speed": speed,
+            "eta": (total - done) / speed if speed else None,
+        })
+
+    executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="segment")
+    try:
+        try:
+            os.posix_fallocate(fd, 0, total)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, total)
+
+        target = min(2, max_connections)
+        active = set()
+        epoch_start, epoch_bytes, epoch_done = time.monotonic(), 0, 0
+        last_rate = 0.0
+
+        while segments or active:
+            while segments and len(active) < target:
+                start, end = segments.popleft()
+                active.add(executor.submit(_fetch_segment, url, headers, fd, start, end, _on_bytes))
+            done, active = wait(active, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+            # تكييف عدد الاتصالات مع الإنتاج الملحوظ بعد كل دورة
+            epoch_done += len(done)
+            if epoch_done >= target:
+                with lock:
+                    total_done = state["done"]
+                elapsed = max(time.monotonic() - epoch_start, 1e-6)
+                rate = (total_done - epoch_bytes) / elapsed
+                if rate > last_rate * 1.1 and target < max_connections:
+                    target += 1
+                elif rate < last_rate * 0.75 and target > 1:
+                    target -= 1
+                last_rate = rate
+                epoch_start, epoch_bytes, epoch_done = time.monotonic(), total_done, 0
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        os.close(fd)
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+    executor.shutdown(wait=True)
+    os.close(fd)
+    os.replace(part, dest)
+
+    if progress_hook:
+        progress_hook({
+            "status": "finished",
+            "downloaded_bytes": total,
+            "total_bytes": total,
+            "elapsed": time.monotonic() - started,
+        })
+    logger.info(
+        f"Segmented download: {format_file_size(total)} in "
+        f"{time.monotonic() - started:.1f}s with up to {target} connections"
+    )
+    return total
+
+
+def _is_progressive(fmt: dict) -> bool:
+    """صيغة ملف واحد عبر HTTP(S) (وليست أجزاء DASH/HLS)"""
+    return (
+        fmt.get("protocol") in ("http", "https")
+        and bool(fmt.get("url"))
+        and not fmt.get("fragments")
+    )
+
+
+def _segmented_video(ydl, info: Optional[dict], progress_hook, timings: dict, max_bytes: int) -> bool:
+    """
+    محاولة تحميل الصيغة المختارة بالتحميل المجزأ (مع دمج الفيديو والصوت عبر ffmpeg).
+    Returns False when not applicable so the caller falls back to yt-dlp.
+    """
+    if not info or info.get("_type", "video") != "video":
+        return False
+    try:
+        resolved = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    except yt_dlp.utils.DownloadError:
+        return False
+    formats = resolved.get("requested_formats") or [resolved]
+    if not all(_is_progressive(f) for f in formats):
+        return False
+    estimated = sum(f.get("filesize") or f.get("filesize_approx") or 0 for f in formats)
+    if estimated and estimated < SEGMENT_MIN_SIZE_MB * 1024 * 1024:
+        return False
+
+    cookiejar = getattr(ydl, "cookiejar", None)
+    target = ydl.prepare_filename(resolved)
+    base = os.path.splitext(target)[0]
+    paths = []
+    done_before = 0
+
+    try:
+        for fmt in formats:
+            path = f"{base}.f{fmt.get('format_id')}.{fmt.get('ext')}" if len(formats) > 1 else target
+            headers = dict(fmt.get("http_headers") or {})
+            if cookiejar is not None and hasattr(cookiejar, "get_cookie_header"):
+                cookie_header = cookiejar.get_cookie_header(fmt["url"])
+                if cookie_header:
+                    headers["Cookie"] = cookie_header
+
+            def _hook(d, offset=done_before):
+                # تقدم إجمالي عبر مسارَي الفيديو والصوت
+                if progress_hook and d.get("status") == "downloading":
+                    progress_hook({
+                        **d,
+                        "downloaded_bytes": offset + d["downloaded_bytes"],
+                        "total_bytes": max(estimated, offset + d["total_bytes"]),
+                    })
+
+            done_before += segmented_download(
+                fmt["url"], path, headers, _hook, max_size=max_bytes
+            )
+            paths.append(path)
+    except (RangeNotSupported, OSError, http.client.HTTPException) as e:
+        logger.info(f"Segmented download not possible, using yt-dlp: {e}")
+        for path in paths:
+            os.remove(path)
+        return False
+
+    if len(paths) > 1:
+        merge_started = time.monotonic()
+        dst = f"{base}.mp4"
+        run_ffmpeg([
+            "-i", paths[0], "-i", paths[1], "-map", "0:v:0", "-map", "1:a:0",
+            "-c", "copy", "-movflags", "+faststart", dst,
+        ])
+        for path in paths:
+            os.remove(path)
+        timings["merge"] += time.monotonic() - merge_started
+    return True
+
+
+# ===== مهام العمال (دوال على مستوى الوحدة حتى تكون قابلة للتسلسل في وضع العمليات) =====
+
+# مفاتيح كبيرة في نتيجة yt-dlp لا يستخدمها البوت
+_UNUSED_INFO_KEYS = (
+    "automatic_captions", "subtitles", "requested_subtitles",
+    "heatmap", "comments", "chapters", "description",
+)
+
+
+def _compact_info(info: dict) -> dict:
+    """حذف الحقول الضخمة غير المستخدمة من نتيجة yt-dlp (بما في ذلك عناصر المنشورات المتعددة)"""
+    for key in _UNUSED_INFO_KEYS:
+        info.pop(key, None)
+    for entry in info.get("entries") or []:
+        if isinstance(entry, dict):
+            _compact_info(entry)
+    return info
+
+
+def _extract_info_job(url: str) -> Optional[dict]:
+    """جلب المعلومات عبر yt-dlp وإرجاع قاموس مضغوط قابل للتسلسل"""
+    opts = {
+        **YTDLP_BASE_OPTIONS,
+        "skip_download": True,
+    }
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        if not info:
+            return None
+        # تحويل النتيجة إلى قاموس قابل للتسلسل (JSON) لتخزينها في الكاش
+        return _compact_info(ydl.sanitize_info(info))
+
+
+def _streams_expired(info: dict, margin: int = 300) -> bool:
+    """
+    هل انتهت صلاحية روابط البث في المعلومات المخزنة؟
+    يُستخدم معامل expire في الرابط (يوتيوب) إن وُجد، وإلا عمر الاستخراج (epoch).
+    """
+    entry = info
+    if info.get("entries"):
+        entry = next((e for e in info["entries"] if isinstance(e, dict)), None)
+        if entry is None:
+            return True
+
+    now = time.time()
+    for fmt in entry.get("formats") or []:
+        expire = parse_qs(urlparse(fmt.get("url") or "").query).get("expire")
+        if expire and expire[0].isdigit():
+            return int(expire[0]) < now + margin
+
+    epoch = info.get("epoch") or entry.get("epoch")
+    return not epoch or epoch + INFO_REUSE_MAX_AGE < now
+
+
+def _run_ytdlp(ydl, url: str, info: Optional[dict]) -> Optional[dict]:
+    """
+    التحميل انطلاقاً من المعلومات المستخرجة مسبقاً (بدون جلب الصفحة وفك التشفير مرة أخرى)،
+    مع الرجوع إلى استخراج كامل إذا فشل ذلك (مثل انتهاء صلاحية الروابط).
+    """
+    if info:
+        try:
+            return ydl.process_ie_result(copy.deepcopy(info), download=True)
+        except yt_dlp.utils.DownloadError as e:
+            logger.warning(f"Download from cached info failed for {url}, re-extracting: {e}")
+    return ydl.extract_info(url, download=True)
+
+
+async def _reusable_info(url: str) -> Optional[dict]:
+    """المعلومات المخزنة في الكاش إذا كانت روابط البث فيها ما زالت صالحة"""
+    info = await metadata_cache.aget(media_key(url))
+    if info and not _streams_expired(info):
+        return info
+    return None
+
+
+def _video_format_spec(height: int, format_id: Optional[str]) -> str:
+    """بناء نص اختيار الصيغة لـ yt-dlp (format_id قد يكون نص اختيار كاملاً مثل خيار "best")"""
+    if format_id and "/" in format_id:
+        return format_id
+    if format_id:
+        return f"{format_id}+bestaudio/bestvideo[height<={height}]+bestaudio/best[height<={height}]/best"
+    if height == 9999:
+        return "bestvideo+bestaudio/best"
+    return f"bestvideo[height<={height}]+bestaudio/best[height<={height}]/best[height<={height}]/best"
+
+
+def fitting_format_spec(heights: list[int], max_bytes: int) -> str:
+    """
+    نص اختيار يجرّب الدقات بالترتيب مستبعداً الصيغ التي يتجاوز حجمها المعروف max_bytes،
+    فيختار yt-dlp لكل عنصر من المنشور المتعدد أعلى دقة مرشحة ضمن الحد.
+    إن لم يقع شيء ضمن الحد تُستخدم أدنى دقة مرشحة.
+    """
+    limit = f"[filesize<=?{max_bytes}][filesize_approx<=?{max_bytes}]"
+    options = []
+    for height in heights:
+        options += [f"bestvideo[height<={height}]{limit}+bestaudio", f"best[height<={height}]{limit}"]
+    return "/".join(options) + "/" + _video_format_spec(heights[-1], None)
+
+
+def _download_video_job(
+    url: str, temp_dir: str, fmt: str, progress_hook=None, info: Optional[dict] = None,
+    max_bytes: Optional[int] = None,
+) -> tuple[Optional[list[str]], dict]:
+    """
+    تحميل الفيديو (مع دمج الصوت) إلى المجلد المؤقت، بحد أقصى max_bytes.
+    Returns: (file paths or None, timings {"download": s, "merge": s})
+    """
+    timings = {"download": 0.0, "merge": 0.0}
+    merge_started = {}
+
+    def _postprocessor_hook(d):
+        # قياس زمن الدمج (Merger ينسخ المسارات دون إعادة ترميز)
+        if d.get("postprocessor") != "Merger":
+            return
+        if d.get("status") == "started":
+            merge_started["at"] = time.monotonic()
+        elif d.get("status") == "finished" and "at" in merge_started:
+            timings["merge"] += time.monotonic() - merge_started.pop("at")
+
+    # yt-dlp يرسل التقدم لكل صيغة على حدة؛ نجمعه حتى لا يعود الشريط للصفر عند بدء الصوت
+    merged_hook = _MergedProgress(progress_hook) if progress_hook else None
+    opts = {
+        **YTDLP_BASE_OPTIONS,
+        "format": fmt,
+        # تفضيل H.264 + AAC عند نفس الدقة حتى يكون الدمج نسخاً مباشراً إلى MP4
+        "format_sort": ["res", "vcodec:h264", "acodec:aac"],
+        "outtmpl": os.path.join(temp_dir, "%(playlist_index)s_%(title).50s.%(ext)s"),
+        "merge_output_format": "mp4",
+        "progress_hooks": [merged_hook] if merged_hook else [],
+        "postprocessor_hooks": [_postprocessor_hook],
+        # ما يتجاوز حد الإرسال حتى max_bytes يُقسَّم إلى أجزاء قبل الرفع
+        "max_filesize": max_bytes,
+    }
+
+    started = time.monotonic()
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        if merged_hook:
+            ydl.add_post_processor(_ExpectFormats(merged_hook), when="before_dl")
+        if not (SEGMENTED_DOWNLOAD and _segmented_video(ydl, info, progress_hook, timings, max_bytes)):
+            _run_ytdlp(ydl, url, info)
+    timings["download"] = time.monotonic() - started - timings["merge"]
+
+    # البحث عن الملفات المحمّلة (دعم المنشورات المتعددة)
+    files = sorted(list(Path(temp_dir).glob("*")), key=os.path.getmtime)
+    if files:
+        return [str(f) for f in files if f.stat().st_size > 0], timings
+    return None, timings
+
+
+def _download_audio_job(
+    url: str,
+    temp_dir: str,
+    format_id: Optional[str] = None,
+    progress_hook=None,
+    info: Optional[dict] = None,
+    max_bytes: Optional[int] = None,
+) -> Optional[tuple]:
+    """
+    تحميل الصيغة الصوتية المختارة (أو أفضل صيغة) مع الصورة المصغرة، بحد أقصى max_bytes.
+    Returns: (audio_path, thumbnail_path | None, metadata) or None.
+    """
+    fmt = "bestaudio/best"
+    if format_id and format_id != fmt:
+        fmt = f"{format_id}/{fmt}"
+    opts = {
+        **YTDLP_BASE_OPTIONS,
+        "format": fmt,
+        "outtmpl": os.path.join(temp_dir, "%(title).50s.%(ext)s"),
+        "writethumbnail": True,
+        "progress_hooks": [progress_hook] if progress_hook else [],
+        "max_filesize": max_bytes,
+    }
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = _run_ytdlp(ydl, url, info)
+
+    files = list(Path(temp_dir).glob("*"))
+    thumbnails = [f for f in files if f.suffix.lower() in THUMBNAIL_EXTS]
+    audio_files = [f for f in files if f not in thumbnails]
+    if not audio_files:
+        return None
+    source = max(audio_files, key=lambda f: f.stat().st_size)
+    thumbnail = str(thumbnails[0]) if thumbnails else None
+    return str(source), thumbnail, _audio_metadata(info or {})
+
+
+def _postprocess_audio_job(
+    source: str, thumbnail: Optional[str], metadata: dict, quality_kbps: Optional[int]
+) -> str:
+    """
+    الملف النهائي مع الغلاف والبيانات في استدعاء ffmpeg واحد.
+    quality_kbps=None يسلّم الصوت الأصلي بدون إعادة ترميز.
+    """
+    try:
+        return encode_audio(source, thumbnail, metadata, quality_kbps)
+    finally:
+        if thumbnail and os.path.exists(thumbnail):
+            os.remove(thumbnail)
+
+
+class _MergedProgress:
+    """
+    تجميع تقدم الصيغ المطلوبة (فيديو ثم صوت) في شريط واحد.
+    الأحجام المتوقعة تأتي من _ExpectFormats قبل بدء التحميل.
+    """
+
+    def __init__(self, progress_hook):
+        self._hook = progress_hook
+        self._expected: dict[str, int] = {}
+        self._done: dict[str, int] = {}
+
+    def expect(self, info: dict):
+        formats = info.get("requested_formats") or [info]
+        self._expected = {f.get("format_id"): f.get("filesize") or f.get("filesize_approx") or 0 for f in formats}
+        self._done = {}
+
+    def __call__(self, d: dict):
+        format_id = (d.get("info_dict") or {}).get("format_id")
+        if len(self._expected) < 2 or format_id not in self._expected:
+            self._hook(d)
+            return
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or self._expected[format_id]
+        if d.get("status") == "finished":
+            self._done[format_id] = downloaded or total
+        before = sum(size for fid, size in self._done.items() if fid != format_id)
+        remaining = sum(
+            size for fid, size in self._expected.items() if fid != format_id and fid not in self._done
+        )
+        self._hook({
+            **d,
+            "downloaded_bytes": before + downloaded,
+            "total_bytes": before + total + remaining if total else None,
+            "total_bytes_estimate": None,
+        })
+
+
+class _ExpectFormats(PostProcessor):
+    """يسجّل الصيغ المختارة وأحجامها في _MergedProgress قبل التحميل (when="before_dl")"""
+
+    def __init__(self, progress: _MergedProgress):
+        super().__init__()
+        self._progress = progress
+
+    def run(self, info):
+        self._progress.expect(info)
+        return [], info
+
+
+class _QueueProgressHook:
+    """
+    hook قابل للتسلسل لوضع العمليات: يرسل عينات مختصرة إلى البوت عبر طابور Manager،
+    بحد أقصى عينة كل min_interval ثانية حتى لا يبطئ التحميل.
+    """
+
+    def __init__(self, queue, min_interval: float = 0.5):
+        self._queue = queue
+        self._min_interval = min_interval
+        self._last = 0.0
+
+    def __call__(self, d: dict):
+        now = time.monotonic()
+        if d.get("status") == "downloading" and now - self._last < self._min_interval:
+            return
+        self._last = now
+        try:
+            self._queue.put({key: d.get(key) for key in PROGRESS_KEYS})
+        except Exception:
+            pass
+
+
+class _CancellableHook:
+    """
+    hook وضع الخيوط: يمرر التقدم كما هو، ويوقف التحميل (DownloadCancelled) بعد ضبط
+    cancelled عند إلغاء من ينتظره، لأن خيط العامل لا يمكن إيقافه من الخارج.
+    yt-dlp والتحميل المجزأ يستدعيانه باستمرار أثناء التحميل.
+    """
+
+    def __init__(self, progress_hook=None):
+        self._progress_hook = progress_hook
+        self.cancelled = threading.Event()
+
+    def __call__(self, d: dict):
+        if self.cancelled.is_set():
+            raise yt_dlp.utils.DownloadCancelled("download cancelled")
+        if self._progress_hook:
+            self._progress_hook(d)
+
+
+_progress_manager = None
+
+
+def _relay_progress(queue, progress_hook):
+    """خيط ينقل العينات من طابور العملية الفرعية إلى hook البوت حتى تصل None"""
+    while True:
+        try:
+            d = queue.get()
+        except (EOFError, OSError):
+            return
+        if d is None:
+            return
+        progress_hook(d)
+
+
+def _cancel_event(hook) -> Optional[threading.Event]:
+    """حدث إيقاف مهمة التحميل في وضع الخيوط (None في وضع العمليات)"""
+    return hook.cancelled if isinstance(hook, _CancellableHook) else None
+
+
+@contextmanager
+def _progress_channel(progress_hook):
+    """
+    hook يمكن تمريره لمهمة التحميل: _CancellableHook حول الدالة في وضع الخيوط،
+    وفي وضع العمليات hook قابل للتسلسل ينقل التقدم عبر طابور multiprocessing.Manager.
+    """
+    global _progress_manager
+    if not download_pool.uses_processes:
+        yield _CancellableHook(progress_hook)
+        return
+    if progress_hook is None:
+        yield None
+        return
+    if _progress_manager is None:
+        _progress_manager = process_context().Manager()
+    queue = _progress_manager.Queue()
+    relay = threading.Thread(target=_relay_progress, args=(queue, progress_hook), daemon=True)
+    relay.start()
+    try:
+        yield _QueueProgressHook(queue)
+    finally:
+        queue.put(None)
+
+
 async def fetch_video_info(url: str) -> Optional[VideoInfo]:
     """
     جلب معلومات الفيديو بدون تحميله (غير متزامن).
+    النتيجة تُخزَّن في كاش المعلومات بمفتاح المعرّف الموحد للوسائط.
     Returns VideoInfo object or None on failure.
     """
-    def _fetch():
-        opts = {
-            **YTDLP_BASE_OPTIONS,
-            "skip_download": True,
-        }
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            return ydl.extract_info(url, download=False)
+    key = media_key(url)
+    descriptor = media_info_cache.get(key)
+    if descriptor:
+        return descriptor
+
+    cached = await metadata_cache.aget(key)
+    if cached:
+        logger.info(f"Metadata cache hit for {key}")
+        return _remember_descriptor(key, VideoInfo(cached))
 
     try:
-        loop = asyncio.get_event_loop()
-        info = await loop.run_in_executor(None, _fetch)
+        if job_queue.enabled:
+            # الوضع المنفصل: الاستخراج وفحص الأحجام لدى العمال
+            info = await job_queue.submit("info", {"url": url})
+        else:
+            info = await _extract_info(url)
         if info:
-            return VideoInfo(info)
+            await metadata_cache.aset(key, info)
+            return _remember_descriptor(key, VideoInfo(info))
         return None
     except yt_dlp.utils.DownloadError as e:
         logger.error(f"yt-dlp DownloadError for {url}: {e}")
@@ -167,164 +1013,491 @@ async def fetch_video_info(url: str) -> Optional[VideoInfo]:
         raise
 
 
+async def _extract_info(url: str) -> Optional[dict]:
+    """استخراج المعلومات على مجمّع الاستخراج ثم ملء الأحجام الناقصة"""
+    info = await extract_pool.run(_extract_info_job, url, platform=platform_id(url))
+    if info:
+        await _probe_format_sizes(info)
+    return info
+
+
+def _remember_descriptor(key: str, descriptor: VideoInfo) -> VideoInfo:
+    """مشاركة الواصف (وقوائم جوداته المحسوبة) بين كل طلبات نفس الوسائط"""
+    media_info_cache.set(key, descriptor, descriptor.estimated_size())
+    return descriptor
+
+
+async def _probe_format_sizes(info: dict):
+    """
+    ملء الحجم الحقيقي (Content-Length) للصيغ التي تظهر في قوائم الجودة ولا يذكر yt-dlp
+    حجمها، عبر طلبات HEAD/Range على مجمّع الفحص (probe_pool) ضمن مهلة إجمالية قصيرة.
+    لكل طلب مهلة اتصال/قراءة SIZE_PROBE_TIMEOUT، فالطلبات المتأخرة تحرر خيوطها بعدها.
+    النتائج تُكتب داخل info نفسه فتُخزَّن مع المعلومات في الكاش.
+    """
+    formats = info.get("formats")
+    if not formats and info.get("entries"):
+        formats = info["entries"][0].get("formats")
+    by_id = {fmt.get("format_id"): fmt for fmt in formats or []}
+    candidates = [
+        by_id[format_id] for format_id in VideoInfo(info).menu_format_ids()
+        if format_id in by_id
+        and not (by_id[format_id].get("filesize") or by_id[format_id].get("filesize_approx"))
+        and _is_progressive(by_id[format_id])
+    ][:SIZE_PROBE_MAX_FORMATS]
+    if not candidates:
+        return
+
+    tasks = {
+        asyncio.ensure_future(probe_pool.run(
+            _probe_size, fmt["url"], dict(fmt.get("http_headers") or {}), SIZE_PROBE_TIMEOUT,
+        )): fmt
+        for fmt in candidates
+    }
+    done, pending = await asyncio.wait(tasks, timeout=SIZE_PROBE_DEADLINE)
+    for task in pending:
+        task.cancel()
+
+    probed = 0
+    for task in done:
+        if task.exception() is None and task.result():
+            tasks[task]["filesize"] = task.result()
+            probed += 1
+    logger.info(f"Probed sizes for {probed}/{len(candidates)} formats ({len(pending)} timed out)")
+
+
+def _disk_estimate(estimated_size: int | None, max_bytes: int) -> int:
+    """
+    المساحة المحجوزة للمهمة: الملفات المنفصلة + الملف المدمج (~ضعف الحجم التقديري)،
+    وبدون تقدير: أقصى حجم يسمح به التحميل (max_bytes).
+    أجزاء التقسيم تُحجز إضافياً عند التقسيم (split_for_upload).
+    """
+    if not estimated_size:
+        return max_bytes
+    return min(int(estimated_size) * 2, max_bytes * 2)
+
+
+class _SharedDownload:
+    """مهمة تحميل واحدة يشترك فيها كل من طلب نفس الملف في نفس الوقت"""
+    __slots__ = ("task", "waiters", "progress_callbacks")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.progress_callbacks: list = []
+
+    def progress_hook(self, d: dict):
+        """توزيع تحديثات التقدم على جميع المنتظرين (يُستدعى من خيط العامل)"""
+        for callback in list(self.progress_callbacks):
+            try:
+                callback(d)
+            except Exception:
+                pass
+
+
+# التحميلات الجارية: {(kind, media_key, ...format params): _SharedDownload}
+_inflight: dict[tuple, _SharedDownload] = {}
+# عدد المستخدمين الذين ما زالوا يحتاجون كل ملف: {file_path: refs}
+_file_refs: dict[str, int] = {}
+
+
+async def _single_flight(key: tuple, job_factory, progress_callback=None):
+    """
+    تنفيذ التحميل مرة واحدة فقط لكل مفتاح: الطلبات المتزامنة المتطابقة تنتظر
+    نفس المهمة وتتشارك ملفاتها وتحديثات تقدمها. كل منتظر يحصل على مرجع للملف،
+    ولا تحذفه cleanup_file إلا عند تحرير آخر مرجع.
+    job_factory(progress_hook) يجب أن يُرجع coroutine التحميل.
+    """
+    job = _inflight.get(key)
+    if job is None:
+        job = _SharedDownload()
+
+        async def _run():
+            # عند الإلغاء تحذف job_factory مجلد مهمتها بما حُمّل فيه حتى الآن
+            try:
+                result = await job_factory(job.progress_hook)
+            finally:
+                if _inflight.get(key) is job:
+                    _inflight.pop(key)
+            # عدد المنتظرين نهائي الآن (لا أحد يستطيع الانضمام بعد الإزالة)
+            paths = [result] if isinstance(result, str) else (result or [])
+            if not job.waiters:
+                # أُلغي كل من طلب الملف أثناء التحميل: لا أحد سيرسله أو يحذفه
+                cleanup_file(paths)
+                return result
+            for path in paths:
+                _file_refs[path] = _file_refs.get(path, 0) + job.waiters
+            return result
+
+        job.task = asyncio.ensure_future(_run())
+        _inflight[key] = job
+    else:
+        logger.info(f"Joining in-flight download {key} ({job.waiters} waiting)")
+
+    job.waiters += 1
+    if progress_callback:
+        job.progress_callbacks.append(progress_callback)
+    try:
+        return await asyncio.shield(job.task)
+    except asyncio.CancelledError:
+        if not job.task.done():
+            job.waiters -= 1
+            if not job.waiters:
+                # لم يعد أحد يحتاج الملف: إيقاف التحميل نفسه (يحرر مكانه في المجمّع)
+                # وإزالته فوراً حتى لا ينضم إليه طلب جديد بعد إلغائه
+                _inflight.pop(key, None)
+                job.task.cancel()
+        elif not job.task.cancelled() and job.task.exception() is None:
+            # انتهى التحميل قبل وصول الإلغاء: مرجع هذا المنتظر محسوب، فنحرره
+            cleanup_file(job.task.result())
+        raise
+    finally:
+        if progress_callback in job.progress_callbacks:
+            job.progress_callbacks.remove(progress_callback)
+
+
 async def download_video(
     url: str,
     height: int = 720,
     format_id: str = None,
-    progress_callback=None
+    progress_callback=None,
+    estimated_size: int = 0,
 ) -> Optional[list[str]]:
     """
     تحميل الفيديو وإرجاع مسار الملف أو قائمة مسارات للمنشورات المتعددة.
+    الطلبات المتزامنة لنفس الفيديو بنفس الجودة تتشارك تحميلاً واحداً.
+    progress_callback(d) دالة متزامنة تستقبل قاموس التقدم من yt-dlp وتُستدعى
+    من خيط العامل (مثل ProgressReporter.hook).
+    estimated_size يُستخدم لحجز المساحة على القرص قبل البدء.
     Returns: list of file path strings or None on failure.
     """
-    temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_PATH)
-
-    def _progress_hook(d):
-        if progress_callback and d["status"] == "downloading":
-            try:
-                total = d.get("total_bytes") or d.get("total_bytes_estimate", 0)
-                downloaded = d.get("downloaded_bytes", 0)
-                if total > 0:
-                    percent = int(downloaded / total * 100)
-                    asyncio.run_coroutine_threadsafe(
-                        progress_callback(percent, downloaded, total),
-                        asyncio.get_event_loop()
-                    )
-            except Exception:
-                pass
-
-    def _download():
-        if format_id and format_id != "bestvideo+bestaudio/best":
-            fmt = f"{format_id}+bestaudio/bestvideo[height<={height}]+bestaudio/best[height<={height}]/best"
-        elif height == 9999:
-            fmt = "bestvideo+bestaudio/best"
-        else:
-            fmt = f"bestvideo[height<={height}]+bestaudio/best[height<={height}]/best[height<={height}]/best"
-
-        opts = {
-            **YTDLP_BASE_OPTIONS,
-            "format": fmt,
-            "outtmpl": os.path.join(temp_dir, "%(playlist_index)s_%(title).50s.%(ext)s"),
-            "merge_output_format": "mp4",
-            "postprocessors": [{
-                "key": "FFmpegVideoConvertor",
-                "preferedformat": "mp4",
-            }],
-            "progress_hooks": [_progress_hook],
-            "max_filesize": MAX_FILE_SIZE_BYTES,
+    key = ("video", media_key(url), height, format_id)
+    # الحد يُحدد في الواجهة حسب وضع خادم Bot API ويُرسل مع المهمة
+    max_bytes = bot_api.max_video_bytes
+    if job_queue.enabled:
+        params = {
+            "url": url, "height": height, "format_id": format_id,
+            "estimated_size": estimated_size, "max_bytes": max_bytes,
         }
+        return await _single_flight(
+            key, lambda hook: _remote_download("video", params, hook), progress_callback
+        )
+    return await _single_flight(
+        key,
+        lambda hook: _download_video(url, height, format_id, hook, estimated_size, max_bytes),
+        progress_callback,
+    )
 
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            ydl.download([url])
 
-        # البحث عن الملفات المحمّلة (دعم المنشورات المتعددة)
-        files = sorted(list(Path(temp_dir).glob("*")), key=os.path.getmtime)
-        if files:
-            return [str(f) for f in files if f.stat().st_size > 0]
-        return None
+async def _download_video(
+    url: str,
+    height: int,
+    format_id: Optional[str],
+    progress_hook=None,
+    estimated_size: int = 0,
+    max_bytes: Optional[int] = None,
+) -> Optional[list[str]]:
+    """تنفيذ تحميل الفيديو الفعلي عبر yt-dlp"""
+    max_bytes = max_bytes or bot_api.max_video_bytes
+    temp_dir = await disk_manager.acquire_job_dir(_disk_estimate(estimated_size, max_bytes))
+    fmt = _video_format_spec(height, format_id)
 
     try:
-        loop = asyncio.get_event_loop()
-        file_path = await loop.run_in_executor(None, _download)
-        return file_path
+        info = await _reusable_info(url)
+        with _progress_channel(progress_hook) as hook:
+            files, timings = await download_pool.run(
+                _download_video_job, url, temp_dir, fmt, hook, info, max_bytes, platform=platform_id(url),
+                cancel_event=_cancel_event(hook),
+            )
+        if not files:
+            disk_manager.release(temp_dir)
+            return None
+        return await _ensure_mp4(files, timings, url)
     except yt_dlp.utils.DownloadError as e:
         logger.error(f"Video download error for {url}: {e}")
+        disk_manager.release(temp_dir)
         raise
-    except Exception as e:
+    except asyncio.CancelledError:
+        logger.info(f"Video download cancelled: {url}")
+        disk_manager.release(temp_dir)
+        raise
+    except BaseException as e:
         logger.error(f"Unexpected error downloading video {url}: {e}")
+        disk_manager.release(temp_dir)
         raise
 
 
-async def download_audio(
+# إحصائيات المعالجة اللاحقة: {المرحلة: [عدد المرات، مجموع الثواني]}
+_postprocess_totals: dict[str, list] = {
+    "merge": [0, 0.0], "remux": [0, 0.0], "audio": [0, 0.0], "transcode": [0, 0.0], "split": [0, 0.0],
+}
+
+
+def _record_timing(stage: str, seconds: float):
+    if seconds > 0:
+        _postprocess_totals[stage][0] += 1
+        _postprocess_totals[stage][1] += seconds
+
+
+def postprocess_stats() -> dict:
+    """عدد مرات كل مرحلة معالجة ومتوسط زمنها بالثواني"""
+    return {
+        stage: {"count": count, "avg_seconds": round(total / count, 2) if count else 0.0}
+        for stage, (count, total) in _postprocess_totals.items()
+    }
+
+
+async def _ensure_mp4(files: list[str], timings: dict, url: str) -> list[str]:
+    """
+    التحويل إلى MP4 (عند الحاجة فقط) في مجمّع المعالجة المنفصل،
+    بالنسخ المباشر كلما أمكن، مع تسجيل أزمنة الدمج والتحويل لكل مهمة.
+    """
+    _record_timing("merge", timings.get("merge", 0.0))
+    converted = []
+    for file_path in files:
+        if not file_path.lower().endswith(".mp4"):
+            file_path, mode, seconds = await transcode_pool.run(convert_to_mp4, file_path)
+            timings[mode] = timings.get(mode, 0.0) + seconds
+            _record_timing(mode, seconds)
+        converted.append(file_path)
+    logger.info(
+        f"Job timings for {url}: "
+        + ", ".join(f"{stage}={seconds:.1f}s" for stage, seconds in timings.items())
+    )
+    return converted
+
+
+async def split_for_upload(file_path: str, max_bytes: Optional[int] = None) -> list[str]:
+    """
+    تقسيم فيديو أكبر من حد الإرسال إلى أجزاء مرقمة (نسخ مباشر عند الإطارات المفتاحية)
+    في مجمّع المعالجة. الأصل يبقى كما هو، وتُحذف الأجزاء مع cleanup_file.
+    الأجزاء تُحجز ضمن ميزانية القرص (بحجم الأصل) على مجلد المهمة قبل التقسيم.
+    Raises FFmpegError if the file cannot be split losslessly under the limit,
+    or DiskFullError if there is no room for the parts.
+    """
+    await disk_manager.reserve_more(os.path.dirname(file_path), os.path.getsize(file_path))
+    parts, seconds = await transcode_pool.run(split_video, file_path, max_bytes or bot_api.max_file_bytes)
+    _record_timing("split", seconds)
+    logger.info(f"Split {file_path} into {len(parts)} parts in {seconds:.1f}s")
+    return parts
+
+
+async def iter_video_items(
     url: str,
-    quality_kbps: int = 192,
+    height: int = 720,
+    format_id: str = None,
     progress_callback=None
+) -> AsyncIterator[list[str]]:
+    """
+    تحميل عناصر المنشورات المتعددة واحداً تلو الآخر، وإرجاع ملفات كل عنصر فور اكتماله
+    حتى يبدأ رفعه بينما يُحمَّل العنصر التالي.
+    للروابط ذات العنصر الواحد يُرجع نتيجة download_video مرة واحدة.
+    """
+    if job_queue.enabled:
+        # في الوضع المنفصل يُحمّل المنشور كاملاً في مهمة واحدة لدى العامل
+        files = await download_video(url, height, format_id, progress_callback)
+        if files:
+            yield files
+        return
+
+    platform = platform_id(url)
+    info = await _reusable_info(url)
+    if info is None:
+        info = await extract_pool.run(_extract_info_job, url, platform=platform)
+        if info:
+            await metadata_cache.aset(media_key(url), info)
+
+    entries = [e for e in (info or {}).get("entries") or [] if isinstance(e, dict)]
+    if not entries:
+        files = await download_video(url, height, format_id, progress_callback)
+        if files:
+            yield files
+        return
+
+    fmt = _video_format_spec(height, format_id)
+    max_bytes = bot_api.max_video_bytes
+    for index, entry in enumerate(entries, start=1):
+        entry_url = entry.get("webpage_url") or entry.get("url") or url
+        # مجلد لكل عنصر: عناصر المنشور الواحد غالباً تحمل نفس العنوان
+        # الحجز حسب حجم العنصر نفسه إن عُرف، لا أقصى حجم مسموح لكل عنصر
+        size = entry.get("filesize") or entry.get("filesize_approx") or CAROUSEL_ITEM_ESTIMATE_MB * 1024 * 1024
+        temp_dir = await disk_manager.acquire_job_dir(_disk_estimate(size, max_bytes))
+        entry_info = entry if entry.get("formats") else None
+        try:
+            with _progress_channel(progress_callback) as hook:
+                files, timings = await download_pool.run(
+                    _download_video_job, entry_url, temp_dir, fmt, hook, entry_info, max_bytes, platform=platform,
+                    cancel_event=_cancel_event(hook),
+                )
+            if files:
+                files = await _ensure_mp4(files, timings, entry_url)
+        except yt_dlp.utils.DownloadError as e:
+            logger.error(f"Carousel item {index} download error for {url}: {e}")
+            disk_manager.release(temp_dir)
+            continue
+        except BaseException:
+            disk_manager.release(temp_dir)
+            raise
+        if not files:
+            disk_manager.release(temp_dir)
+            continue
+        yield files
+
+
+async def download_audio(
+    url: str,
+    quality_kbps: Optional[int] = 192,
+    progress_callback=None,
+    estimated_size: int = 0,
+    format_id: Optional[str] = None,
 ) -> Optional[str]:
     """
-    تحميل الصوت فقط بصيغة MP3.
+    تحميل الصوت فقط: بصيغة MP3 بمعدل البت المطلوب، أو كما هو (m4a/opus) إذا كان
+    quality_kbps=None. يُحمَّل format_id المحدد بعينه عند تمريره.
+    الطلبات المتزامنة لنفس الصوت بنفس الجودة تتشارك تحميلاً واحداً.
     Returns: file path string or None on failure.
     """
-    temp_dir = tempfile.mkdtemp(dir=DOWNLOAD_PATH)
+    key = ("audio", media_key(url), quality_kbps, format_id)
+    max_bytes = bot_api.max_file_bytes
+    if job_queue.enabled:
+        params = {
+            "url": url, "quality_kbps": quality_kbps,
+            "estimated_size": estimated_size, "format_id": format_id, "max_bytes": max_bytes,
+        }
+        return await _single_flight(
+            key, lambda hook: _remote_download("audio", params, hook), progress_callback
+        )
+    return await _single_flight(
+        key,
+        lambda hook: _download_audio(url, quality_kbps, hook, estimated_size, format_id, max_bytes),
+        progress_callback,
+    )
 
-    def _progress_hook(d):
-        if progress_callback and d["status"] == "downloading":
-            try:
-                total = d.get("total_bytes") or d.get("total_bytes_estimate", 0)
-                downloaded = d.get("downloaded_bytes", 0)
-                if total > 0:
-                    percent = int(downloaded / total * 100)
-                    asyncio.run_coroutine_threadsafe(
-                        progress_callback(percent, downloaded, total),
-                        asyncio.get_event_loop()
-                    )
-            except Exception:
-                pass
 
-    def _download():
-        opts = {
-            **YTDLP_BASE_OPTIONS,
-            "format": "bestaudio/best",
-            "outtmpl": os.path.join(temp_dir, "%(title).50s.%(ext)s"),
-            "postprocessors": [
-                {
-                    "key": "FFmpegExtractAudio",
-                    "preferredcodec": "mp3",
-                    "preferredquality": str(quality_kbps),
-                },
-                {
-                    "key": "EmbedThumbnail",
-                },
-                {
-                    "key": "FFmpegMetadata",
-                    "add_metadata": True,
-                },
-            ],
-            "writethumbnail": True,
-            "progress_hooks": [_progress_hook],
-            "max_filesize": MAX_FILE_SIZE_BYTES,
-        }
+def _result_dirs(result) -> set[str]:
+    """مجلدات المهام التي تحتوي ملفات نتيجة تحميل (مسار واحد أو قائمة)"""
+    paths = [result] if isinstance(result, str) else (result or [])
+    return {os.path.dirname(path) for path in paths}
 
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            ydl.download([url])
 
-        # البحث عن ملف MP3
-        mp3_files = list(Path(temp_dir).glob("*.mp3"))
-        if mp3_files:
-            return str(mp3_files[0])
+def _discard_remote_result(result):
+    """أنهى العامل التحميل بعد إلغاء الطلب: لا أحد سيرسل الملفات فتُحذف مجلداتها"""
+    for job_dir in _result_dirs(result):
+        disk_manager.release(job_dir)
 
-        # fallback: أي ملف صوتي
-        audio_files = list(Path(temp_dir).glob("*"))
-        if audio_files:
-            return str(max(audio_files, key=lambda f: f.stat().st_size))
-        return None
+
+async def _remote_download(kind: str, params: dict, progress_hook):
+    """
+    الوضع المنفصل: تنفيذ التحميل في عملية عامل عبر الطابور. العامل يكتب في نفس
+    DOWNLOAD_PATH، فتتبنى الواجهة مجلد المهمة حتى تحذفه cleanup_file بعد الإرسال.
+    """
+    result = await job_queue.submit(kind, params, progress_hook, on_discard=_discard_remote_result)
+    for job_dir in _result_dirs(result):
+        disk_manager.adopt(job_dir, _disk_estimate(params.get("estimated_size"), params["max_bytes"]))
+    return result
+
+
+async def run_download_job(kind: str, params: dict, progress_hook=None):
+    """
+    تنفيذ مهمة من الطابور داخل عملية العامل (بنفس معاملات fetch_video_info/download_video/download_audio).
+    Returns: the compact info dict for info, list of paths for video, a single path for audio, or None.
+    """
+    if kind == "info":
+        return await _extract_info(params["url"])
+    if kind == "video":
+        return await _download_video(
+            params["url"], params["height"], params.get("format_id"),
+            progress_hook, params.get("estimated_size", 0), params.get("max_bytes"),
+        )
+    if kind == "audio":
+        return await _download_audio(
+            params["url"], params.get("quality_kbps"), progress_hook,
+            params.get("estimated_size", 0), params.get("format_id"), params.get("max_bytes"),
+        )
+    raise ValueError(f"unknown job kind: {kind}")
+
+
+async def _download_audio(
+    url: str,
+    quality_kbps: Optional[int],
+    progress_hook=None,
+    estimated_size: int = 0,
+    format_id: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> Optional[str]:
+    """تنفيذ تحميل الصوت الفعلي عبر yt-dlp"""
+    max_bytes = max_bytes or bot_api.max_file_bytes
+    temp_dir = await disk_manager.acquire_job_dir(_disk_estimate(estimated_size, max_bytes))
 
     try:
-        loop = asyncio.get_event_loop()
-        file_path = await loop.run_in_executor(None, _download)
-        return file_path
+        info = await _reusable_info(url)
+        with _progress_channel(progress_hook) as hook:
+            downloaded = await download_pool.run(
+                _download_audio_job, url, temp_dir, format_id, hook, info, max_bytes, platform=platform_id(url),
+                cancel_event=_cancel_event(hook),
+            )
+        if not downloaded:
+            disk_manager.release(temp_dir)
+            return None
+        # الترميز (أو النسخ المباشر) في مجمّع المعالجة المنفصل
+        return await transcode_pool.run(_postprocess_audio_job, *downloaded, quality_kbps)
     except yt_dlp.utils.DownloadError as e:
         logger.error(f"Audio download error for {url}: {e}")
+        disk_manager.release(temp_dir)
         raise
-    except Exception as e:
+    except asyncio.CancelledError:
+        logger.info(f"Audio download cancelled: {url}")
+        disk_manager.release(temp_dir)
+        raise
+    except BaseException as e:
         logger.error(f"Unexpected error downloading audio {url}: {e}")
+        disk_manager.release(temp_dir)
         raise
 
 
+def _audio_metadata(info: dict) -> dict:
+    """البيانات الوصفية التي تُضمَّن في الملف الصوتي"""
+    return {
+        "title": info.get("track") or info.get("title"),
+        "artist": info.get("artist") or info.get("uploader"),
+        "album": info.get("album"),
+        "date": info.get("upload_date"),
+        "comment": info.get("webpage_url"),
+    }
+
+
 def cleanup_file(file_path: str | list[str]):
-    """حذف الملف أو قائمة الملفات المؤقتة بعد الإرسال"""
+    """
+    حذف الملف أو قائمة الملفات المؤقتة بعد الإرسال.
+    الملفات المشتركة بين عدة طلبات لا تُحذف إلا عند تحرير آخر مرجع لها،
+    ومجلد المهمة يُحذف بالكامل (مع بقايا .part والصور المصغرة) بعد آخر ملف.
+    """
     if not file_path:
         return
     
     paths = [file_path] if isinstance(file_path, str) else file_path
+    job_dirs = set()
     
     for path in paths:
+        refs = _file_refs.get(path)
+        if refs is not None:
+            if refs > 1:
+                _file_refs[path] = refs - 1
+                continue
+            del _file_refs[path]
         try:
             if path and os.path.exists(path):
                 os.remove(path)
-                # حذف المجلد المؤقت إذا كان فارغاً
-                parent = os.path.dirname(path)
-                if os.path.exists(parent) and not os.listdir(parent):
-                    os.rmdir(parent)
                 logger.info(f"Cleaned up: {path}")
+            parent = os.path.dirname(path)
+            if disk_manager.is_job_dir(parent):
+                job_dirs.add(parent)
+            elif os.path.exists(parent) and not os.listdir(parent):
+                # حذف المجلد المؤقت إذا كان فارغاً
+                os.rmdir(parent)
         except Exception as e:
             logger.warning(f"Failed to clean up {path}: {e}")
+
+    for job_dir in job_dirs:
+        # لا نحذف المجلد إذا كان فيه ملف ما زال منتظر آخر يحتاجه
+        if not any(os.path.dirname(p) == job_dir for p in _file_refs):
+            disk_manager.release(job_dir)
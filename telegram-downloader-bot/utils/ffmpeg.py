@@ -0,0 +1,227 @@
+"""
+وحدة تشغيل ffmpeg مباشرة لمراحل المعالجة بعد التحميل
+Thin wrappers around the ffmpeg CLI for post-download processing
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+
+from config.settings import FFMPEG_THREADS
+
+logger = logging.getLogger(__name__)
+
+# صيغ الصور المصغرة التي يكتبها yt-dlp مع writethumbnail
+THUMBNAIL_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+
+# ترميزات يمكن نسخها كما هي داخل MP4 ويشغّلها تلغرام
+MP4_VIDEO_CODECS = {"h264", "hevc"}
+MP4_AUDIO_CODECS = {"aac", "mp3"}
+
+
+class FFmpegError(Exception):
+    """فشل تنفيذ أمر ffmpeg"""
+
+
+def run_ffmpeg(args: list[str]):
+    """تنفيذ ffmpeg مع الوسائط المحددة ورفع FFmpegError عند الفشل"""
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        message = proc.stderr.strip()[-500:] or f"ffmpeg exited with code {proc.returncode}"
+        raise FFmpegError(message)
+
+
+def probe_codecs(path: str) -> tuple[str | None, str | None]:
+    """ترميز الفيديو والصوت في الملف عبر ffprobe. Returns (vcodec, acodec)."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name",
+        "-of", "json", path,
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise FFmpegError(proc.stderr.strip()[-500:] or "ffprobe failed")
+    vcodec = acodec = None
+    for stream in json.loads(proc.stdout or "{}").get("streams", []):
+        if stream.get("codec_type") == "video" and vcodec is None:
+            vcodec = stream.get("codec_name")
+        elif stream.get("codec_type") == "audio" and acodec is None:
+            acodec = stream.get("codec_name")
+    return vcodec, acodec
+
+
+def probe_format(path: str) -> tuple[float, int]:
+    """مدة الملف بالثواني وحجمه بالبايت من بيانات الحاوية. Returns (duration, size)."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration,size",
+        "-of", "json", path,
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise FFmpegError(proc.stderr.strip()[-500:] or "ffprobe failed")
+    fmt = json.loads(proc.stdout or "{}").get("format", {})
+    return float(fmt.get("duration") or 0), int(fmt.get("size") or os.path.getsize(path))
+
+
+# نسبة الحد المستهدفة لكل جزء: القطع يحدث عند أول إطار مفتاحي بعد الوقت المحدد
+SPLIT_HEADROOM = 0.9
+
+
+def split_video(src: str, max_bytes: int, attempts: int = 3) -> tuple[list[str], float]:
+    """
+    تقسيم فيديو أكبر من max_bytes إلى أجزاء متتالية لا يتجاوز كل منها الحد، بالقطع عند
+    الإطارات المفتاحية والنسخ المباشر (segment muxer بدون إعادة ترميز). الأصل لا يُحذف.
+    مدة الجزء تُحسب من معدل البت في الحاوية، وتُقصَّر عند إعادة المحاولة إذا تجاوز
+    أحد الأجزاء الحد (معدل بت متغير أو إطارات مفتاحية متباعدة).
+    Returns: (part paths in order, seconds)
+    """
+    started = time.monotonic()
+    duration, size = probe_format(src)
+    if duration <= 0 or size <= 0:
+        raise FFmpegError(f"cannot split {src}: unknown duration or size")
+
+    segment_time = duration * max_bytes * SPLIT_HEADROOM / size
+    # مجلد خاص بكل عملية تقسيم: قد يقسّم أكثر من طلب نفس الملف المشترك
+    out_dir = tempfile.mkdtemp(prefix="split_", dir=os.path.dirname(src))
+    stem = os.path.splitext(os.path.basename(src))[0].replace("%", "%%")
+    pattern = os.path.join(out_dir, f"{stem}.part%03d.mp4")
+
+    for _ in range(attempts):
+        for name in os.listdir(out_dir):
+            os.remove(os.path.join(out_dir, name))
+        run_ffmpeg([
+            "-i", src, "-map", "0:v:0?", "-map", "0:a:0?", "-c", "copy",
+            "-f", "segment", "-segment_time", f"{segment_time:.3f}",
+            "-reset_timestamps", "1", "-segment_format_options", "movflags=+faststart",
+            pattern,
+        ])
+        parts = sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir))
+        largest = max((os.path.getsize(part) for part in parts), default=0)
+        if parts and largest <= max_bytes:
+            return parts, time.monotonic() - started
+        segment_time *= max_bytes * SPLIT_HEADROOM / max(largest, 1)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    raise FFmpegError(f"could not split {src} into parts under {max_bytes} bytes")
+
+
+def convert_to_mp4(src: str) -> tuple[str, str, float]:
+    """
+    تحويل ملف فيديو إلى MP4 بأقل تكلفة ممكنة (بديل FFmpegVideoConvertor)، وحذف الأصل:
+    - remux: نسخ المسارات كما هي عندما تكون الترميزات متوافقة مع MP4
+    - audio: نسخ الفيديو وإعادة ترميز الصوت فقط إلى AAC
+    - transcode: إعادة ترميز كاملة (الملاذ الأخير) بعدد خيوط محدود
+    Returns: (dst_path, mode, seconds)
+    """
+    started = time.monotonic()
+    dst = os.path.splitext(src)[0] + ".mp4"
+    vcodec, acodec = probe_codecs(src)
+
+    args = ["-i", src, "-map", "0:v:0?", "-map", "0:a:0?"]
+    if vcodec in MP4_VIDEO_CODECS:
+        args += ["-c:v", "copy"]
+        if acodec is None or acodec in MP4_AUDIO_CODECS:
+            mode = "remux"
+            args += ["-c:a", "copy"]
+        else:
+            mode = "audio"
+            args += ["-c:a", "aac", "-b:a", "160k"]
+    else:
+        mode = "transcode"
+        args += [
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-c:a", "aac", "-b:a", "160k",
+            "-threads", str(FFMPEG_THREADS),
+        ]
+    args += ["-movflags", "+faststart", dst]
+
+    run_ffmpeg(args)
+    os.remove(src)
+    return dst, mode, time.monotonic() - started
+
+
+# الحاوية المناسبة لكل ترميز صوتي عند التسليم بدون تحويل، وهل تدعم صورة الغلاف
+AUDIO_CONTAINERS = {
+    "aac": (".m4a", True),
+    "alac": (".m4a", True),
+    "mp3": (".mp3", True),
+    "opus": (".ogg", False),
+    "vorbis": (".ogg", False),
+}
+# الحاويات التي يعرضها تلغرام كمقطع صوتي عبر sendAudio؛ غيرها (مثل .ogg) يُرسل كمستند
+SEND_AUDIO_EXTS = (".mp3", ".m4a")
+
+
+def _audio_args(src: str, dst: str, thumbnail: str | None, metadata: dict, codec_args: list[str]) -> list[str]:
+    """بناء وسائط ffmpeg لاستدعاء واحد: الصوت + صورة الغلاف + البيانات الوصفية"""
+    args = ["-i", src]
+    if thumbnail:
+        args += ["-i", thumbnail, "-map", "0:a:0", "-map", "1:v:0"]
+        args += ["-c:v", "copy" if thumbnail.lower().endswith((".jpg", ".jpeg")) else "mjpeg"]
+        args += ["-disposition:v", "attached_pic", "-metadata:s:v", "title=Album cover"]
+    else:
+        args += ["-map", "0:a:0"]
+    args += codec_args
+    for key, value in metadata.items():
+        if value:
+            args += ["-metadata", f"{key}={value}"]
+    if dst.lower().endswith(".mp3"):
+        args += ["-id3v2_version", "3"]
+    args.append(dst)
+    return args
+
+
+def encode_audio(
+    src: str,
+    thumbnail: str | None,
+    metadata: dict,
+    quality_kbps: int | None = None,
+) -> str:
+    """
+    إنتاج الملف الصوتي النهائي في استدعاء ffmpeg واحد (بديل FFmpegExtractAudio +
+    EmbedThumbnail + FFmpegMetadata)، وحذف الأصل.
+    - quality_kbps=None: نسخ الصوت كما هو (m4a/opus) إلى حاوية مناسبة بدون إعادة ترميز
+    - غير ذلك: الترميز إلى MP3 بمعدل البت المطلوب
+    إذا فشل تضمين الغلاف يُعاد المحاولة بدونه.
+    """
+    base = os.path.splitext(src)[0]
+    container = None
+    if quality_kbps is None:
+        container = AUDIO_CONTAINERS.get(probe_codecs(src)[1] or "")
+        if container is None:
+            # ترميز غير مدعوم للتسليم المباشر: الرجوع إلى MP3
+            quality_kbps = 192
+
+    if container:
+        ext, supports_cover = container
+        codec_args = ["-c:a", "copy"]
+        if ext == ".m4a":
+            codec_args += ["-movflags", "+faststart"]
+    else:
+        ext, supports_cover = ".mp3", True
+        codec_args = ["-c:a", "libmp3lame", "-b:a", f"{quality_kbps}k"]
+
+    dst = f"{base}{ext}"
+    if dst == src:
+        dst = f"{base}.tagged{ext}"
+    cover = thumbnail if supports_cover else None
+
+    try:
+        run_ffmpeg(_audio_args(src, dst, cover, metadata, codec_args))
+    except FFmpegError as e:
+        if not cover:
+            raise
+        logger.warning(f"Failed to embed cover into {dst}, retrying without it: {e}")
+        run_ffmpeg(_audio_args(src, dst, None, metadata, codec_args))
+
+    os.remove(src)
+    if dst.endswith(f".tagged{ext}"):
+        os.replace(dst, f"{base}{ext}")
+        dst = f"{base}{ext}"
+    return dst
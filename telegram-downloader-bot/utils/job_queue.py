@@ -0,0 +1,309 @@
+"""
+وحدة طابور المهام الدائم (SQLite بوضع WAL) بين واجهة البوت وعمليات العمال
+Durable local job queue for the split frontend/worker mode
+
+- الواجهة تضيف المهمة وتنتظر نتيجتها؛ مهمة خلفية واحدة تفحص كل المهام المنتظرة
+  في استعلام واحد وتمرر التقدم إلى progress_hook
+- العامل يحجز المهمة (lease) ويجدد حجزه مع آخر عينة تقدم؛ إذا توقف العامل
+  تعود المهمة إلى الطابور بعد انتهاء الحجز حتى JOB_MAX_ATTEMPTS محاولات
+كل عمليات القرص تعمل في خيط عامل فلا تُحجب حلقة الأحداث.
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Any, Optional
+
+from config.settings import (
+    JOB_QUEUE_PATH, JOB_POLL_INTERVAL, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_QUEUE_TIMEOUT,
+)
+from utils.workers import PoolBusyError, JobTimeoutError
+from utils.disk import DiskFullError
+
+logger = logging.getLogger(__name__)
+
+# حقول التقدم التي تُنقل من العامل (يكفيها ما يستخدمه ProgressReporter)
+PROGRESS_KEYS = ("status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta")
+
+
+class RemoteJobError(Exception):
+    """فشلت المهمة في عملية العامل"""
+
+
+# أخطاء العامل التي تُعاد بنفس نوعها حتى تعرض المعالجات الرسالة المناسبة
+_REMOTE_ERRORS = {
+    "PoolBusyError": PoolBusyError,
+    "DiskFullError": DiskFullError,
+    "JobTimeoutError": JobTimeoutError,
+}
+
+
+class _Waiter:
+    """مهمة تنتظرها الواجهة"""
+    __slots__ = ("future", "progress_hook", "progress", "created")
+
+    def __init__(self, future: asyncio.Future, progress_hook):
+        self.future = future
+        self.progress_hook = progress_hook
+        self.progress: Optional[str] = None
+        self.created = time.monotonic()
+
+
+class JobQueue:
+    """
+    طابور مهام SQLite مشترك بين عمليات نفس الجهاز.
+    الحالات: queued → running → done | failed، أو cancelled عند تخلي الواجهة عن المهمة.
+    مسار فارغ = تعطيل (التحميل داخل عملية البوت كالمعتاد).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = JOB_POLL_INTERVAL,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        queue_timeout: float = JOB_QUEUE_TIMEOUT,
+    ):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.queue_timeout = queue_timeout
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._waiters: dict[int, _Waiter] = {}
+        self._poller: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # ===== عمليات القرص (متزامنة، تُستدعى من خيط عامل) =====
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None: المعاملات تُدار يدوياً (BEGIN IMMEDIATE عند الحجز)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, params TEXT NOT NULL, "
+                "status TEXT NOT NULL, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+                "progress TEXT, result TEXT, error_type TEXT, error TEXT, "
+                "created_at REAL NOT NULL, lease_until REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        return self._conn
+
+    def _execute(self, sql: str, args: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connect().execute(sql, args)
+
+    def _insert(self, kind: str, params: dict) -> int:
+        return self._execute(
+            "INSERT INTO jobs (kind, params, status, created_at) VALUES (?, ?, 'queued', ?)",
+            (kind, json.dumps(params), time.time()),
+        ).lastrowid
+
+    def _fetch(self, job_ids: list[int]) -> list[tuple]:
+        marks = ",".join("?" * len(job_ids))
+        return self._execute(
+            f"SELECT id, status, progress, result, error_type, error FROM jobs WHERE id IN ({marks})",
+            tuple(job_ids),
+        ).fetchall()
+
+    def _delete(self, job_ids: list[int]):
+        marks = ",".join("?" * len(job_ids))
+        self._execute(f"DELETE FROM jobs WHERE id IN ({marks})", tuple(job_ids))
+
+    def _cancel(self, job_id: int):
+        # المهمة المنتظرة تُحذف فوراً، والجارية يلاحظ عاملها الإلغاء عند تجديد الحجز
+        self._execute("DELETE FROM jobs WHERE id = ? AND status = 'queued'", (job_id,))
+        self._execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def _claim(self, worker: str) -> Optional[tuple[int, str, dict]]:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # مهام عمال توقفوا بعد استنفاد المحاولات: فشل نهائي
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error_type = 'JobTimeoutError', "
+                    "error = 'worker stopped responding (timeout)' "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, self.max_attempts),
+                )
+                row = conn.execute(
+                    "SELECT id, kind, params FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                        "lease_until = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def _heartbeat(self, job_id: int, worker: str, progress: Optional[str]) -> bool:
+        return self._execute(
+            "UPDATE jobs SET lease_until = ?, progress = COALESCE(?, progress) "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, progress, job_id, worker),
+        ).rowcount == 1
+
+    def _finish(self, job_id: int, worker: str, status: str, result: Any = None,
+                error_type: str = None, error: str = None) -> bool:
+        return self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error_type = ?, error = ?, lease_until = NULL "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, json.dumps(result), error_type, error, job_id, worker),
+        ).rowcount == 1
+
+    def _discard(self, job_id: int):
+        self._execute("DELETE FROM jobs WHERE id = ? AND status = 'cancelled'", (job_id,))
+
+    def _reset(self):
+        self._execute("DELETE FROM jobs WHERE status != 'running'")
+        self._execute("UPDATE jobs SET status = 'cancelled' WHERE status = 'running'")
+
+    # ===== جهة الواجهة =====
+
+    async def _run_sync(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def reset(self):
+        """
+        عند بدء الواجهة: لا أحد ينتظر المهام القديمة، لذا تُحذف المنتظرة منها
+        ويُطلب من العمال التخلي عن الجارية.
+        """
+        await self._run_sync(self._reset)
+
+    async def submit(self, kind: str, params: dict, progress_hook=None, on_discard=None) -> Any:
+        """
+        إضافة مهمة وانتظار نتيجتها من العامل.
+        progress_hook(d) يستقبل قواميس تقدم بنفس شكل yt-dlp.
+        on_discard(result) يُستدعى إذا أُلغي الانتظار بعد أن أنهى العامل المهمة (لحذف ملفاتها).
+        Raises RemoteJobError (or the worker's PoolBusyError/DiskFullError/JobTimeoutError).
+        """
+        job_id = await self._run_sync(self._insert, kind, params)
+        self.submitted += 1
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), progress_hook)
+        self._waiters[job_id] = waiter
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                if on_discard:
+                    on_discard(future.result())
+            else:
+                await asyncio.shield(self._run_sync(self._cancel, job_id))
+            raise
+        finally:
+            self._waiters.pop(job_id, None)
+
+    async def _poll(self):
+        """مهمة خلفية واحدة لكل المهام المنتظرة: استعلام واحد كل poll_interval"""
+        while self._waiters:
+            await asyncio.sleep(self.poll_interval)
+            job_ids = list(self._waiters)
+            if not job_ids:
+                break
+            try:
+                rows = await self._run_sync(self._fetch, job_ids)
+            except sqlite3.Error as e:
+                logger.error(f"Job queue poll failed: {e}")
+                continue
+
+            finished = []
+            now = time.monotonic()
+            for job_id, status, progress, result, error_type, error in rows:
+                waiter = self._waiters.get(job_id)
+                if waiter is None or waiter.future.done():
+                    continue
+                if status == "done":
+                    finished.append(job_id)
+                    self.completed += 1
+                    waiter.future.set_result(json.loads(result) if result else None)
+                elif status in ("failed", "cancelled"):
+                    finished.append(job_id)
+                    self.failed += 1
+                    error_class = _REMOTE_ERRORS.get(error_type, RemoteJobError)
+                    waiter.future.set_exception(error_class(error or f"job {status}"))
+                elif status == "queued" and now - waiter.created > self.queue_timeout:
+                    # لا يوجد عامل حر: رفض بدلاً من انتظار غير محدود
+                    logger.warning(f"Job {job_id} waited {int(now - waiter.created)}s without a worker")
+                    await self._run_sync(self._cancel, job_id)
+                    waiter.future.set_exception(PoolBusyError("no worker available"))
+                elif progress and progress != waiter.progress and waiter.progress_hook:
+                    waiter.progress = progress
+                    try:
+                        waiter.progress_hook(json.loads(progress))
+                    except Exception:
+                        pass
+
+            if finished:
+                try:
+                    await self._run_sync(self._delete, finished)
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to delete finished jobs: {e}")
+
+    # ===== جهة العامل =====
+
+    async def claim(self, worker: str) -> Optional[tuple[int, str, dict]]:
+        """حجز أقدم مهمة متاحة. Returns (job_id, kind, params) or None."""
+        return await self._run_sync(self._claim, worker)
+
+    async def heartbeat(self, job_id: int, worker: str, progress: Optional[dict] = None) -> bool:
+        """تجديد الحجز ونشر آخر تقدم. False = أُلغيت المهمة أو انتقلت لعامل آخر."""
+        payload = json.dumps(progress) if progress else None
+        return await self._run_sync(self._heartbeat, job_id, worker, payload)
+
+    async def complete(self, job_id: int, worker: str, result: Any) -> bool:
+        """تسجيل النتيجة. False = لم يعد أحد ينتظرها (على العامل حذف ملفاتها)."""
+        return await self._run_sync(self._finish, job_id, worker, "done", result)
+
+    async def fail(self, job_id: int, worker: str, error: BaseException) -> bool:
+        return await self._run_sync(
+            self._finish, job_id, worker, "failed", None, type(error).__name__, str(error)[:1000]
+        )
+
+    async def discard(self, job_id: int):
+        """حذف مهمة تخلّت عنها الواجهة"""
+        await self._run_sync(self._discard, job_id)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "waiting": len(self._waiters),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+# الطابور المشترك بين الواجهة والعمال
+job_queue = JobQueue(JOB_QUEUE_PATH)
@@ -0,0 +1,140 @@
+"""
+وحدة تفضيلات المستخدمين الدائمة (SQLite بوضع WAL) مع كتابة مؤجلة على دفعات
+Persistent user preferences and counters with write-behind batching
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Optional
+
+from config.settings import PREFS_DB_PATH, PREFS_FLUSH_INTERVAL, PREFS_FLUSH_BATCH
+
+logger = logging.getLogger(__name__)
+
+
+class PrefsStore:
+    """
+    تخزين اللغة وعدد التحميلات لكل مستخدم.
+    - القراءة تتم مرة واحدة لكل مستخدم عند أول تحديث منه (تحميل كسول بدلاً من قراءة الجدول كله)
+    - الكتابة تُجمَّع في الذاكرة وتُكتب على دفعات بواسطة مهمة خلفية
+    - كل عمليات القرص تعمل في خيط عامل فلا تُحجب حلقة الأحداث أبداً
+    مسار فارغ = تعطيل الحفظ (كل شيء في الذاكرة فقط).
+    """
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # {user_id: (lang, downloads)} — آخر قيمة فقط لكل مستخدم (دمج الكتابات المتكررة)
+        self._dirty: dict[int, tuple[Optional[str], int]] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self.loads = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # ===== عمليات القرص (متزامنة، تُستدعى من خيط عامل) =====
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_prefs ("
+                "user_id INTEGER PRIMARY KEY, lang TEXT, "
+                "downloads INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+            )
+        return self._conn
+
+    def _read(self, user_id: int) -> Optional[tuple[Optional[str], int]]:
+        with self._lock:
+            return self._connect().execute(
+                "SELECT lang, downloads FROM user_prefs WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    def _write(self, rows: list[tuple[int, Optional[str], int]]):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT INTO user_prefs (user_id, lang, downloads, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "lang = excluded.lang, downloads = excluded.downloads, updated_at = excluded.updated_at",
+                [(user_id, lang, downloads, now) for user_id, lang, downloads in rows],
+            )
+            conn.commit()
+
+    # ===== الواجهة غير المتزامنة =====
+
+    async def load(self, user_id: int) -> Optional[tuple[Optional[str], int]]:
+        """تفضيلات المستخدم المحفوظة. Returns (lang, downloads) or None."""
+        if user_id in self._dirty:
+            # كتابة لم تُحفظ بعد أحدث من القرص
+            return self._dirty[user_id]
+        if not self.enabled:
+            return None
+        self.loads += 1
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, user_id)
+
+    def save(self, user_id: int, lang: Optional[str], downloads: int):
+        """تسجيل تغيير للحفظ لاحقاً (فوري ولا يلمس القرص)"""
+        if not self.enabled:
+            return
+        self._dirty[user_id] = (lang, downloads)
+        if len(self._dirty) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    async def flush(self):
+        """كتابة كل التغييرات المعلّقة في معاملة واحدة"""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        rows = [(user_id, lang, downloads) for user_id, (lang, downloads) in pending.items()]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+            self.flushes += 1
+            self.rows_written += len(rows)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(rows)} user prefs: {e}")
+            # إعادة ما فشل دون الكتابة فوق تغييرات أحدث وصلت أثناء المحاولة
+            for user_id, value in pending.items():
+                self._dirty.setdefault(user_id, value)
+
+    async def run_writer(self):
+        """مهمة خلفية: الحفظ كل flush_interval أو فور امتلاء الدفعة"""
+        if not self.enabled:
+            return
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._dirty),
+            "loads": self.loads,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+        }
+
+
+# مخزن التفضيلات المشترك
+prefs_store = PrefsStore(PREFS_DB_PATH, PREFS_FLUSH_INTERVAL, PREFS_FLUSH_BATCH)
@@ -0,0 +1,124 @@
+"""
+وحدة تقارير التقدم: نقل عينات التقدم من خيوط yt-dlp إلى حلقة الأحداث
+وتحديث رسالة الحالة بمعدل محدود
+Thread-safe, throttled progress reporting for status messages
+"""
+
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from config.settings import PROGRESS_EDIT_INTERVAL, PROGRESS_MIN_STEP
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressSample(NamedTuple):
+    """عينة تقدم واحدة"""
+    percent: int
+    downloaded: int
+    total: int
+    speed: float      # بايت/ثانية
+    eta: int          # ثوانٍ
+
+
+class ProgressReporter:
+    """
+    قناة تقدم مرتبطة بحلقة الأحداث الرئيسية:
+    - hook() يُستدعى من خيط العامل ويمرر العينة عبر call_soon_threadsafe
+    - تُحفظ آخر عينة فقط (العينات القديمة تُتجاهل)
+    - مهمة واحدة تعدّل الرسالة كل PROGRESS_EDIT_INTERVAL ثانية على الأكثر
+      وفقط عند تغير النسبة بمقدار PROGRESS_MIN_STEP على الأقل
+
+    Usage:
+        async with ProgressReporter(edit, render) as progress:
+            await download_video(url, progress_callback=progress.hook)
+    """
+
+    def __init__(
+        self,
+        edit: Callable[[str], Awaitable],
+        render: Callable[[ProgressSample], str],
+        min_interval: float = PROGRESS_EDIT_INTERVAL,
+        min_step: int = PROGRESS_MIN_STEP,
+    ):
+        self._edit = edit
+        self._render = render
+        self._min_interval = min_interval
+        self._min_step = min_step
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._latest: Optional[ProgressSample] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_percent = -100
+        self._last_edit = 0.0
+
+    async def __aenter__(self) -> "ProgressReporter":
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def hook(self, d: dict):
+        """hook لـ yt-dlp — آمن للاستدعاء من أي خيط"""
+        if d.get("status") != "downloading" or self._loop is None:
+            return
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        if total <= 0:
+            return
+        downloaded = d.get("downloaded_bytes") or 0
+        sample = ProgressSample(
+            percent=min(100, int(downloaded / total * 100)),
+            downloaded=downloaded,
+            total=int(total),
+            speed=d.get("speed") or 0.0,
+            eta=int(d.get("eta") or 0),
+        )
+        try:
+            self._loop.call_soon_threadsafe(self._push, sample)
+        except RuntimeError:
+            # الحلقة أُغلقت
+            pass
+
+    def _push(self, sample: ProgressSample):
+        self._latest = sample
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+
+            delay = self._last_edit + self._min_interval - time.monotonic()
+            if delay > 0:
+                # تجميع العينات التي تصل خلال فترة الانتظار، وتُستخدم آخرها فقط
+                await asyncio.sleep(delay)
+
+            sample = self._latest
+            if sample is None or abs(sample.percent - self._last_percent) < self._min_step:
+                continue
+
+            try:
+                await self._edit(self._render(sample))
+                self._last_percent = sample.percent
+            except RetryAfter as e:
+                logger.debug(f"Progress edit throttled by Telegram for {e.retry_after}s")
+                self._last_edit = time.monotonic() + float(e.retry_after)
+                self._wake.set()
+                continue
+            except BadRequest:
+                # غالباً "message is not modified" — لا حاجة لإعادة المحاولة
+                pass
+            except TelegramError as e:
+                logger.debug(f"Progress edit failed: {e}")
+            self._last_edit = time.monotonic()
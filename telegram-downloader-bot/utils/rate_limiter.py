@@ -3,83 +3,278 @@
 Anti-spam and rate limiting module
 """
 
+import math
 import time
 import logging
-from collections import defaultdict
-from config.settings import RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, COOLDOWN_SECONDS
+import itertools
+from collections import OrderedDict
+from config.settings import (
+    RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, COOLDOWN_SECONDS,
+    GLOBAL_RATE_LIMIT, GLOBAL_RATE_BURST, PLATFORM_CONCURRENCY_LIMITS,
+)
+from utils.state import state_key, state_writer
 
 logger = logging.getLogger(__name__)
 
+# عمر نتائج الخادم المشترك التي لم تُستهلك (تحديثات بلا معالج) قبل حذفها
+_PRIMED_MAX_AGE = 60.0
+
+
+class _UserWindow:
+    """
+    عداد نافذة منزلقة تقريبي لكل مستخدم: عدد طلبات النافذة الحالية والسابقة فقط
+    (ذاكرة ثابتة بدلاً من قائمة الطوابع الزمنية)
+    """
+    __slots__ = ("window_start", "current", "previous", "cooldown_until", "last_seen")
+
+    def __init__(self, window_start: float):
+        self.window_start = window_start
+        self.current = 0
+        self.previous = 0
+        self.cooldown_until = 0.0
+        self.last_seen = window_start
+
 
 class RateLimiter:
     """
-    نظام تحديد معدل الطلبات لكل مستخدم
-    Tracks request counts per user within a time window
+    نظام تحديد معدل الطلبات على ثلاث طبقات:
+    - لكل مستخدم: نافذة منزلقة تقريبية (O(1) وذاكرة ثابتة لكل مستخدم نشط)، مع فترة تهدئة
+    - عام: دلو رموز (token bucket) لعدد الطلبات في الثانية لكل البوت
+    - لكل منصة: حد للطلبات المتزامنة لحماية المستخرجات الحساسة
+    المستخدمون الخاملون يُحذفون تلقائياً من بداية الترتيب (الأقدم نشاطاً) أثناء الاستدعاءات.
     """
 
-    def __init__(self):
-        # {user_id: [timestamps]}
-        self._requests: dict[int, list[float]] = defaultdict(list)
-        # {user_id: cooldown_until_timestamp}
-        self._cooldowns: dict[int, float] = {}
+    def __init__(
+        self,
+        max_requests: int = RATE_LIMIT_REQUESTS,
+        window: float = RATE_LIMIT_WINDOW,
+        cooldown: float = COOLDOWN_SECONDS,
+        global_rate: float = GLOBAL_RATE_LIMIT,
+        global_burst: int = GLOBAL_RATE_BURST,
+        platform_limits: dict[str, int] | None = None,
+    ):
+        self.max_requests = max_requests
+        self.window = window
+        self.cooldown = cooldown
+        # {user_id: _UserWindow} بترتيب آخر نشاط
+        self._users: OrderedDict[int, _UserWindow] = OrderedDict()
+        # دلو الرموز العام (0 = معطّل)
+        self.global_rate = global_rate
+        self.global_burst = max(global_burst, 1)
+        self._tokens = float(self.global_burst)
+        self._tokens_at = time.monotonic()
+        # التزامن لكل منصة
+        self.platform_limits = PLATFORM_CONCURRENCY_LIMITS if platform_limits is None else platform_limits
+        self._platform_active: dict[str, int] = {}
+        # نتائج الخادم المشترك المجلوبة مع تحميل المستخدم بترتيب الإنشاء:
+        # {user_id: (created, window_key, elapsed)} ثم {user_id: (created, window_key, cooldown_ms, estimate)}
+        self._window_elapsed: OrderedDict[int, tuple] = OrderedDict()
+        self._primed: OrderedDict[int, tuple] = OrderedDict()
+        self._refunds = itertools.count()
+        self.evicted = 0
+
+    # ===== وضع الخادم المشترك (عدة نسخ من البوت) =====
+
+    def shared_commands(self, user_id: int) -> list[tuple]:
+        """
+        أوامر تُضاف إلى رحلة تحميل المستخدم: مدة التهدئة المتبقية، وعدادا النافذة الحالية
+        والسابقة في الخادم المشترك (نفس النافذة المنزلقة التقريبية للوضع المحلي).
+        """
+        now = time.time()
+        index = int(now // self.window)
+        created = time.monotonic()
+        self._expire_primed(created)
+        window_key = state_key("rl", user_id, index)
+        # موضع الطلب داخل النافذة الحالية، لوزن عداد النافذة السابقة في prime
+        self._window_elapsed.pop(user_id, None)
+        self._window_elapsed[user_id] = (created, window_key, now - index * self.window)
+        return [
+            ("PTTL", state_key("cooldown", user_id)),
+            ("INCR", window_key),
+            ("EXPIRE", window_key, math.ceil(self.window * 2)),
+            ("GET", state_key("rl", user_id, index - 1)),
+        ]
+
+    def prime(self, user_id: int, results: list):
+        """تخزين نتائج shared_commands حتى يستهلكها is_allowed لنفس التحديث"""
+        pending = self._window_elapsed.pop(user_id, None)
+        if pending is None:
+            return
+        created, window_key, elapsed = pending
+        cooldown_ms, count, _, previous = results
+        # العداد الحالي يشمل هذا الطلب؛ التقدير يخص الطلبات السابقة فقط كما في الوضع المحلي
+        estimate = int(previous or 0) * (1 - elapsed / self.window) + count - 1
+        self._primed.pop(user_id, None)
+        self._primed[user_id] = (created, window_key, cooldown_ms, estimate)
+
+    def _expire_primed(self, now: float, limit: int = 8):
+        """حذف حتى limit نتيجة قديمة لم تُستهلك من بداية كل ترتيب (تكلفة ثابتة لكل استدعاء)"""
+        for pending in (self._window_elapsed, self._primed):
+            for _ in range(limit):
+                if not pending:
+                    break
+                user_id, entry = next(iter(pending.items()))
+                if now - entry[0] < _PRIMED_MAX_AGE:
+                    break
+                del pending[user_id]
+
+    def _refund(self, window_key: str):
+        """
+        الطلب المرفوض لا يُحسب: إنقاص العداد الذي زاده shared_commands.
+        مفتاح كتابة فريد لكل طلب حتى لا تدمج WriteBehind عدة إنقاصات في واحد.
+        """
+        state_writer.queue(
+            f"{window_key}:refund:{next(self._refunds)}",
+            [("DECR", window_key), ("EXPIRE", window_key, math.ceil(self.window * 2))],
+        )
+
+    def _is_allowed_shared(self, user_id: int, cooldown_ms: int, estimate: float) -> tuple[bool, int]:
+        if cooldown_ms > 0:
+            wait_time = math.ceil(cooldown_ms / 1000)
+            logger.warning(f"User {user_id} is in cooldown for {wait_time}s")
+            return False, wait_time
+        if estimate >= self.max_requests:
+            key = state_key("cooldown", user_id)
+            state_writer.queue(key, [("SET", key, 1, "EX", int(self.cooldown))])
+            logger.warning(f"Rate limit exceeded for user {user_id}, cooldown: {self.cooldown}s")
+            return False, int(self.cooldown)
+        return True, 0
 
     def is_allowed(self, user_id: int) -> tuple[bool, int]:
         """
         التحقق من إمكانية قبول طلب المستخدم.
         Returns: (is_allowed: bool, wait_seconds: int)
         """
-        now = time.time()
+        primed = self._primed.pop(user_id, None)
+        if primed is not None:
+            _, window_key, cooldown_ms, estimate = primed
+            allowed, wait = self._is_allowed_shared(user_id, cooldown_ms, estimate)
+            if allowed:
+                allowed, wait = self._take_global_token()
+            if not allowed:
+                self._refund(window_key)
+            return allowed, wait
+        allowed, wait = self._is_allowed_local(user_id)
+        if not allowed:
+            return False, wait
+        return self._take_global_token()
+
+    def _is_allowed_local(self, user_id: int) -> tuple[bool, int]:
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = _UserWindow(now)
+        else:
+            self._users.move_to_end(user_id)
+        entry.last_seen = now
 
         # التحقق من وجود فترة تهدئة نشطة
-        if user_id in self._cooldowns:
-            cooldown_until = self._cooldowns[user_id]
-            if now < cooldown_until:
-                wait_time = int(cooldown_until - now)
-                logger.warning(f"User {user_id} is in cooldown for {wait_time}s")
-                return False, wait_time
-            else:
-                del self._cooldowns[user_id]
-
-        # تنظيف الطلبات القديمة خارج النافذة الزمنية
-        self._requests[user_id] = [
-            ts for ts in self._requests[user_id]
-            if now - ts < RATE_LIMIT_WINDOW
-        ]
+        if now < entry.cooldown_until:
+            wait_time = math.ceil(entry.cooldown_until - now)
+            logger.warning(f"User {user_id} is in cooldown for {wait_time}s")
+            return False, wait_time
 
-        # التحقق من عدد الطلبات
-        if len(self._requests[user_id]) >= RATE_LIMIT_REQUESTS:
+        # تقديم النافذة: الحالية تصبح السابقة (أو تُصفَّر إذا مرت نافذتان)
+        elapsed = now - entry.window_start
+        if elapsed >= self.window:
+            windows = int(elapsed // self.window)
+            entry.previous = entry.current if windows == 1 else 0
+            entry.current = 0
+            entry.window_start += windows * self.window
+            elapsed = now - entry.window_start
+
+        # تقدير عدد الطلبات في آخر window ثانية
+        estimate = entry.previous * (1 - elapsed / self.window) + entry.current
+        if estimate >= self.max_requests:
             # تفعيل فترة التهدئة
-            self._cooldowns[user_id] = now + COOLDOWN_SECONDS
-            logger.warning(f"Rate limit exceeded for user {user_id}, cooldown: {COOLDOWN_SECONDS}s")
-            return False, COOLDOWN_SECONDS
+            entry.cooldown_until = now + self.cooldown
+            logger.warning(f"Rate limit exceeded for user {user_id}, cooldown: {self.cooldown}s")
+            return False, int(self.cooldown)
 
         # تسجيل الطلب الجديد
-        self._requests[user_id].append(now)
+        entry.current += 1
+        return True, 0
+
+    def _evict_idle(self, now: float, limit: int = 4):
+        """حذف حتى limit مستخدمين خاملين من بداية الترتيب (تكلفة ثابتة لكل استدعاء)"""
+        idle_after = 2 * self.window + self.cooldown
+        for _ in range(limit):
+            if not self._users:
+                return
+            user_id, entry = next(iter(self._users.items()))
+            if now - entry.last_seen < idle_after:
+                return
+            del self._users[user_id]
+            self.evicted += 1
+
+    def _take_global_token(self) -> tuple[bool, int]:
+        """الطبقة العامة: دلو رموز يُعبّأ بمعدل global_rate في الثانية"""
+        if self.global_rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        self._tokens = min(self.global_burst, self._tokens + (now - self._tokens_at) * self.global_rate)
+        self._tokens_at = now
+        if self._tokens < 1:
+            wait_time = math.ceil((1 - self._tokens) / self.global_rate)
+            logger.warning(f"Global rate limit reached, retry in {wait_time}s")
+            return False, wait_time
+        self._tokens -= 1
         return True, 0
 
+    # ===== التزامن لكل منصة =====
+
+    def try_acquire_platform(self, platform: str) -> bool:
+        """حجز مكان لطلب على المنصة. Returns False if the platform is at its limit."""
+        limit = self.platform_limits.get(platform)
+        active = self._platform_active.get(platform, 0)
+        if limit is not None and active >= limit:
+            logger.warning(f"Platform {platform} at concurrency limit ({limit})")
+            return False
+        self._platform_active[platform] = active + 1
+        return True
+
+    def release_platform(self, platform: str):
+        """تحرير مكان محجوز بـ try_acquire_platform"""
+        active = self._platform_active.get(platform, 0) - 1
+        if active > 0:
+            self._platform_active[platform] = active
+        else:
+            self._platform_active.pop(platform, None)
+
     def reset_user(self, user_id: int):
         """إعادة تعيين حالة المستخدم (للمشرفين)"""
-        self._requests.pop(user_id, None)
-        self._cooldowns.pop(user_id, None)
+        self._users.pop(user_id, None)
 
     def get_user_stats(self, user_id: int) -> dict:
         """الحصول على إحصائيات المستخدم"""
-        now = time.time()
-        recent_requests = [
-            ts for ts in self._requests.get(user_id, [])
-            if now - ts < RATE_LIMIT_WINDOW
-        ]
-        cooldown_remaining = max(
-            0,
-            int(self._cooldowns.get(user_id, 0) - now)
-        )
+        now = time.monotonic()
+        entry = self._users.get(user_id)
+        requests_in_window = 0
+        cooldown_remaining = 0
+        if entry is not None:
+            elapsed = now - entry.window_start
+            if elapsed < self.window:
+                requests_in_window = int(entry.previous * (1 - elapsed / self.window) + entry.current)
+            elif elapsed < 2 * self.window:
+                requests_in_window = int(entry.current * (1 - (elapsed - self.window) / self.window))
+            cooldown_remaining = max(0, int(entry.cooldown_until - now))
         return {
-            "requests_in_window": len(recent_requests),
-            "max_requests": RATE_LIMIT_REQUESTS,
-            "window_seconds": RATE_LIMIT_WINDOW,
+            "requests_in_window": requests_in_window,
+            "max_requests": self.max_requests,
+            "window_seconds": self.window,
             "cooldown_remaining": cooldown_remaining,
         }
 
+    def stats(self) -> dict:
+        return {
+            "tracked_users": len(self._users),
+            "evicted": self.evicted,
+            "global_tokens": round(self._tokens, 2) if self.global_rate > 0 else None,
+            "platform_active": dict(self._platform_active),
+        }
+
 
 # مثيل عام واحد للاستخدام في جميع أنحاء البوت
 rate_limiter = RateLimiter()
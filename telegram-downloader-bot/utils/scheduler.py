@@ -0,0 +1,200 @@
+"""
+مجدول مهام التحميل: عدالة بين المستخدمين وتقديم المهام الأقصر أولاً
+Fair multi-user job scheduler (shortest-estimated-job-first with aging)
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from config.settings import MAX_CONCURRENT_JOBS, QUEUE_UPDATE_INTERVAL, SCHEDULER_AGING_BYTES
+
+logger = logging.getLogger(__name__)
+
+# معدل افتراضي لتقدير الحجم من المدة عند غياب حجم الملف (~2 ميجابت/ثانية)
+_DEFAULT_BYTES_PER_SECOND = 250_000
+# متوسط مدة الخدمة المفترض قبل توفر قياسات فعلية
+_DEFAULT_SERVICE_SECONDS = 30.0
+
+
+def estimate_job_cost(filesize: int | None, duration: int | float | None) -> int:
+    """تقدير تكلفة المهمة بالبايت من الحجم المعروف أو من المدة"""
+    if filesize:
+        return int(filesize)
+    if duration:
+        return int(duration * _DEFAULT_BYTES_PER_SECOND)
+    return 50 * 1024 * 1024
+
+
+class _Job:
+    """مهمة في طابور أحد المستخدمين"""
+    __slots__ = ("user_id", "cost", "seq", "enqueued_at", "started")
+
+    def __init__(self, user_id: int, cost: int, seq: int):
+        self.user_id = user_id
+        self.cost = cost
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.started = asyncio.Event()
+
+
+class JobScheduler:
+    """
+    مجدول عام لمهام التحميل الثقيلة:
+    - طابور مستقل لكل مستخدم، ولا يتنافس من كل مستخدم إلا أقدم مهامه
+    - بين المستخدمين تُقدَّم المهمة ذات التكلفة الأقل (الأقصر أولاً)
+    - التكلفة تقل مع الانتظار (aging) حتى لا تنتظر المهام الطويلة إلى الأبد
+    - حد عام لعدد المهام المتزامنة
+    """
+
+    def __init__(self, max_concurrent: int, aging_bytes: int):
+        self.max_concurrent = max_concurrent
+        self.aging_bytes = aging_bytes
+        self._queues: dict[int, deque[_Job]] = {}
+        self._running = 0
+        self._seq = itertools.count()
+        # مواقع المهام المنتظرة محسوبة مرة واحدة لكل تغيير في الطوابير أو كل QUEUE_UPDATE_INTERVAL
+        self._positions: Optional[dict[_Job, int]] = None
+        self._positions_at = 0.0
+        # آخر القياسات بالثواني
+        self.wait_times: deque[float] = deque(maxlen=500)
+        self.service_times: deque[float] = deque(maxlen=500)
+
+    # ===== الترتيب =====
+
+    def _priority(self, job: _Job, now: float) -> tuple[float, int]:
+        waited = now - job.enqueued_at
+        return job.cost - waited * self.aging_bytes, job.seq
+
+    def _ordered_jobs(self) -> list[_Job]:
+        """جميع المهام المنتظرة بترتيب التنفيذ المتوقع"""
+        now = time.monotonic()
+        queues = [list(q) for q in self._queues.values()]
+        # محاكاة الاختيار: في كل جولة تتنافس رؤوس الطوابير فقط (كومة برأس كل طابور)
+        heap = [(self._priority(q[0], now), i, 0) for i, q in enumerate(queues)]
+        heapq.heapify(heap)
+        ordered = []
+        while heap:
+            _, i, index = heapq.heappop(heap)
+            ordered.append(queues[i][index])
+            if index + 1 < len(queues[i]):
+                heapq.heappush(heap, (self._priority(queues[i][index + 1], now), i, index + 1))
+        return ordered
+
+    def _dispatch(self):
+        """بدء أكبر عدد ممكن من المهام ضمن الحد العام"""
+        now = time.monotonic()
+        while self._running < self.max_concurrent and self._queues:
+            user_id = min(self._queues, key=lambda uid: self._priority(self._queues[uid][0], now))
+            queue = self._queues[user_id]
+            job = queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+            self._running += 1
+            self._positions = None
+            job.started.set()
+
+    def _remove(self, job: _Job):
+        queue = self._queues.get(job.user_id)
+        if queue and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.user_id]
+            self._positions = None
+
+    # ===== الواجهة =====
+
+    def position(self, job: _Job) -> int:
+        """
+        موقع المهمة في الطابور (1 = التالية). الترتيب يُحسب مرة واحدة لكل المنتظرين
+        ويُعاد حسابه بعد أي تغيير في الطوابير، أو بعد QUEUE_UPDATE_INTERVAL بسبب تقادم الأولويات.
+        """
+        now = time.monotonic()
+        if self._positions is None or now - self._positions_at >= QUEUE_UPDATE_INTERVAL:
+            self._positions = {queued: i for i, queued in enumerate(self._ordered_jobs(), start=1)}
+            self._positions_at = now
+        return self._positions.get(job, 0)
+
+    def estimate_wait(self, position: int) -> float:
+        """تقدير وقت الانتظار بالثواني لموقع معين"""
+        if self.service_times:
+            avg_service = sum(self.service_times) / len(self.service_times)
+        else:
+            avg_service = _DEFAULT_SERVICE_SECONDS
+        rounds = -(-position // self.max_concurrent)  # قسمة مع التقريب للأعلى
+        return rounds * avg_service
+
+    async def run(
+        self,
+        user_id: int,
+        cost: int,
+        job_factory: Callable[[], Awaitable],
+        on_queued: Optional[Callable[[int, float], Awaitable]] = None,
+    ):
+        """
+        انتظار دور المهمة ثم تنفيذها.
+        on_queued(position, eta_seconds) يُستدعى عند تغير موقع المهمة أثناء الانتظار.
+        """
+        job = _Job(user_id, cost, next(self._seq))
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._positions = None
+        self._dispatch()
+
+        last_position = None
+        try:
+            while not job.started.is_set():
+                position = self.position(job)
+                if on_queued and position != last_position:
+                    last_position = position
+                    try:
+                        await on_queued(position, self.estimate_wait(position))
+                    except Exception as e:
+                        logger.debug(f"Queue position callback failed: {e}")
+                try:
+                    await asyncio.wait_for(job.started.wait(), QUEUE_UPDATE_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            if job.started.is_set():
+                self._running -= 1
+                self._dispatch()
+            else:
+                self._remove(job)
+            raise
+
+        started_at = time.monotonic()
+        self.wait_times.append(started_at - job.enqueued_at)
+        try:
+            return await job_factory()
+        finally:
+            self.service_times.append(time.monotonic() - started_at)
+            self._running -= 1
+            self._dispatch()
+
+    def stats(self) -> dict:
+        """مقاييس المجدول: أطوال الطوابير وأزمنة الانتظار والخدمة"""
+        def _summary(samples: deque[float]) -> dict:
+            if not samples:
+                return {"avg": 0.0, "p95": 0.0}
+            ordered = sorted(samples)
+            return {
+                "avg": round(sum(ordered) / len(ordered), 2),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            }
+
+        return {
+            "running": self._running,
+            "queued": sum(len(q) for q in self._queues.values()),
+            "users_waiting": len(self._queues),
+            "max_concurrent": self.max_concurrent,
+            "wait_seconds": _summary(self.wait_times),
+            "service_seconds": _summary(self.service_times),
+        }
+
+
+# مثيل عام واحد للاستخدام في جميع أنحاء البوت
+job_scheduler = JobScheduler(MAX_CONCURRENT_JOBS, SCHEDULER_AGING_BYTES)
@@ -0,0 +1,399 @@
+"""
+وحدة الحالة المشتركة: واجهة موحدة لتخزين الجلسات وعدادات المعدل والكاش
+Pluggable state backend: in-process memory or a shared Redis-protocol server
+
+كل الواجهات تنفّذ دفعة أوامر بصيغة Redis في رحلة واحدة (pipeline)، لذلك يكلّف
+كل تحديث من تلغرام رحلة واحدة على الأكثر للقراءة، والكتابات تُجمَّع في الخلفية.
+"""
+
+import abc
+import json
+import time
+import select
+import socket
+import asyncio
+import logging
+import threading
+from typing import Any, Optional
+from urllib.parse import urlsplit, unquote
+
+from config.settings import STATE_BACKEND_URL, STATE_KEY_PREFIX, STATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class StateError(Exception):
+    """فشل أمر أو اتصال بخادم الحالة المشتركة"""
+
+
+def _encode_arg(value: Any) -> str:
+    """تحويل وسيط أمر إلى نص (القيم المركبة تُخزَّن JSON)"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class StateBackend(abc.ABC):
+    """
+    الواجهة المشتركة: execute(commands) ينفّذ قائمة أوامر مثل ("HGETALL", key)
+    ويعيد نتائجها بالترتيب. shared=True يعني أن الحالة مشتركة بين عدة نسخ من البوت.
+    الدوال متزامنة ويجب استدعاؤها من خيط عامل وليس من حلقة الأحداث.
+    """
+    shared = False
+
+    @abc.abstractmethod
+    def execute(self, commands: list[tuple]) -> list:
+        """تنفيذ الأوامر بالترتيب وإرجاع نتائجها. Raises StateError."""
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """
+    تنفيذ داخل العملية لمجموعة الأوامر التي يستخدمها البوت.
+    هو السلوك الافتراضي (نسخة واحدة)، ويُستخدم أيضاً كخادم بديل محلي للاختبار.
+    """
+
+    def __init__(self):
+        self._data: dict[str, Any] = {}
+        self._expires: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def execute(self, commands: list[tuple]) -> list:
+        with self._lock:
+            return [self._run(cmd[0].upper(), [_encode_arg(a) for a in cmd[1:]]) for cmd in commands]
+
+    def _alive(self, key: str) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            del self._expires[key]
+        return key in self._data
+
+    def _run(self, name: str, args: list[str]):
+        if name == "PING":
+            return "PONG"
+        if name == "GET":
+            return self._data[args[0]] if self._alive(args[0]) else None
+        if name == "SET":
+            key, value = args[0], args[1]
+            self._data[key] = value
+            self._expires.pop(key, None)
+            options = [a.upper() for a in args[2:]]
+            if "EX" in options:
+                self._expires[key] = time.time() + int(args[2 + options.index("EX") + 1])
+            elif "PX" in options:
+                self._expires[key] = time.time() + int(args[2 + options.index("PX") + 1]) / 1000
+            return "OK"
+        if name == "DEL":
+            removed = 0
+            for key in args:
+                if self._alive(key):
+                    del self._data[key]
+                    self._expires.pop(key, None)
+                    removed += 1
+            return removed
+        if name in ("INCR", "DECR"):
+            key = args[0]
+            value = (int(self._data[key]) if self._alive(key) else 0) + (1 if name == "INCR" else -1)
+            self._data[key] = str(value)
+            return value
+        if name in ("EXPIRE", "PEXPIRE"):
+            if not self._alive(args[0]):
+                return 0
+            seconds = int(args[1]) / (1000 if name == "PEXPIRE" else 1)
+            self._expires[args[0]] = time.time() + seconds
+            return 1
+        if name == "PTTL":
+            if not self._alive(args[0]):
+                return -2
+            deadline = self._expires.get(args[0])
+            return -1 if deadline is None else int((deadline - time.time()) * 1000)
+        if name == "HGETALL":
+            if not self._alive(args[0]):
+                return {}
+            return dict(self._data[args[0]])
+        if name == "HSET":
+            key = args[0]
+            if not self._alive(key):
+                self._data[key] = {}
+            fields = self._data[key]
+            added = sum(1 for f in args[1::2] if f not in fields)
+            fields.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == "HDEL":
+            if not self._alive(args[0]):
+                return 0
+            fields = self._data[args[0]]
+            removed = sum(1 for f in args[1:] if fields.pop(f, None) is not None)
+            if not fields:
+                del self._data[args[0]]
+                self._expires.pop(args[0], None)
+            return removed
+        raise StateError(f"unsupported command {name}")
+
+
+# أوامر لا يتغير أثرها إذا نُفّذت مرتين (EXPIRE يمدد المهلة قليلاً فقط)
+_IDEMPOTENT_COMMANDS = frozenset((
+    "PING", "GET", "SET", "DEL", "EXPIRE", "PEXPIRE", "PTTL", "HGETALL", "HSET", "HDEL", "AUTH", "SELECT",
+))
+
+
+class RespBackend(StateBackend):
+    """
+    عميل خفيف لبروتوكول Redis (RESP) فوق TCP بدون مكتبات خارجية.
+    كل استدعاء لـ execute يرسل كل الأوامر دفعة واحدة ثم يقرأ كل الردود (رحلة واحدة).
+    """
+    shared = True
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None, timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._roundtrip(setup)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def execute(self, commands: list[tuple]) -> list:
+        if not commands:
+            return []
+        # إعادة الإرسال آمنة فقط إذا لم يتغير شيء بتكرار الأوامر (INCR يُحسب مرتين)
+        repeatable = all(cmd[0].upper() in _IDEMPOTENT_COMMANDS for cmd in commands)
+        with self._lock:
+            if self._sock is not None and not repeatable and self._closed_by_peer():
+                # اتصال أغلقه الخادم أثناء الخمول: استبداله قبل الكتابة بدلاً من الفشل بعدها
+                self._disconnect()
+            for attempt in (1, 2):
+                written = False
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    written = True
+                    self._send(commands)
+                    return self._read_replies(commands)
+                except (OSError, EOFError) as e:
+                    # انقطع الاتصال (إعادة تشغيل الخادم مثلاً): إعادة المحاولة مرة باتصال جديد،
+                    # إلا إذا ربما وصلت أوامر غير قابلة للتكرار إلى الخادم
+                    self._disconnect()
+                    if attempt == 2 or (written and not repeatable):
+                        raise StateError(f"state backend unreachable: {e}") from e
+
+    def _closed_by_peer(self) -> bool:
+        """هل أغلق الخادم الاتصال الخامل؟ (لا ردود معلقة، فأي بيانات مقروءة تعني الإغلاق)"""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            return bool(readable) and not self._sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def _roundtrip(self, commands: list[tuple]) -> list:
+        self._send(commands)
+        return self._read_replies(commands)
+
+    def _send(self, commands: list[tuple]):
+        payload = bytearray()
+        for cmd in commands:
+            args = [_encode_arg(a).encode("utf-8") for a in cmd]
+            payload += b"*%d\r\n" % len(args)
+            for arg in args:
+                payload += b"$%d\r\n%s\r\n" % (len(arg), arg)
+        self._sock.sendall(payload)
+
+    def _read_replies(self, commands: list[tuple]) -> list:
+        replies = [self._read_reply() for _ in commands]
+        for i, (cmd, reply) in enumerate(zip(commands, replies)):
+            if isinstance(reply, StateError):
+                raise StateError(f"{cmd[0]}: {reply}")
+            if cmd[0].upper() == "HGETALL" and isinstance(reply, list):
+                replies[i] = dict(zip(reply[::2], reply[1::2]))
+        return replies
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise EOFError("connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            return StateError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise StateError(f"invalid reply: {line!r}")
+
+
+def make_backend(url: str) -> StateBackend:
+    """
+    إنشاء الواجهة من رابط الإعدادات:
+    "" أو memory:// → داخل العملية، redis://[:password@]host:port/db → خادم مشترك
+    """
+    if not url or url.startswith("memory:"):
+        return MemoryBackend()
+    parts = urlsplit(url)
+    if parts.scheme != "redis":
+        raise ValueError(f"Unsupported STATE_BACKEND_URL scheme: {parts.scheme}")
+    db = int(parts.path.lstrip("/") or 0)
+    password = unquote(parts.password) if parts.password else None
+    return RespBackend(parts.hostname or "localhost", parts.port or 6379, db, password)
+
+
+def state_key(*parts) -> str:
+    """مفتاح موحد مع بادئة البوت: dlbot:kind:id"""
+    return STATE_KEY_PREFIX + ":".join(str(p) for p in parts)
+
+
+class WriteBehind:
+    """
+    تجميع الكتابات إلى الواجهة المشتركة وإرسالها في رحلة واحدة دورياً.
+    الكتابات لنفس المفتاح تُدمج (آخر قيمة فقط) وتُرسل بترتيب آخر كتابة لكل مفتاح.
+    """
+
+    def __init__(self, backend: StateBackend, interval: float = STATE_FLUSH_INTERVAL):
+        self.backend = backend
+        self.interval = interval
+        # {key: [commands]}
+        self._pending: dict[str, list[tuple]] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self.flushes = 0
+        self.failures = 0
+
+    def queue(self, key: str, commands: list[tuple]):
+        # نقل المفتاح إلى النهاية حتى تبقى الكتابات المرتبطة (حذف ثم تحديث حقل) بترتيبها
+        self._pending.pop(key, None)
+        self._pending[key] = commands
+        if self._wake is not None:
+            self._wake.set()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        commands = [cmd for cmds in pending.values() for cmd in cmds]
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.backend.execute, commands)
+            self.flushes += 1
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"State write-behind flush failed ({len(commands)} commands): {e}")
+            for key, cmds in pending.items():
+                self._pending.setdefault(key, cmds)
+
+    async def run(self):
+        """مهمة خلفية: انتظار أول كتابة ثم إرسال كل ما تجمّع خلال interval"""
+        self._wake = asyncio.Event()
+        while True:
+            await self._wake.wait()
+            await asyncio.sleep(self.interval)
+            self._wake.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "flushes": self.flushes, "failures": self.failures}
+
+
+# الواجهة المشتركة لكل البوت
+state_backend = make_backend(STATE_BACKEND_URL)
+state_writer = WriteBehind(state_backend)
+
+
+async def run_query(commands: list[tuple]) -> list:
+    """تنفيذ دفعة أوامر في خيط عامل (رحلة واحدة)"""
+    return await asyncio.get_running_loop().run_in_executor(None, state_backend.execute, commands)
+
+
+# ===== خادم بديل محلي (للتطوير والاختبار بدون Redis) =====
+
+async def serve_standin(host: str = "127.0.0.1", port: int = 6399, backend: Optional[MemoryBackend] = None):
+    """
+    خادم صغير يتحدث بروتوكول RESP ويخزن في MemoryBackend.
+    يكفي لتشغيل عدة نسخ من البوت محلياً بـ STATE_BACKEND_URL=redis://127.0.0.1:6399
+    """
+    backend = backend or MemoryBackend()
+
+    def _encode_reply(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, StateError):
+            return b"-ERR %s\r\n" % str(value).encode("utf-8")
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, dict):
+            items = [x for pair in value.items() for x in pair]
+            return b"*%d\r\n" % len(items) + b"".join(_encode_reply(i) for i in items)
+        data = str(value).encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                count = int(line[1:-2])
+                args = []
+                for _ in range(count):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode("utf-8"))
+                if args[0].upper() in ("AUTH", "SELECT"):
+                    writer.write(b"+OK\r\n")
+                    continue
+                try:
+                    result = backend.execute([tuple(args)])[0]
+                except StateError as e:
+                    result = e
+                writer.write(_encode_reply(result))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info(f"State stand-in listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve_standin(port=int(sys.argv[1]) if len(sys.argv) > 1 else 6399))
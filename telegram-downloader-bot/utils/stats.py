@@ -0,0 +1,76 @@
+"""
+لقطة واحدة لإحصائيات مكونات البوت (المجمّعات، المجدول، القرص، الكاش، الطوابير...)
+لأمر /stats للمشرفين ولسطر السجل الدوري
+Runtime statistics snapshot for the admin /stats command and periodic logging
+"""
+
+import json
+import asyncio
+import logging
+
+from utils.workers import pool_stats
+from utils.downloader import postprocess_stats
+from utils.scheduler import job_scheduler
+from utils.disk import disk_manager
+from utils.user_manager import session_store
+from utils.cache import metadata_cache, media_info_cache, file_id_cache
+from utils.rate_limiter import rate_limiter
+from utils.prefs import prefs_store
+from utils.state import state_backend, state_writer
+from utils.job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+
+def collect_stats(application=None) -> dict:
+    """
+    جمع إحصائيات كل المكونات في قاموس واحد.
+    application (اختياري) يضيف إحصائيات معالج التحديثات وخادم Webhook.
+    """
+    stats = {
+        "pools": {pool["name"]: pool for pool in pool_stats()},
+        "postprocess": postprocess_stats(),
+        "scheduler": job_scheduler.stats(),
+        "disk": disk_manager.stats(),
+        "sessions": session_store.stats(),
+        "caches": {
+            "metadata": metadata_cache.stats(),
+            "media_info": media_info_cache.stats(),
+            "file_id": file_id_cache.stats(),
+        },
+        "rate_limiter": rate_limiter.stats(),
+        "prefs": prefs_store.stats(),
+    }
+    if state_backend.shared:
+        stats["state_writer"] = state_writer.stats()
+    if job_queue.enabled:
+        stats["job_queue"] = job_queue.stats()
+    if application is not None:
+        processor = getattr(application, "update_processor", None)
+        if hasattr(processor, "stats"):
+            stats["updates"] = processor.stats()
+        webhook = application.bot_data.get("webhook_server")
+        if webhook is not None:
+            stats["webhook"] = webhook.stats()
+    return stats
+
+
+def format_stats(stats: dict, limit: int = 4000) -> str:
+    """سطر JSON مضغوط لكل مكون داخل كتلة كود، مقصوصاً إلى حد رسالة تلغرام"""
+    text = "\n".join(
+        f"{name}: {json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)}"
+        for name, value in stats.items()
+    )
+    if len(text) > limit:
+        text = text[:limit] + "\n…"
+    return f"```\n{text}\n```"
+
+
+async def run_stats_logger(application, interval: float):
+    """مهمة خلفية: تسجيل لقطة الإحصائيات في السجل كل interval ثانية"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            logger.info(f"Stats: {json.dumps(collect_stats(application), ensure_ascii=False, default=str)}")
+        except Exception as e:
+            logger.error(f"Collecting stats failed: {e}")
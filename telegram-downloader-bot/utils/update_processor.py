@@ -0,0 +1,120 @@
+"""
+وحدة معالجة التحديثات بالتوازي مع الحفاظ على الترتيب داخل كل محادثة
+Concurrent update processing with per-chat ordering
+"""
+
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# تحرير دور المحادثة للتحديث الجاري (يُضبط في process_update لكل تحديث)
+_lane_release: ContextVar[Optional[Callable[[], None]]] = ContextVar("lane_release", default=None)
+
+
+def release_chat_lane():
+    """
+    إنهاء الجزء الحساس للترتيب من التحديث الجاري: التحديث التالي لنفس المحادثة يبدأ
+    الآن بدلاً من انتظار نهاية المعالج (مثل تحميل طويل بعد تسجيل الطلب في الجلسة).
+    لا يفعل شيئاً خارج PerChatUpdateProcessor أو إذا حُرر الدور مسبقاً.
+    """
+    release = _lane_release.get()
+    if release is not None:
+        release()
+
+
+class _ChatLane:
+    """قفل محادثة واحدة مع عدد التحديثات التي تستخدمه (يُحذف عند الوصول إلى صفر)"""
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    معالجة حتى max_concurrent_updates تحديثاً في نفس الوقت، لكن تحديثات نفس المحادثة
+    (أو نفس المستخدم إذا لم توجد محادثة) تُعالج واحداً تلو الآخر بترتيب وصولها.
+    بذلك لا يسبق زرُّ اختيار الجودة تخزينَ معلومات الفيديو من رسالة نفس المستخدم،
+    ولا يؤخر رفعٌ بطيء في محادثة ما بقيةَ المستخدمين.
+    التحديثات التي يقبلها skip_lane(update) (مثل الإلغاء) تُعالج فوراً بلا انتظار.
+    المعالج الذي ينتهي جزؤه الحساس للترتيب مبكراً يحرر الدور بـ release_chat_lane()
+    ويكمل عمله الطويل (التحميل والرفع) دون حجز المحادثة.
+    """
+
+    def __init__(self, max_concurrent_updates: int, skip_lane: Optional[Callable[[object], bool]] = None):
+        super().__init__(max_concurrent_updates)
+        self._lanes: dict[int, _ChatLane] = {}
+        self._skip_lane = skip_lane
+        self.skipped = 0
+
+    @staticmethod
+    def _lane_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable):
+        if self._skip_lane and self._skip_lane(update):
+            # تحديث خفيف وعاجل: لا ينتظر دور المحادثة ولا مكاناً من الحد العام
+            # (الأماكن قد تكون كلها محجوزة بالتحميلات التي يريد إلغاءها)
+            self.skipped += 1
+            await self.do_process_update(update, coroutine)
+            return
+
+        key = self._lane_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _ChatLane()
+        lane.users += 1
+        released = False
+
+        def _release():
+            nonlocal released
+            if not released:
+                released = True
+                lane.lock.release()
+
+        try:
+            # انتظار دور المحادثة أولاً، ثم حجز مكان من الحد العام، حتى لا تحجز
+            # تحديثات محادثة واحدة المنتظرة أماكن المحادثات الأخرى
+            await lane.lock.acquire()
+            token = _lane_release.set(_release)
+            try:
+                await super().process_update(update, coroutine)
+            finally:
+                _lane_release.reset(token)
+                _release()
+        finally:
+            lane.users -= 1
+            if lane.users == 0:
+                del self._lanes[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent_updates": self.max_concurrent_updates,
+            "active_chats": len(self._lanes),
+            "skipped_lane": self.skipped,
+        }
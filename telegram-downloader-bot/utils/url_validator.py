@@ -4,7 +4,7 @@ URL validation and platform detection module
 """
 
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 from config.settings import SUPPORTED_PLATFORMS
 
 
@@ -61,6 +61,12 @@ def detect_platform(url: str) -> str:
     return "Unknown"
 
 
+def platform_id(url: str) -> str:
+    """معرّف قصير للمنصة (مثل youtube أو instagram) لاستخدامه في حدود التزامن"""
+    name = detect_platform(url)
+    return re.split(r"[ /]", name)[0].lower()
+
+
 def extract_url_from_text(text: str) -> str | None:
     """استخراج أول رابط من النص"""
     url_pattern = re.compile(
@@ -81,3 +87,46 @@ def clean_url(url: str) -> str:
         if "youtu.be" in parsed.netloc:
             return url.split("?")[0]  # روابط youtu.be لا تحتاج معاملات
     return url
+
+
+# أنماط استخراج المعرّف الفريد للوسائط من الرابط: (المنصة، النطاق، النمط)
+_MEDIA_ID_PATTERNS = [
+    ("youtube", "youtu.be", re.compile(r"^/([\w-]{11})")),
+    ("youtube", "youtube.com", re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{11})")),
+    ("tiktok", "tiktok.com", re.compile(r"/video/(\d+)")),
+    ("instagram", "instagram.com", re.compile(r"^/(?:[\w.]+/)?(?:p|reel|reels|tv)/([\w-]+)")),
+    ("instagram_story", "instagram.com", re.compile(r"^/stories/[\w.]+/(\d+)")),
+    ("twitter", "twitter.com", re.compile(r"/status/(\d+)")),
+    ("twitter", "x.com", re.compile(r"/status/(\d+)")),
+    ("vimeo", "vimeo.com", re.compile(r"^/(?:video/)?(\d+)")),
+    ("dailymotion", "dailymotion.com", re.compile(r"^/video/([a-z0-9]+)", re.IGNORECASE)),
+]
+
+
+def media_key(url: str) -> str:
+    """
+    المعرّف الموحد للوسائط (مثل youtube:dQw4w9WgXcQ) لاستخدامه كمفتاح للكاش.
+    روابط مختلفة لنفس الفيديو تعطي نفس المفتاح.
+    """
+    parsed = urlparse(url.strip())
+    domain = parsed.netloc.lower()
+    if domain.startswith("www.") or domain.startswith("m."):
+        domain = domain.split(".", 1)[1]
+    path = parsed.path or "/"
+
+    if domain.endswith("youtube.com") and path == "/watch":
+        video_id = parse_qs(parsed.query).get("v", [None])[0]
+        if video_id:
+            return f"youtube:{video_id}"
+
+    for platform, host, pattern in _MEDIA_ID_PATTERNS:
+        if domain == host or domain.endswith("." + host):
+            match = pattern.search(path)
+            if match:
+                return f"{platform}:{match.group(1)}"
+
+    # احتياطي: الرابط نفسه بعد توحيد النطاق والمسار
+    normalized = f"{domain}{path.rstrip('/')}"
+    if parsed.query:
+        normalized += f"?{parsed.query}"
+    return f"url:{normalized}"
@@ -1,84 +1,341 @@
 """
-وحدة إدارة بيانات المستخدمين (اللغة والحالة في الذاكرة)
-In-memory user data management (language, state)
+وحدة إدارة بيانات المستخدمين (اللغة والحالة في الذاكرة، والتفضيلات محفوظة على القرص)
+User data management (in-memory state, persisted preferences)
+
+عند استخدام خادم حالة مشترك (STATE_BACKEND_URL) تصبح الذاكرة نسخة محلية فقط:
+تُحدَّث من الخادم في بداية كل تحديث (رحلة واحدة) وتُكتب التغييرات إليه في الخلفية.
 """
 
+import sys
+import json
+import time
+import asyncio
 import logging
-from config.settings import DEFAULT_LANGUAGE
+from collections import OrderedDict
+
+from config.settings import (
+    DEFAULT_LANGUAGE, SESSION_TTL, SESSION_MAX_ENTRIES,
+    USER_RECORD_TTL, USER_MAX_ENTRIES, SESSION_SWEEP_INTERVAL,
+)
+from utils.prefs import prefs_store
+from utils.state import StateError, state_backend, state_writer, state_key, run_query
+from utils.rate_limiter import rate_limiter
 
 logger = logging.getLogger(__name__)
 
-# تخزين بيانات المستخدمين في الذاكرة
-# {user_id: {"lang": "ar", "state": "idle", "current_url": None, "video_info": None}}
-_user_data: dict[int, dict] = {}
+
+class _UserRecord:
+    """سجل دائم نسبياً لكل مستخدم: اللغة وعدد التحميلات (نسخة من المحفوظ على القرص)"""
+    __slots__ = ("lang", "downloads", "last_seen")
+
+    def __init__(self, lang: str, downloads: int = 0):
+        self.lang = lang
+        self.downloads = downloads
+        self.last_seen = time.monotonic()
+
+
+_RECORD_SIZE = sys.getsizeof(_UserRecord(DEFAULT_LANGUAGE))
+
+
+class _Session:
+    """جلسة قصيرة العمر: الحالة والرابط ومعلومات الفيديو المعروضة في قائمة الجودات"""
+    __slots__ = ("state", "current_url", "video_info", "size", "last_seen")
+
+    def __init__(self):
+        self.state = "idle"
+        self.current_url = None
+        self.video_info = None
+        self.size = sys.getsizeof(self)
+        self.last_seen = time.monotonic()
+
+
+def _approx_size(value) -> int:
+    """حجم تقريبي سطحي (القوائم المشتركة بين المستخدمين لا تُحسب مرة أخرى)"""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+    return sys.getsizeof(value) if value is not None else 0
+
+
+class SessionStore:
+    """
+    مخزن جلسات محدود ومنتهي الصلاحية:
+    - سجلات بـ __slots__ لكل مستخدم
+    - الجلسات الخاملة تنتهي بعد SESSION_TTL فتُحرَّر معلومات الفيديو للقوائم المهجورة
+    - سجلات اللغة تنتهي بعد USER_RECORD_TTL من عدم النشاط
+    - حد أقصى لعدد العناصر مع إخلاء الأقدم استخداماً (LRU)
+    ترتيب OrderedDict هو ترتيب آخر استخدام، لذا التنظيف يبدأ من الأقدم ويتوقف عند
+    أول عنصر صالح بدلاً من فحص القاموس بالكامل.
+    """
+
+    def __init__(
+        self,
+        session_ttl: float = SESSION_TTL,
+        max_sessions: int = SESSION_MAX_ENTRIES,
+        record_ttl: float = USER_RECORD_TTL,
+        max_records: int = USER_MAX_ENTRIES,
+    ):
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.record_ttl = record_ttl
+        self.max_records = max_records
+        self._records: OrderedDict[int, _UserRecord] = OrderedDict()
+        self._sessions: OrderedDict[int, _Session] = OrderedDict()
+        self._session_bytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    # ===== السجلات (اللغة) =====
+
+    def record(self, user_id: int, create: bool = False) -> _UserRecord | None:
+        """سجل المستخدم مع تحديث وقت آخر استخدام. Returns None if missing and not create."""
+        rec = self._records.get(user_id)
+        now = time.monotonic()
+        if rec is not None and now - rec.last_seen > self.record_ttl:
+            del self._records[user_id]
+            self.expired += 1
+            rec = None
+        if rec is None:
+            if not create:
+                return None
+            rec = self._records[user_id] = _UserRecord(DEFAULT_LANGUAGE)
+            while len(self._records) > self.max_records:
+                self._records.popitem(last=False)
+                self.evicted += 1
+        rec.last_seen = now
+        self._records.move_to_end(user_id)
+        return rec
+
+    # ===== الجلسات =====
+
+    def session(self, user_id: int, create: bool = False) -> _Session | None:
+        """جلسة المستخدم الحالية مع تحديث وقت آخر استخدام"""
+        sess = self._sessions.get(user_id)
+        now = time.monotonic()
+        if sess is not None and now - sess.last_seen > self.session_ttl:
+            self._drop_session(user_id)
+            self.expired += 1
+            sess = None
+        if sess is None:
+            if not create:
+                return None
+            sess = self._sessions[user_id] = _Session()
+            self._session_bytes += sess.size
+            while len(self._sessions) > self.max_sessions:
+                self._drop_session(next(iter(self._sessions)))
+                self.evicted += 1
+        sess.last_seen = now
+        self._sessions.move_to_end(user_id)
+        return sess
+
+    def set_video_info(self, user_id: int, info: dict | None):
+        sess = self.session(user_id, create=True)
+        new_size = sys.getsizeof(sess) + _approx_size(sess.current_url) + _approx_size(info)
+        self._session_bytes += new_size - sess.size
+        sess.size = new_size
+        sess.video_info = info
+
+    def clear_session(self, user_id: int):
+        if user_id in self._sessions:
+            self._drop_session(user_id)
+
+    def _drop_session(self, user_id: int):
+        sess = self._sessions.pop(user_id)
+        self._session_bytes -= sess.size
+
+    # ===== التنظيف =====
+
+    def sweep(self, limit: int = 1000) -> int:
+        """
+        حذف حتى limit عنصراً منتهي الصلاحية من بداية الترتيب (الأقدم استخداماً).
+        Returns number of removed entries.
+        """
+        now = time.monotonic()
+        removed = 0
+        while self._sessions and removed < limit:
+            user_id, sess = next(iter(self._sessions.items()))
+            if now - sess.last_seen <= self.session_ttl:
+                break
+            self._drop_session(user_id)
+            removed += 1
+        while self._records and removed < limit:
+            user_id, rec = next(iter(self._records.items()))
+            if now - rec.last_seen <= self.record_ttl:
+                break
+            del self._records[user_id]
+            removed += 1
+        self.expired += removed
+        return removed
+
+    async def run_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL, batch: int = 1000):
+        """مهمة خلفية: تنظيف دوري على دفعات صغيرة مع ترك الحلقة للمعالجات بين الدفعات"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                while self.sweep(batch) >= batch:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._records),
+            "sessions": len(self._sessions),
+            "approx_bytes": self._session_bytes + len(self._records) * _RECORD_SIZE,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+# مخزن الجلسات المشترك
+session_store = SessionStore()
+
+
+async def load_user(user_id: int, count_request: bool = False):
+    """
+    تحميل تفضيلات المستخدم المحفوظة إلى الذاكرة عند أول تحديث منه (أو بعد انتهاء سجله)،
+    حتى تبقى دوال القراءة التالية متزامنة ولا تلمس القرص.
+    count_request: احتساب هذا التحديث في حد معدل الطلبات (للخادم المشترك).
+    """
+    if state_backend.shared:
+        await _load_shared(user_id, count_request)
+        return
+    if session_store.record(user_id) is not None:
+        return
+    saved = await prefs_store.load(user_id)
+    rec = session_store.record(user_id, create=True)
+    if saved:
+        lang, downloads = saved
+        rec.lang = lang or DEFAULT_LANGUAGE
+        rec.downloads = downloads or 0
+
+
+async def _load_shared(user_id: int, count_request: bool):
+    """جلب السجل والجلسة (وعدادات المعدل) من الخادم المشترك في رحلة واحدة"""
+    user_key, session_key = state_key("user", user_id), state_key("session", user_id)
+    commands = [("HGETALL", user_key), ("HGETALL", session_key)]
+    if count_request:
+        commands += rate_limiter.shared_commands(user_id)
+    try:
+        results = await run_query(commands)
+    except StateError as e:
+        # الاستمرار بالنسخة المحلية بدلاً من تعطيل البوت
+        logger.error(f"Failed to load shared state for user {user_id}: {e}")
+        return
+
+    saved, session = results[0], results[1]
+    rec = session_store.record(user_id, create=True)
+    rec.lang = saved.get("lang") or rec.lang
+    rec.downloads = int(saved.get("downloads") or rec.downloads)
+
+    if session:
+        sess = session_store.session(user_id, create=True)
+        sess.state = session.get("state", "idle")
+        sess.current_url = session.get("url")
+        video_info = session.get("video_info")
+        session_store.set_video_info(user_id, json.loads(video_info) if video_info else None)
+    else:
+        session_store.clear_session(user_id)
+
+    if count_request:
+        rate_limiter.prime(user_id, results[2:])
+
+
+def _persist_user(user_id: int, rec: _UserRecord):
+    """حفظ السجل: في الخادم المشترك إن وُجد، وإلا في قاعدة التفضيلات المحلية"""
+    if state_backend.shared:
+        key = state_key("user", user_id)
+        state_writer.queue(key, [("HSET", key, "lang", rec.lang, "downloads", rec.downloads)])
+    else:
+        prefs_store.save(user_id, rec.lang, rec.downloads)
+
+
+def _persist_session(user_id: int, field: str | None = None):
+    """
+    نسخ حقل الجلسة الذي تغيّر (state أو url أو video_info) إلى الخادم المشترك،
+    فلا تُعاد كتابة video_info الكبيرة مع كل تغيير للحالة. field=None بعد مسح الجلسة.
+    لا شيء في وضع الذاكرة.
+    """
+    if not state_backend.shared:
+        return
+    key = state_key("session", user_id)
+    sess = session_store.session(user_id)
+    if sess is None:
+        state_writer.queue(key, [("DEL", key)])
+        return
+    value = {"state": sess.state, "url": sess.current_url, "video_info": sess.video_info}[field]
+    if value is None:
+        command = ("HDEL", key, field)
+    else:
+        command = ("HSET", key, field, value)
+    # مفتاح مستقل لكل حقل: كتابات الحقول المختلفة لا تستبدل بعضها في WriteBehind
+    state_writer.queue(f"{key}#{field}", [command, ("EXPIRE", key, SESSION_TTL)])
 
 
 def get_user_lang(user_id: int) -> str:
     """الحصول على لغة المستخدم"""
-    return _user_data.get(user_id, {}).get("lang", DEFAULT_LANGUAGE)
+    rec = session_store.record(user_id)
+    return rec.lang if rec else DEFAULT_LANGUAGE
 
 
 def set_user_lang(user_id: int, lang: str):
     """تعيين لغة المستخدم"""
-    if user_id not in _user_data:
-        _user_data[user_id] = {}
-    _user_data[user_id]["lang"] = lang
+    rec = session_store.record(user_id, create=True)
+    rec.lang = lang
+    _persist_user(user_id, rec)
     logger.info(f"User {user_id} language set to: {lang}")
 
 
+def increment_user_downloads(user_id: int):
+    """زيادة عداد التحميلات الناجحة للمستخدم"""
+    rec = session_store.record(user_id, create=True)
+    rec.downloads += 1
+    _persist_user(user_id, rec)
+
+
 def get_user_state(user_id: int) -> str:
     """الحصول على حالة المستخدم الحالية"""
-    return _user_data.get(user_id, {}).get("state", "idle")
+    sess = session_store.session(user_id)
+    return sess.state if sess else "idle"
 
 
 def set_user_state(user_id: int, state: str):
     """تعيين حالة المستخدم"""
-    if user_id not in _user_data:
-        _user_data[user_id] = {}
-    _user_data[user_id]["state"] = state
+    session_store.session(user_id, create=True).state = state
+    _persist_session(user_id, "state")
 
 
 def get_user_url(user_id: int) -> str | None:
     """الحصول على الرابط الحالي للمستخدم"""
-    return _user_data.get(user_id, {}).get("current_url")
+    sess = session_store.session(user_id)
+    return sess.current_url if sess else None
 
 
 def set_user_url(user_id: int, url: str):
     """تعيين الرابط الحالي للمستخدم"""
-    if user_id not in _user_data:
-        _user_data[user_id] = {}
-    _user_data[user_id]["current_url"] = url
+    session_store.session(user_id, create=True).current_url = url
+    _persist_session(user_id, "url")
 
 
 def get_user_video_info(user_id: int) -> dict | None:
     """الحصول على معلومات الفيديو المخزنة للمستخدم"""
-    return _user_data.get(user_id, {}).get("video_info")
+    sess = session_store.session(user_id)
+    return sess.video_info if sess else None
 
 
 def set_user_video_info(user_id: int, info: dict):
     """تخزين معلومات الفيديو للمستخدم"""
-    if user_id not in _user_data:
-        _user_data[user_id] = {}
-    _user_data[user_id]["video_info"] = info
+    session_store.set_video_info(user_id, info)
+    _persist_session(user_id, "video_info")
 
 
 def clear_user_session(user_id: int):
     """مسح جلسة المستخدم الحالية (مع الاحتفاظ باللغة)"""
-    lang = get_user_lang(user_id)
-    _user_data[user_id] = {
-        "lang": lang,
-        "state": "idle",
-        "current_url": None,
-        "video_info": None,
-    }
+    session_store.clear_session(user_id)
+    _persist_session(user_id)
 
 
 def init_user(user_id: int, lang: str = None):
     """تهيئة بيانات مستخدم جديد"""
-    if user_id not in _user_data:
-        _user_data[user_id] = {
-            "lang": lang or DEFAULT_LANGUAGE,
-            "state": "idle",
-            "current_url": None,
-            "video_info": None,
-        }
+    rec = session_store.record(user_id)
+    if rec is None:
+        session_store.record(user_id, create=True).lang = lang or DEFAULT_LANGUAGE
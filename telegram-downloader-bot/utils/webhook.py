@@ -0,0 +1,161 @@
+"""
+وحدة وضع Webhook: خادم HTTP صغير غير متزامن يستقبل التحديثات من تلغرام
+Embedded asyncio HTTP server for webhook mode (no extra dependencies)
+
+- POST على WEBHOOK_PATH: التحقق من رأس X-Telegram-Bot-Api-Secret-Token ثم إدخال
+  التحديث في طابور التطبيق
+- GET على WEBHOOK_READY_PATH: ‏200 عندما يكون التطبيق جاهزاً (لموازن الأحمال)
+يمكن اختباره محلياً بإرسال تحديث JSON مصطنع عبر curl مع نفس الرأس السري.
+"""
+
+import hmac
+import json
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# أقصى حجم لجسم الطلب (التحديثات أصغر بكثير)
+MAX_BODY_BYTES = 1024 * 1024
+KEEPALIVE_TIMEOUT = 30
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable",
+}
+
+
+def derive_secret_token(bot_token: str) -> str:
+    """رمز سري ثابت مشتق من توكن البوت (نفس القيمة في كل النسخ) عند عدم تحديد WEBHOOK_SECRET"""
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()[:48]
+
+
+class WebhookServer:
+    """خادم HTTP/1.1 بسيط (مع keep-alive) يوصل التحديثات إلى update_queue في التطبيق"""
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str,
+        port: int,
+        path: str,
+        secret_token: str,
+        max_connections: int,
+        ready_path: str,
+    ):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self.ready_path = ready_path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._active = 0
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        logger.info(f"Webhook server listening on {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._active >= self.max_connections:
+            # تجاوز حد الاتصالات: رفض فوري بدلاً من تكديس الطلبات
+            self.rejected += 1
+            writer.write(self._response(503, close=True))
+            await self._close(writer)
+            return
+
+        self._active += 1
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY_BYTES:
+                    writer.write(self._response(413, close=True))
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._dispatch(method, target.split("?", 1)[0], headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(self._response(status, payload, close=not keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._active -= 1
+            await self._close(writer)
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, bytes]:
+        if path == self.ready_path:
+            if method != "GET":
+                return 405, b""
+            return (200, b"ok") if self.application.running else (503, b"starting")
+
+        if path != self.path:
+            return 404, b""
+        if method != "POST":
+            return 405, b""
+
+        token = headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logger.warning("Webhook request with invalid secret token rejected")
+            return 403, b""
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Invalid webhook payload: {e}")
+            return 400, b""
+        if update is None:
+            return 400, b""
+
+        await self.application.update_queue.put(update)
+        self.received += 1
+        return 200, b""
+
+    @staticmethod
+    def _response(status: int, payload: bytes = b"", close: bool = False) -> bytes:
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Content-Type: text/plain\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        return head.encode("latin-1") + payload
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def stats(self) -> dict:
+        return {"active_connections": self._active, "received": self.received, "rejected": self.rejected}
@@ -0,0 +1,256 @@
+"""
+مجمّعات عمل منفصلة ومحدودة لجلب المعلومات والتحميل والمعالجة بـ ffmpeg
+Dedicated bounded worker pools for extraction, download and transcode
+"""
+
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from config.settings import (
+    EXTRACT_WORKERS, EXTRACT_QUEUE_SIZE, EXTRACT_PLATFORM_LIMITS,
+    DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, DOWNLOAD_PLATFORM_LIMITS,
+    TRANSCODE_WORKERS, TRANSCODE_QUEUE_SIZE, TRANSCODE_PLATFORM_LIMITS,
+    PROBE_WORKERS, PROBE_QUEUE_SIZE,
+    EXECUTION_MODE, EXTRACT_TIMEOUT, DOWNLOAD_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolBusyError(Exception):
+    """الطابور ممتلئ — تم رفض المهمة بدلاً من انتظار غير محدود"""
+
+
+class JobTimeoutError(Exception):
+    """تجاوزت المهمة مهلتها وتم إنهاء العملية المنفذة لها"""
+
+
+def process_context():
+    """سياق multiprocessing للعمليات الفرعية: forkserver يتجنب نسخ حالة الخيوط من العملية الرئيسية"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        # yt-dlp يُستورد مرة واحدة في خادم التفرع فلا تدفع كل عملية مهمة ثمن استيراده
+        context.set_forkserver_preload(["yt_dlp"])
+    return context
+
+
+def _process_entry(conn, func: Callable, args: tuple):
+    """نقطة دخول عملية المهمة: تنفيذ الدالة وإرسال ("ok", النتيجة) أو ("error", الاستثناء)"""
+    try:
+        message = ("ok", func(*args))
+    except BaseException as e:
+        message = ("error", e)
+    try:
+        conn.send(message)
+    except Exception as e:
+        # نتيجة أو استثناء غير قابل للتسلسل
+        conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+    finally:
+        conn.close()
+
+
+class WorkerPool:
+    """
+    مجمّع عمال بحجم ثابت (خيوط أو عمليات) مع:
+    - حد أقصى للمهام المنتظرة (يتم رفض ما يزيد عنه بـ PoolBusyError)
+    - حد للتزامن لكل منصة لحماية المستخرجات الحساسة
+    - عدادات لعمق الطابور والمهام الجارية
+
+    في وضع العمليات تعمل كل مهمة في عملية خاصة بها (بحد max_workers عملية)، ويجب أن تكون
+    الدالة ووسائطها ونتيجتها قابلة للتسلسل (pickle). المهمة التي تتجاوز مهلتها تُنهى
+    عمليتها وحدها بالقوة دون التأثير على البوت أو المهام الأخرى.
+    في وضع الخيوط لا تُطبق المهلة (timeout) لأن الخيط العالق لا يمكن إيقافه.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        max_queue: int,
+        platform_limits: dict[str, int],
+        use_processes: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.platform_limits = platform_limits
+        self.uses_processes = use_processes
+        self.timeout = timeout
+        self._executor = self._make_executor()
+        # وضع العمليات: عملية لكل مهمة، بحد max_workers عملية في نفس الوقت
+        self._process_slots = asyncio.Semaphore(max_workers)
+        self._processes: set = set()
+        self._platform_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._pending = 0     # جميع المهام المقبولة (منتظرة + جارية)
+        self._submitted = 0   # المهام التي سُلّمت للمنفّذ
+        self.completed = 0
+        self.rejected = 0
+        self.killed = 0       # عمليات مهام أُنهيت بالقوة (مهلة أو إلغاء)
+
+    def _make_executor(self) -> Optional[Executor]:
+        if self.uses_processes:
+            return None
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{self.name}-worker")
+
+    @property
+    def running(self) -> int:
+        """عدد المهام التي تعمل حالياً"""
+        return min(self._submitted, self.max_workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """عدد المهام التي تنتظر عاملاً حراً"""
+        return max(0, self._pending - self.running)
+
+    def _platform_semaphore(self, platform: Optional[str]) -> Optional[asyncio.Semaphore]:
+        limit = self.platform_limits.get(platform or "")
+        if not limit:
+            return None
+        if platform not in self._platform_semaphores:
+            self._platform_semaphores[platform] = asyncio.Semaphore(limit)
+        return self._platform_semaphores[platform]
+
+    async def run(
+        self, func: Callable, *args, platform: Optional[str] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ):
+        """
+        تنفيذ دالة متزامنة في المجمّع وانتظار نتيجتها.
+        cancel_event: حدث تراقبه الدالة نفسها، يُضبط عند إلغاء المنتظر. في وضع الخيوط
+        يبقى مكان المهمة محجوزاً حتى تلاحظه الدالة وتتوقف، فلا يتجاوز المجمّع حده.
+        """
+        if self._pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Pool '{self.name}' is full ({self._pending} pending), rejecting job")
+            raise PoolBusyError(f"{self.name} pool is full")
+
+        self._pending += 1
+        try:
+            semaphore = self._platform_semaphore(platform)
+            if semaphore is None:
+                return await self._submit(func, args, cancel_event)
+            async with semaphore:
+                return await self._submit(func, args, cancel_event)
+        finally:
+            self._pending -= 1
+
+    async def _submit(self, func: Callable, args: tuple, cancel_event: Optional[threading.Event] = None):
+        self._submitted += 1
+        try:
+            if self.uses_processes:
+                async with self._process_slots:
+                    return await self._run_in_process(func, args)
+            # لا مهلة في وضع الخيوط: لا يمكن إيقاف خيط عالق من الخارج
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            if cancel_event is None:
+                return await future
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancel_event.set()
+                await asyncio.wait({future})
+                if not future.cancelled():
+                    future.exception()
+                raise
+        finally:
+            self._submitted -= 1
+            self.completed += 1
+
+    async def _run_in_process(self, func: Callable, args: tuple):
+        """
+        تنفيذ المهمة في عملية خاصة بها تعيد النتيجة عبر أنبوب. عند تجاوز المهلة
+        أو إلغاء المنتظر تُنهى هذه العملية وحدها، ولا تتأثر المهام الأخرى الجارية.
+        """
+        loop = asyncio.get_running_loop()
+        context = process_context()
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_process_entry, args=(writer, func, args), name=f"{self.name}-job", daemon=True,
+        )
+        process.start()
+        writer.close()
+        self._processes.add(process)
+        ready = loop.create_future()
+        loop.add_reader(reader.fileno(), lambda: ready.done() or ready.set_result(None))
+        status = None
+        try:
+            try:
+                await asyncio.wait_for(ready, self.timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Pool '{self.name}' job exceeded {self.timeout}s, killing its process {process.pid}")
+                raise JobTimeoutError(f"{self.name} job timeout after {self.timeout}s")
+            try:
+                status, value = reader.recv()
+            except EOFError:
+                process.join(1)
+                logger.error(f"Pool '{self.name}' job process crashed (exit code {process.exitcode})")
+                raise BrokenProcessPool(f"{self.name} job process exited with code {process.exitcode}")
+        finally:
+            loop.remove_reader(reader.fileno())
+            reader.close()
+            self._processes.discard(process)
+            if status is None and process.is_alive():
+                process.kill()
+                self.killed += 1
+            # جمع العملية دون انتظار (وإلا تُجمع عند بدء العملية التالية)
+            process.join(0)
+        if status == "error":
+            raise value
+        return value
+
+    def stats(self) -> dict:
+        """إحصائيات المجمّع"""
+        return {
+            "name": self.name,
+            "workers": self.max_workers,
+            "mode": "process" if self.uses_processes else "thread",
+            "running": self.running,
+            "queue_depth": self.queue_depth,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "killed": self.killed,
+        }
+
+    def shutdown(self):
+        """إيقاف المجمّع دون انتظار المهام الجارية"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        for process in list(self._processes):
+            process.kill()
+
+
+_use_processes = EXECUTION_MODE == "process"
+
+# مجمّع جلب المعلومات: مهام قصيرة، يجب ألا تنتظر خلف التحميلات الطويلة
+extract_pool = WorkerPool(
+    "extract", EXTRACT_WORKERS, EXTRACT_QUEUE_SIZE, EXTRACT_PLATFORM_LIMITS,
+    use_processes=_use_processes, timeout=EXTRACT_TIMEOUT,
+)
+# مجمّع التحميل عبر الشبكة: مهام طويلة مرتبطة بالإدخال/الإخراج
+download_pool = WorkerPool(
+    "download", DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, DOWNLOAD_PLATFORM_LIMITS,
+    use_processes=_use_processes, timeout=DOWNLOAD_TIMEOUT,
+)
+# مجمّع المعالجة بـ ffmpeg: ffmpeg يعمل أصلاً في عملية منفصلة، لذا تكفي الخيوط
+transcode_pool = WorkerPool("transcode", TRANSCODE_WORKERS, TRANSCODE_QUEUE_SIZE, TRANSCODE_PLATFORM_LIMITS)
+# مجمّع فحص الأحجام (طلبات HEAD/Range قصيرة): خيوط دائماً لأنه يستخدم مجمّع الاتصالات المشترك
+probe_pool = WorkerPool("probe", PROBE_WORKERS, PROBE_QUEUE_SIZE, {})
+
+
+def pool_stats() -> list[dict]:
+    """إحصائيات جميع المجمّعات"""
+    return [pool.stats() for pool in (extract_pool, download_pool, transcode_pool, probe_pool)]
+
+
+def shutdown_pools():
+    """إيقاف جميع المجمّعات عند إغلاق البوت"""
+    for pool in (extract_pool, download_pool, transcode_pool, probe_pool):
+        pool.shutdown()
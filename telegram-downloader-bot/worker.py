@@ -0,0 +1,180 @@
+"""
+عامل التحميل للوضع المنفصل: يسحب مهام جلب المعلومات والتحميل من طابور SQLite (JOB_QUEUE_PATH)،
+ينفذها (yt-dlp + ffmpeg) ويعيد النتائج والتقدم إلى البوت عبر نفس الطابور.
+Download worker process for the split frontend/worker mode
+
+الاستخدام:
+    python worker.py                  # عملية عامل واحدة
+    python worker.py --processes 4    # عدة عمليات على نفس الجهاز
+يجب أن يشترك البوت والعمال في نفس JOB_QUEUE_PATH ونفس DOWNLOAD_PATH.
+"""
+
+import os
+import sys
+import signal
+import socket
+import sqlite3
+import asyncio
+import logging
+import argparse
+import multiprocessing
+from pathlib import Path
+
+# إضافة مسار المشروع إلى sys.path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config.settings import DOWNLOAD_PATH, JOB_QUEUE_PATH, JOB_POLL_INTERVAL, WORKER_CONCURRENCY
+from utils.job_queue import job_queue, PROGRESS_KEYS
+from utils.downloader import run_download_job
+from utils.disk import disk_manager
+from utils.workers import shutdown_pools
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+logging.getLogger("yt_dlp").setLevel(logging.WARNING)
+
+logger = logging.getLogger("worker")
+
+# فترة تجديد الحجز ونشر التقدم بالثواني
+HEARTBEAT_INTERVAL = 1.0
+
+
+async def _execute(worker: str, job_id: int, kind: str, params: dict):
+    """تنفيذ مهمة واحدة مع تجديد حجزها ونشر تقدمها حتى تنتهي أو تُلغى"""
+    latest: dict = {}
+
+    def progress_hook(d: dict):
+        # يُستدعى من خيط التحميل: استبدال القيمة فقط، والإرسال من الحلقة
+        latest["progress"] = {key: d.get(key) for key in PROGRESS_KEYS}
+
+    logger.info(f"Job {job_id} ({kind}) started: {params.get('url')}")
+    task = asyncio.create_task(run_download_job(kind, params, progress_hook))
+    sent = None
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=HEARTBEAT_INTERVAL)
+            if done:
+                break
+            progress = latest.get("progress")
+            try:
+                alive = await job_queue.heartbeat(job_id, worker, progress if progress != sent else None)
+            except sqlite3.Error as e:
+                logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+                continue
+            sent = progress
+            if not alive:
+                # أُلغيت المهمة (أو انتقلت لعامل آخر بعد انتهاء الحجز)
+                logger.info(f"Job {job_id} was abandoned by the bot, stopping it")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await job_queue.discard(job_id)
+                return
+        result = task.result()
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        await job_queue.fail(job_id, worker, e)
+        return
+
+    if kind == "info":
+        paths = []
+    else:
+        paths = [result] if isinstance(result, str) else (result or [])
+    job_dirs = {os.path.dirname(path) for path in paths}
+    if await job_queue.complete(job_id, worker, result):
+        # المجلد أصبح ملك البوت، يحذفه بعد الإرسال
+        for job_dir in job_dirs:
+            disk_manager.detach(job_dir)
+        logger.info(f"Job {job_id} done: {len(paths)} file(s)" if kind != "info" else f"Job {job_id} done")
+    else:
+        for job_dir in job_dirs:
+            disk_manager.release(job_dir)
+        await job_queue.discard(job_id)
+        logger.info(f"Job {job_id} finished after it was abandoned, files removed")
+
+
+async def run_worker(name: str, concurrency: int):
+    """حلقة العامل: حجز المهام حتى concurrency مهمة متزامنة، وإنهاء الجارية قبل الخروج"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows
+            pass
+
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+    # تجديد حجوزات القرص المشتركة وتنظيف اليتيم منها (بدون التنظيف الفوري: عمليات أخرى تعمل)
+    janitor = asyncio.create_task(disk_manager.run_janitor(reap_on_start=False))
+    slots = asyncio.Semaphore(concurrency)
+    running: set[asyncio.Task] = set()
+    logger.info(f"Worker {name} started ({concurrency} concurrent jobs)")
+
+    def _finished(task: asyncio.Task):
+        running.discard(task)
+        slots.release()
+
+    while not stop_event.is_set():
+        await slots.acquire()
+        try:
+            job = await job_queue.claim(name)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to claim a job: {e}")
+            job = None
+        if job is None:
+            slots.release()
+            try:
+                await asyncio.wait_for(stop_event.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = asyncio.create_task(_execute(name, *job))
+        running.add(task)
+        task.add_done_callback(_finished)
+
+    logger.info(f"Worker {name} stopping, waiting for {len(running)} running job(s)")
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
+    janitor.cancel()
+    shutdown_pools()
+
+
+def _run_process(concurrency: int):
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    asyncio.run(run_worker(name, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download worker for the split bot mode")
+    parser.add_argument("--processes", type=int, default=1, help="عدد عمليات العمال على هذا الجهاز")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="مهام متزامنة لكل عملية")
+    args = parser.parse_args()
+
+    if not JOB_QUEUE_PATH:
+        logger.critical("❌ لم يتم تعيين JOB_QUEUE_PATH! العامل يحتاج نفس طابور المهام الذي يستخدمه البوت")
+        sys.exit(1)
+
+    if args.processes <= 1:
+        _run_process(args.concurrency)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_run_process, args=(args.concurrency,), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # Ctrl+C يصل لكل العمليات مباشرة؛ SIGTERM (مثل docker stop) يُمرَّر لها لتنهي مهامها الجارية
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()